@@ -1,190 +1,933 @@
+import sys
+import time
+import argparse
+import traceback
 import numpy as np
 import src.fileIO as io
 import src.filepaths as fp
 import src.analysis as anal
+import src.cache as cache
+import src.models as models
+import src.kernels as kernels
 import src.plotting as plot
+import src.uncertainty as uncertainty
+import src.kramerskronig as kramerskronig
+import src.timeseries as timeseries
+import src.ndjson as ndjson
+import src.metrics as metrics
+import src.hall as hall
+import src.prefetch as prefetch
+import src.jobqueue as jobqueue
+import src.database as database
+import src.checkpoint as checkpoint
 
 from pathlib import Path
 
 
+real_color = [
+    'darkviolet',
+    'black',
+    'blue',
+    'crimson']
+imag_color = [
+    'peru',
+    'forestgreen',
+    'fuchsia',
+    'olive']
+real_label = [
+    '$\epsilon_r$ 0% $O_2$',
+    '$\epsilon_r$ 20% $O_2$',
+    '$\epsilon_r$ 27% $O_2$',
+    '$\epsilon_r$ 5% $O_2$']
+imag_label = [
+    '$\epsilon_i$ 0% $O_2$',
+    '$\epsilon_i$ 20% $O_2$',
+    '$\epsilon_i$ 27% $O_2$',
+    '$\epsilon_i$ 5% $O_2$']
+
+
+def batch_style(index,
+                batch):
+    '''
+    Plot colours and labels for a batch. The hardcoded styles are used in
+    order, batches beyond them are styled automatically.
+    Args:
+        index: <int> batch index
+        batch: <string> batch name
+    Returns:
+        style: <tuple> real colour, imaginary colour, real label, imaginary
+                label
+    '''
+    if index < len(real_color):
+        return (
+            real_color[index],
+            imag_color[index],
+            real_label[index],
+            imag_label[index])
+    real_style, imag_style = plot.overlay_styles(count=index + 1)[index]
+    return (
+        real_style,
+        imag_style,
+        rf'$\epsilon_r$ {batch}',
+        rf'$\epsilon_i$ {batch}')
+
+
+def stage_settings(drude_parameters,
+                   stage):
+    '''
+    Settings of an optional stage ("Kramers Kronig", "Uncertainty"). A stage
+    runs when its block is in drude_parameters and its "Enabled" is not
+    false; the shipped Drude_parameters.json leaves them disabled.
+    Args:
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        stage: <string> stage block name
+    Returns:
+        settings: <dict> stage settings, None when the stage is off
+    '''
+    settings = drude_parameters.get(stage)
+    if not settings or not settings.get('Enabled', True):
+        return None
+    return settings
+
+
+def fit_two_stage_drude(angular_frequencies,
+                        permittivity,
+                        carrier_density,
+                        drude_parameters,
+                        batch_dictionary):
+    '''
+    Fit the real Drude permittivity, then the imaginary permittivity within
+    bounds set by the real fit. Each fit is checked against the "Fit Gates"
+    straight after it runs, and a failed real fit stops before the imaginary
+    fit. Updates batch_dictionary in place.
+    Args:
+        angular_frequencies: <dict> measured angular frequencies with errors
+        permittivity: <dict> measured permittivities with errors
+        carrier_density: <dict> carrier density in m^-3, with errors
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        batch_dictionary: <dict> batch results dictionary
+    Returns:
+        gate_failures: <array> descriptions of failed fit gates
+    '''
+    fit_gates = drude_parameters.get('Fit Gates', {})
+    real_guesses_bounds = anal.get_real_guesses_bounds(
+        carrier_density=carrier_density,
+        drude_parameters=drude_parameters)
+    drude_real = anal.optimize_real_drude(
+        angular_frequency=angular_frequencies['Angular Frequency'],
+        real_permittivity=permittivity['Real Permittivity'],
+        real_permittivity_error=permittivity['Real Permittivity Error'],
+        initial_guesses=real_guesses_bounds['Real Initial Guesses'],
+        bounds=real_guesses_bounds['Real Bounds'])
+    real_diagnostics = anal.fit_diagnostics(
+        prefix='Real',
+        model=anal.real_drude_permittivity,
+        angular_frequency=angular_frequencies['Angular Frequency'],
+        permittivity=permittivity['Real Permittivity'],
+        permittivity_error=permittivity['Real Permittivity Error'],
+        variable_names=real_guesses_bounds['Real Variable Names'],
+        results=drude_real['Real Results'],
+        covariance=drude_real['Real Covariance'],
+        bounds=real_guesses_bounds['Real Bounds'])
+    batch_dictionary.update(
+        **real_guesses_bounds,
+        **drude_real,
+        **real_diagnostics)
+    gate_failures = anal.fit_gate_failures(
+        prefix='Real',
+        diagnostics=real_diagnostics,
+        fit_gates=fit_gates)
+    if gate_failures:
+        return gate_failures
+
+    imag_guesses_bounds = anal.get_imag_guesses_bounds(
+        variables=drude_real['Real Results'],
+        errors=drude_real['Real Errors'],
+        drude_parameters=drude_parameters)
+    drude_imag = anal.optimize_imag_drude(
+        angular_frequency=angular_frequencies['Angular Frequency'],
+        imag_permittivity=permittivity['Imaginary Permittivity'],
+        imag_permittivity_error=permittivity['Imaginary Permittivity Error'],
+        initial_guesses=imag_guesses_bounds['Imaginary Initial Guesses'],
+        bounds=imag_guesses_bounds['Imaginary Bounds'])
+    imag_diagnostics = anal.fit_diagnostics(
+        prefix='Imaginary',
+        model=anal.imag_drude_permittivity,
+        angular_frequency=angular_frequencies['Angular Frequency'],
+        permittivity=permittivity['Imaginary Permittivity'],
+        permittivity_error=permittivity['Imaginary Permittivity Error'],
+        variable_names=imag_guesses_bounds['Imaginary Variable Names'],
+        results=drude_imag['Imaginary Results'],
+        covariance=drude_imag['Imaginary Covariance'],
+        bounds=imag_guesses_bounds['Imaginary Bounds'])
+    batch_dictionary.update(
+        **imag_guesses_bounds,
+        **drude_imag,
+        **imag_diagnostics)
+    return anal.fit_gate_failures(
+        prefix='Imaginary',
+        diagnostics=imag_diagnostics,
+        fit_gates=fit_gates)
+
+
+def fit_dispersion_model(model,
+                         angular_frequencies,
+                         permittivity,
+                         carrier_density,
+                         drude_parameters,
+                         batch_dictionary):
+    '''
+    Fit a registered dispersion model to the real and imaginary permittivity
+    together and check it against the "Fit Gates". Updates batch_dictionary
+    in place.
+    Args:
+        model: <string> model name (models.MODELS)
+        angular_frequencies: <dict> measured angular frequencies with errors
+        permittivity: <dict> measured permittivities with errors
+        carrier_density: <dict> carrier density in m^-3, with errors
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        batch_dictionary: <dict> batch results dictionary
+    Returns:
+        gate_failures: <array> descriptions of failed fit gates
+    '''
+    guesses_bounds = models.get_model_guesses_bounds(
+        model=model,
+        carrier_density=carrier_density,
+        drude_parameters=drude_parameters)
+    fitted_model = models.optimize_model(
+        model=model,
+        angular_frequency=angular_frequencies['Angular Frequency'],
+        permittivity=permittivity,
+        initial_guesses=guesses_bounds['Model Initial Guesses'],
+        bounds=guesses_bounds['Model Bounds'],
+        variable_names=guesses_bounds['Model Variable Names'])
+    batch_dictionary.update(
+        **guesses_bounds,
+        **fitted_model)
+    return anal.fit_gate_failures(
+        prefix='Model',
+        diagnostics=fitted_model,
+        fit_gates=drude_parameters.get('Fit Gates', {}))
+
+
+def process_batch(index,
+                  batch,
+                  batch_inputs,
+                  batch_dictionary,
+                  drude_parameters,
+                  directory_paths,
+                  render=True,
+                  scaffold=None,
+                  hall_mobilities=None):
+    '''
+    Fit the dispersion model ("Model" in drude_parameters, the two stage
+    Drude fit by default) to one batch's loaded measurements and plot the
+    result. Updates batch_dictionary in place. Fits failing the "Fit Gates"
+    are recorded under "Fit Gate Failures" and stop the batch before the
+    remaining stages. Fits that pass are checked for Kramers-Kronig
+    consistency when "Kramers Kronig" is enabled in drude_parameters. The
+    mobility comes from the batch's Hall measurements, or else "Mobilities"
+    in drude_parameters; a batch with neither is skipped.
+    Args:
+        index: <int> batch index, selects plot colours and labels
+        batch: <string> batch name
+        batch_inputs: <dict> loaded batch inputs (prefetch.load_batch_inputs)
+        batch_dictionary: <dict> batch results dictionary
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        directory_paths: <dict> directory paths from info.json
+        render: <bool> plot the batch on its own figure
+        scaffold: <dict> reusable figure scaffold
+                    (plotting.permittivity_scaffold)
+        hall_mobilities: <dict> Hall mobilities (hall.load_hall_mobilities)
+    Returns:
+        outputs: <array> paths of files written for the batch
+    '''
+    S4_measurements = batch_inputs['S4 Measurements']
+    if len(batch_inputs['S4 File']) == 0 or 'Skip' in S4_measurements.keys():
+        return []
+    mobility = hall.batch_mobility(
+        batch=batch,
+        hall_mobilities=hall_mobilities,
+        drude_parameters=drude_parameters)
+    if mobility is None:
+        print(f'{batch} skipped: no Hall measurement or configured mobility')
+        return []
+    conductivity = anal.average_sample_conductivity(
+        film_thicknesses=S4_measurements['Film Thickness'],
+        sheet_resistances=batch_inputs['Sheet Resistances'])
+    print(f'{batch}')
+    permittivity = anal.calc_permittivities(
+        refractive_indices=S4_measurements['Refractive Index'],
+        refractive_indices_errors=S4_measurements['Refractive Index Error'],
+        extinction_coefficients=S4_measurements['Extinction Coefficient'],
+        extinction_coefficients_errors=S4_measurements[
+            'Extinction Coefficient Error'])
+    carrier_density = anal.calculate_carrier_concs(
+        conductivity=conductivity,
+        mobility=mobility['Mobility'],
+        mobility_error=mobility['Mobility Error'])
+    angular_frequencies = anal.peaks_to_angularfrequencies(
+        resonant_peaks=S4_measurements['Peak Wavelength'],
+        resonant_peaks_errors=S4_measurements['Peak Wavelength Error'])
+    batch_dictionary.update(
+        S4_measurements,
+        **mobility,
+        **conductivity,
+        **carrier_density,
+        **drude_parameters,
+        **permittivity,
+        **angular_frequencies)
+
+    model = drude_parameters.get('Model', 'Drude')
+    with metrics.registry.timer(stage='fit'):
+        if model == 'Drude':
+            gate_failures = fit_two_stage_drude(
+                angular_frequencies=angular_frequencies,
+                permittivity=permittivity,
+                carrier_density=carrier_density,
+                drude_parameters=drude_parameters,
+                batch_dictionary=batch_dictionary)
+        else:
+            gate_failures = fit_dispersion_model(
+                model=model,
+                angular_frequencies=angular_frequencies,
+                permittivity=permittivity,
+                carrier_density=carrier_density,
+                drude_parameters=drude_parameters,
+                batch_dictionary=batch_dictionary)
+    batch_dictionary['Fit Gate Failures'] = gate_failures
+    if gate_failures:
+        print(f'{batch} rejected: {gate_failures}')
+        return []
+
+    settings = stage_settings(
+        drude_parameters=drude_parameters,
+        stage='Kramers Kronig')
+    if settings is not None:
+        frequency_range = drude_parameters['Frequency THz Range']
+        with metrics.registry.timer(stage='kramers_kronig'):
+            batch_dictionary.update(kramerskronig.kramers_kronig_check(
+                angular_frequency=2 * np.pi * 1E12 * np.arange(
+                    frequency_range[0],
+                    frequency_range[1],
+                    frequency_range[2]),
+                results_dictionary=batch_dictionary,
+                extension=settings.get('Extension', 8),
+                tolerance=settings.get('Tolerance', 0.05)))
+        if not batch_dictionary['Kramers Kronig Consistent']:
+            print(
+                f'{batch} not Kramers-Kronig consistent: relative deviation '
+                f'{batch_dictionary["Kramers Kronig Deviation"]:.3g}')
+
+    settings = stage_settings(
+        drude_parameters=drude_parameters,
+        stage='Uncertainty')
+    if model == 'Drude' and settings is not None:
+        with metrics.registry.timer(stage='uncertainty'):
+            batch_dictionary.update(uncertainty.drude_uncertainty(
+                S4_measurements=S4_measurements,
+                permittivity=permittivity,
+                carrier_density=carrier_density,
+                drude_parameters=drude_parameters,
+                samples=settings.get('Samples', 10000),
+                method=settings.get('Method', 'Monte Carlo'),
+                fit=settings.get('Fit', 'Linearised'),
+                percentiles=settings.get('Percentiles', [2.5, 97.5]),
+                workers=settings.get('Workers'),
+                seed=settings.get('Seed')))
+
+    if not render:
+        return []
+    with metrics.registry.timer(stage='plot'):
+        curves = drude_curves(results_dictionary=batch_dictionary)
+        real_style, imag_style, real_text, imag_text = batch_style(
+            index=index,
+            batch=batch)
+        plot_file = Path(
+            f'{directory_paths["Results Path"]}/{batch}_Drude.png')
+        return plot.drude_permittivity_plot(
+            frequency_THz=curves['Frequency THz'],
+            drude_permittivity_real=curves['Real Drude Permittivity'],
+            drude_permittivity_imag=curves['Imaginary Drude Permittivity'],
+            real_color=real_style,
+            imag_color=imag_style,
+            real_label=real_text,
+            imaginary_label=imag_text,
+            frequency_points=curves['Frequency Points'],
+            frequency_errors=curves['Frequency Errors'],
+            real_permittivity_points=curves['Real Permittivity'],
+            real_permittivity_errors=curves['Real Permittivity Error'],
+            imag_permittivity_points=curves['Imaginary Permittivity'],
+            imag_permittivity_errors=curves['Imaginary Permittivity Error'],
+            frequency_ticks=drude_parameters['Frequency THz Ticks'],
+            out_path=plot_file,
+            scaffold=scaffold)
+
+
+def drude_curves(results_dictionary):
+    '''
+    Model curves and measured points to plot for a fitted batch, for any
+    registered dispersion model.
+    Args:
+        results_dictionary: <dict> fitted batch results dictionary
+    Returns:
+        curves: <dict> frequency grid, real and imaginary Drude curves,
+                measured frequency points and permittivities with errors
+    '''
+    frequency_range = results_dictionary['Frequency THz Range']
+    frequency_THz = np.arange(
+        frequency_range[0],
+        frequency_range[1],
+        frequency_range[2])
+    omega = 2 * np.pi * frequency_THz * 1E12
+    frequency_points = [
+        (anal.wavelength_or_frequency(
+            wavelength_or_frequency=peak * 1E-9)) / 1E12
+        for peak in results_dictionary['Peak Wavelength']]
+    frequency_errors = [
+        anal.standard_quadrature(
+            calculated_parameter=f,
+            variables=[w],
+            errors=[dw])
+        for f, w, dw in zip(
+            frequency_points,
+            results_dictionary['Angular Frequency'],
+            results_dictionary['Angular Frequency Error'])]
+    permittivity = models.results_permittivity(
+        angular_frequency=omega,
+        results_dictionary=results_dictionary)
+    return {
+        'Frequency THz': frequency_THz,
+        'Real Drude Permittivity': permittivity.real,
+        'Imaginary Drude Permittivity': permittivity.imag,
+        'Frequency Points': frequency_points,
+        'Frequency Errors': frequency_errors,
+        'Real Permittivity': results_dictionary['Real Permittivity'],
+        'Real Permittivity Error': results_dictionary[
+            'Real Permittivity Error'],
+        'Imaginary Permittivity': results_dictionary['Imaginary Permittivity'],
+        'Imaginary Permittivity Error': results_dictionary[
+            'Imaginary Permittivity Error']}
+
+
+def overlay_batches(batches,
+                    drude_parameters,
+                    directory_paths,
+                    profile='Default'):
+    '''
+    Render the saved results of several batches on one overlay figure.
+    Args:
+        batches: <array> batch names to overlay
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        directory_paths: <dict> directory paths from info.json
+        profile: <string> render profile name (plotting.RENDER_PROFILES)
+    Returns:
+        out_paths: <array> overlay figure paths, None if nothing to plot
+    '''
+    curves = []
+    for batch in batches:
+        results_file = Path(
+            f'{directory_paths["Results Path"]}/{batch}_Drude.json')
+        if not io.is_valid_json(file_path=results_file):
+            continue
+        results_dictionary = io.load_json(file_path=results_file)
+        if (not models.is_fitted(results_dictionary=results_dictionary)
+                or results_dictionary.get('Fit Gate Failures')):
+            continue
+        curve = drude_curves(results_dictionary=results_dictionary)
+        curve['Label'] = batch
+        curves.append(curve)
+    if len(curves) == 0:
+        return None
+    plot_file = Path(f'{directory_paths["Results Path"]}/Overlay_Drude.png')
+    return plot.drude_overlay_plot(
+        frequency_THz=curves[0]['Frequency THz'],
+        curves=curves,
+        frequency_ticks=drude_parameters['Frequency THz Ticks'],
+        out_path=plot_file,
+        profile=profile)
+
+
+def stream_samples(info,
+                   directory_paths,
+                   drude_parameters,
+                   poll_interval=None,
+                   ndjson_output=None):
+    '''
+    Streaming mode for samples measured repeatedly (over anneal time, O2
+    exposure, ...). The 4PP secondary string is the time or condition axis:
+    every measurement file is one point, processed once in condition order as
+    it arrives (once the sample has a mobility), with its fit warm started
+    from the sample's previous accepted point, and appended to the sample's
+    time series file in the results directory instead of rewriting the batch
+    results. A point that fails to load or fit is logged and recorded as
+    failed (timeseries.failed_record), and the stream carries on.
+    Args:
+        info: <dict> information dictionary (info.json)
+        directory_paths: <dict> directory paths from info.json
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        poll_interval: <float> seconds between directory scans for new
+                        measurements, None to process what exists and stop
+        ndjson_output: <file> stream to also write each point's record to
+                        (ndjson.open_output)
+    Returns:
+        None
+    '''
+    results_path = directory_paths['Results Path']
+    records = {}
+    batch_indices = {}
+    while True:
+        index = fp.index_catalogue(catalogue=fp.discover_files(
+            directory_path=directory_paths['4PP Path'],
+            file_string='.csv',
+            pattern=info.get('4PP Pattern'),
+            recursive=info.get('Recursive Search', False)))
+        try:
+            S4_index = fp.index_catalogue(catalogue=fp.discover_files(
+                directory_path=directory_paths['S4 Path'],
+                file_string='S4.json',
+                pattern=info.get('S4 Pattern'),
+                recursive=info.get('Recursive Search', False)))
+        except OSError:
+            S4_index = None
+        hall_mobilities = hall.discover_hall_mobilities(
+            info=info,
+            directory_paths=directory_paths)
+        for batch in index:
+            batch_indices.setdefault(batch, len(batch_indices))
+            if batch not in records.keys():
+                records[batch] = io.load_json_lines(
+                    file_path=timeseries.timeseries_path(
+                        results_path=results_path,
+                        batch=batch))
+        for batch, entry in timeseries.new_measurements(
+                index=index,
+                timeseries=records):
+            if hall.batch_mobility(
+                    batch=batch,
+                    hall_mobilities=hall_mobilities,
+                    drude_parameters=drude_parameters) is None:
+                continue
+            try:
+                batch_inputs = timeseries.load_point_inputs(
+                    batch=batch,
+                    entry=entry,
+                    S4_index=S4_index)
+                batch_dictionary = fp.catalogue_batch_dictionary(
+                    parent=entry['Parent Directory'],
+                    batch_name=batch,
+                    entries=[entry])
+                batch_dictionary.update(batch_inputs['S4 Parameters'])
+                process_batch(
+                    index=batch_indices[batch],
+                    batch=batch,
+                    batch_inputs=batch_inputs,
+                    batch_dictionary=batch_dictionary,
+                    drude_parameters=timeseries.warm_start_parameters(
+                        drude_parameters=drude_parameters,
+                        record=timeseries.last_accepted(
+                            records=records[batch])),
+                    directory_paths=directory_paths,
+                    render=False,
+                    hall_mobilities=hall_mobilities)
+                record = timeseries.timeseries_record(
+                    entry=entry,
+                    batch_dictionary=batch_dictionary)
+                status = (
+                    'Rejected' if record['Fit Gate Failures']
+                    else 'Completed')
+            except Exception:
+                ''' Recorded as processed, retried once the file changes '''
+                traceback.print_exc()
+                record = timeseries.failed_record(
+                    entry=entry,
+                    error=traceback.format_exc(limit=1))
+                status = 'Failed'
+            io.append_json_line(
+                file_path=timeseries.timeseries_path(
+                    results_path=results_path,
+                    batch=batch),
+                record=record)
+            records[batch].append(record)
+            metrics.registry.increment(
+                name='drude_batches_total',
+                labels={'status': status})
+            ndjson_output = ndjson.write_record(
+                output=ndjson_output,
+                record={'Batch Name': batch, **record})
+        if poll_interval is None:
+            return
+        time.sleep(poll_interval)
+
+
+def run_metrics_collector(queue_path=None):
+    '''
+    Collector of run metrics owned outside the metrics registry: batch
+    throughput, curve cache statistics and, in job-queue mode, the queue
+    depth by job state (read on its own connection).
+    Args:
+        queue_path: <string> path to queue database, None outside queue mode
+    Returns:
+        collector: <callable> collector for metrics.registry.add_collector
+    '''
+    def collect():
+        uptime = time.time() - metrics.registry.start_time
+        statistics = cache.curve_cache.statistics()
+        gauges = {
+            'drude_batches_per_second': (
+                metrics.registry.counter_total(name='drude_batches_total')
+                / uptime),
+            'drude_cache_hit_rate': statistics['Cache Hit Rate'],
+            'drude_cache_hits': statistics['Cache Hits'],
+            'drude_cache_misses': statistics['Cache Misses'],
+            'drude_cache_evictions': statistics['Cache Evictions'],
+            'drude_cache_bytes': statistics['Cache Bytes']}
+        if queue_path is not None:
+            connection = jobqueue.connect_queue(queue_path=queue_path)
+            try:
+                gauges['drude_queue_jobs'] = {
+                    (('status', status),): count
+                    for status, count in jobqueue.queue_status(
+                        connection=connection).items()}
+            finally:
+                connection.close()
+        return gauges
+    return collect
+
+
+def stop_exporting(stop,
+                   metrics_file=None):
+    '''
+    Stop the metrics exporter and write the final metrics file.
+    Args:
+        stop: <threading.Event> exporter stop event, None if not exporting
+        metrics_file: <string> path to Prometheus text file
+    Returns:
+        None
+    '''
+    if stop is None:
+        return
+    stop.set()
+    if metrics_file:
+        metrics.write_textfile(out_path=metrics_file)
+
+
+def parse_arguments():
+    '''
+    Command line options for the batch run.
+    Args:
+        None
+    Returns:
+        arguments: <argparse.Namespace> parsed arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Fit the Drude model to every 4PP/S4 batch.')
+    parser.add_argument(
+        '--interactive',
+        action='store_true',
+        help='select 4PP files with the file dialog instead of discovery')
+    parser.add_argument(
+        '--overlay',
+        nargs='*',
+        default=None,
+        metavar='BATCH',
+        help='plot the listed batches (all if none listed) on one overlay '
+             'figure instead of one figure per batch')
+    parser.add_argument(
+        '--render-profile',
+        default=None,
+        choices=list(plot.RENDER_PROFILES),
+        help='plot render profile: fast low-resolution Preview for QC, '
+             'Default png, or Publication png/svg/pdf (overrides info.json)')
+    parser.add_argument(
+        '--kernel-backend',
+        default=None,
+        choices=kernels.BACKENDS,
+        help='Drude kernel backend: NumPy, Numba JIT compiled loops, or Auto '
+             'for Numba when installed (overrides info.json)')
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='time series mode: fit every measurement of a sample as a '
+             'separate point and append it to the sample time series')
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=None,
+        help='with --stream, keep scanning for new measurements every this '
+             'many seconds until interrupted')
+    parser.add_argument(
+        '--ndjson',
+        nargs='?',
+        const='-',
+        default=None,
+        metavar='TARGET',
+        help='write one json line per finished batch to stdout (default, '
+             'progress messages move to stderr), a file or named pipe, or '
+             'tcp://host:port')
+    parser.add_argument(
+        '--metrics-file',
+        default=None,
+        help='write run metrics to this Prometheus text file periodically')
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=None,
+        help='serve run metrics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=15,
+        help='seconds between metrics file writes')
+    parser.add_argument(
+        '--queue',
+        default=None,
+        help='SQLite job queue shared by several workers (job-queue mode)')
+    parser.add_argument(
+        '--worker',
+        default=jobqueue.default_worker_name(),
+        help='worker name recorded against claimed batches')
+    parser.add_argument(
+        '--stale-after',
+        type=float,
+        default=300,
+        help='seconds without heartbeat before a claimed batch is reclaimed')
+    parser.add_argument(
+        '--database',
+        default=None,
+        help='also write each batch into this indexed SQLite results database')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    arguments = parse_arguments()
     root = Path().absolute()
     info, directory_paths = fp.get_directory_paths(root_path=root)
-    file_paths = fp.get_files_paths(
-        directory_path=directory_paths['4PP Path'],
-        file_string='.csv')
-    parent, batches = fp.get_all_batches(file_paths=file_paths)
+    kernels.set_backend(
+        backend=(
+            arguments.kernel_backend or info.get('Kernel Backend', 'NumPy')))
+    stop_metrics = None
+    if arguments.metrics_file or arguments.metrics_port is not None:
+        metrics.registry.add_collector(run_metrics_collector(
+            queue_path=arguments.queue))
+        stop_metrics = metrics.start_exporter(
+            textfile=arguments.metrics_file,
+            port=arguments.metrics_port,
+            interval=arguments.metrics_interval)
+    ndjson_output = None
+    if arguments.ndjson:
+        ndjson_output = ndjson.open_output(target=arguments.ndjson)
+        if ndjson_output is sys.stdout:
+            ''' Progress messages go to stderr, stdout only carries records '''
+            sys.stdout = sys.stderr
+    if arguments.stream:
+        try:
+            stream_samples(
+                info=info,
+                directory_paths=directory_paths,
+                drude_parameters=io.load_json(
+                    file_path=Path(f'{root}/Drude_parameters.json')),
+                poll_interval=arguments.poll_interval,
+                ndjson_output=ndjson_output)
+        except KeyboardInterrupt:
+            pass
+        ndjson.close_output(output=ndjson_output)
+        stop_exporting(
+            stop=stop_metrics,
+            metrics_file=arguments.metrics_file)
+        raise SystemExit
+    with metrics.registry.timer(stage='discovery'):
+        catalogue = fp.discover_files(
+            directory_path=directory_paths['4PP Path'],
+            file_string='.csv',
+            pattern=info.get('4PP Pattern'),
+            recursive=info.get('Recursive Search', False),
+            interactive=(
+                arguments.interactive or info.get('Interactive', False)))
+        try:
+            S4_index = fp.index_catalogue(catalogue=fp.discover_files(
+                directory_path=directory_paths['S4 Path'],
+                file_string='S4.json',
+                pattern=info.get('S4 Pattern'),
+                recursive=info.get('Recursive Search', False)))
+        except OSError:
+            S4_index = None
+        parent, batches = fp.catalogue_batches(catalogue=catalogue)
     drude_parameters = io.load_json(
         file_path=Path(f'{root}/Drude_parameters.json'))
+    retry_rejected = anal.fit_gate_action(
+        fit_gates=drude_parameters.get('Fit Gates', {})) == 'Retry'
+    render_profile = (
+        arguments.render_profile or info.get('Render Profile', 'Default'))
+    scaffold = None
+    if arguments.overlay is None:
+        scaffold = plot.permittivity_scaffold(
+            frequency_ticks=drude_parameters['Frequency THz Ticks'],
+            profile=render_profile)
 
-    real_color = [
-        'darkviolet',
-        'black',
-        'blue',
-        'crimson']
-    imag_color = [
-        'peru',
-        'forestgreen',
-        'fuchsia',
-        'olive']
-    real_label = [
-        '$\epsilon_r$ 0% $O_2$',
-        '$\epsilon_r$ 20% $O_2$',
-        '$\epsilon_r$ 27% $O_2$',
-        '$\epsilon_r$ 5% $O_2$']
-    imag_label = [
-        '$\epsilon_i$ 0% $O_2$',
-        '$\epsilon_i$ 20% $O_2$',
-        '$\epsilon_i$ 27% $O_2$',
-        '$\epsilon_i$ 5% $O_2$']
-    for index, batch in enumerate(batches):
-        file_paths = batches[f'{batch}']
-        out_file = Path(f'{directory_paths["Results Path"]}/{batch}_Drude.json')
-        oot_file = Path(f'{directory_paths["Results Path"]}/{batch}_Drude.json')
-        if oot_file.is_file():
-            pass
-        else:
-            batch_dictionary = fp.update_batch_dictionary(
-                parent=parent,
-                batch_name=batch,
-                file_paths=file_paths)
-            sheet_resistances = io.load_sheet_resistance(
-                file_path=file_paths[0])
-            S4_file, S4_parameters = fp.find_S4_measurement(
-                S4_path=directory_paths['S4 Path'],
-                sample_details=fp.sample_information(
-                    file_path=file_paths[0]),
-                file_string='S4.json')
-            batch_dictionary.update(S4_parameters)
-
-            if len(S4_file) == 0:
-                pass
-            else:
-                S4_measurements = io.get_S4_measurements(file_path=S4_file[0])
-                if 'Skip' in S4_measurements.keys():
-                    pass
-                else:
-                    conductivity = anal.average_sample_conductivity(
-                        film_thicknesses=S4_measurements['Film Thickness'],
-                        sheet_resistances=sheet_resistances)
-                    print(f'{batch}')
-                    permittivity = anal.calc_permittivities(
-                        refractive_indices=S4_measurements['Refractive Index'],
-                        refractive_indices_errors=S4_measurements[
-                            'Refractive Index Error'],
-                        extinction_coefficients=S4_measurements[
-                            'Extinction Coefficient'],
-                        extinction_coefficients_errors=S4_measurements[
-                            'Extinction Coefficient Error'])
-                    mobility = (drude_parameters['Mobilities'])[f'{batch}']
-                    carrier_density = anal.calculate_carrier_concs(
-                        conductivity=conductivity,
-                        mobility=mobility)
-
-                    angular_frequencies = anal.peaks_to_angularfrequencies(
-                        resonant_peaks=S4_measurements['Peak Wavelength'],
-                        resonant_peaks_errors=S4_measurements[
-                            'Peak Wavelength Error'])
-                    real_guesses_bounds = anal.get_real_guesses_bounds(
-                        carrier_density=carrier_density,
-                        drude_parameters=drude_parameters)
-                    drude_real = anal.optimize_real_drude(
-                        angular_frequency=angular_frequencies[
-                            'Angular Frequency'],
-                        real_permittivity=permittivity['Real Permittivity'],
-                        real_permittivity_error=permittivity[
-                            'Real Permittivity Error'],
-                        initial_guesses=real_guesses_bounds[
-                            'Real Initial Guesses'],
-                        bounds=real_guesses_bounds['Real Bounds'])
-
-                    imag_guesses_bounds = anal.get_imag_guesses_bounds(
-                        variables=drude_real['Real Results'],
-                        errors=drude_real['Real Errors'],
-                        drude_parameters=drude_parameters)
-                    drude_imag = anal.optimize_imag_drude(
-                        angular_frequency=angular_frequencies[
-                            'Angular Frequency'],
-                        imag_permittivity=permittivity[
-                            'Imaginary Permittivity'],
-                        imag_permittivity_error=permittivity[
-                            'Imaginary Permittivity Error'],
-                        initial_guesses=imag_guesses_bounds[
-                            'Imaginary Initial Guesses'],
-                        bounds=imag_guesses_bounds['Imaginary Bounds'])
-
-                    results_dictionary = dict(
-                        S4_measurements,
-                        **conductivity,
-                        **drude_parameters,
-                        **permittivity,
-                        **angular_frequencies,
-                        **real_guesses_bounds,
-                        **drude_real,
-                        **imag_guesses_bounds,
-                        **drude_imag)
-                    batch_dictionary.update(results_dictionary)
-
-                    frequency_range = results_dictionary['Frequency THz Range']
-                    frequency_THz = np.arange(
-                        frequency_range[0],
-                        frequency_range[1],
-                        frequency_range[2])
-                    omega = [2 * np.pi * f * 1E12 for f in frequency_THz]
-                    real_results = results_dictionary['Real Results']
-                    imag_results = results_dictionary['Imaginary Results']
-                    real_drude_permittivity = [
-                        anal.real_drude_permittivity(
-                            x=w,
-                            carrier_density=real_results[0],
-                            effective_mass=real_results[1],
-                            epsilon_infinity=real_results[2])
-                        for w in omega]
-                    imag_drude_permittivity = [
-                        anal.imag_drude_permittivity(
-                            x=w,
-                            carrier_density=imag_results[0],
-                            effective_mass=imag_results[1],
-                            epsilon_infinity=imag_results[2],
-                            relaxation_time=imag_results[3])
-                        for w in omega]
-                    frequency_points = [
-                        (anal.wavelength_or_frequency(
-                            wavelength_or_frequency=peak * 1E-9)) / 1E12
-                        for peak in S4_measurements['Peak Wavelength']]
-                    frequency_errors = [
-                        anal.standard_quadrature(
-                            calculated_parameter=f,
-                            variables=[w],
-                            errors=[dw])
-                        for f, w, dw in zip(
-                            frequency_points,
-                            results_dictionary['Angular Frequency'],
-                            results_dictionary['Angular Frequency Error'])]
-                    plot.drude_permittivity_plot(
-                        frequency_THz=frequency_THz,
-                        drude_permittivity_real=real_drude_permittivity,
-                        drude_permittivity_imag=imag_drude_permittivity,
-                        real_color=real_color[index],
-                        imag_color=imag_color[index],
-                        real_label=real_label[index],
-                        imaginary_label=imag_label[index],
-                        frequency_points=frequency_points,
-                        frequency_errors=frequency_errors,
-                        real_permittivity_points=results_dictionary[
-                            'Real Permittivity'],
-                        real_permittivity_errors=results_dictionary[
-                            'Real Permittivity Error'],
-                        imag_permittivity_points=results_dictionary[
-                            'Imaginary Permittivity'],
-                        imag_permittivity_errors=results_dictionary[
-                            'Imaginary Permittivity Error'],
-                        frequency_ticks=drude_parameters[
-                            'Frequency THz Ticks'],
-                        out_path=Path(
-                            f'{directory_paths["Results Path"]}'
-                            f'\{batch}_Drude.png'))
-
-            io.save_json_dicts(
-                out_path=out_file,
-                dictionary=batch_dictionary)
+    batch_indices = {batch: index for index, batch in enumerate(batches)}
+    journal = checkpoint.journal_path(
+        results_path=directory_paths['Results Path'],
+        worker=arguments.worker if arguments.queue else None)
+    journal_records = checkpoint.load_journal(journal_path=journal)
+    pending_batches = [
+        (batch, batches[f'{batch}'])
+        for batch in batches
+        if not checkpoint.batch_finished(
+            records=journal_records,
+            batch=batch,
+            results_file=Path(
+                f'{directory_paths["Results Path"]}/{batch}_Drude.json'))]
+    with metrics.registry.timer(stage='discovery'):
+        hall_mobilities = hall.discover_hall_mobilities(
+            info=info,
+            directory_paths=directory_paths)
+    missing_mobility = [
+        batch for batch, _ in pending_batches
+        if hall.batch_mobility(
+            batch=batch,
+            hall_mobilities=hall_mobilities,
+            drude_parameters=drude_parameters) is None]
+    if missing_mobility:
+        ''' Left pending rather than failing part way through the run '''
+        print(f'No Hall measurement or configured mobility, skipped: '
+              f'{", ".join(missing_mobility)}')
+        pending_batches = [
+            (batch, entries) for batch, entries in pending_batches
+            if batch not in missing_mobility]
+    if arguments.database:
+        results_database = database.connect_database(
+            database_path=arguments.database)
+    if arguments.queue:
+        queue = jobqueue.connect_queue(queue_path=arguments.queue)
+        jobqueue.enqueue_batches(
+            connection=queue,
+            batches=[batch for batch, _ in pending_batches])
+        stop_heartbeat = jobqueue.start_heartbeat(
+            queue_path=arguments.queue,
+            worker=arguments.worker,
+            interval=arguments.stale_after / 10)
+        pending_batches = jobqueue.claimed_batches(
+            connection=queue,
+            worker=arguments.worker,
+            batches=batches,
+            stale_after=arguments.stale_after)
+    if not arguments.queue:
+        metrics.registry.set_gauge(
+            name='drude_pending_batches',
+            value=len(pending_batches))
+    for batch, entries, batch_inputs in metrics.timed(
+            iterable=prefetch.prefetch_batches(
+                batches=pending_batches,
+                S4_index=S4_index,
+                depth=info.get('Prefetch Depth', 2)),
+            stage='load'):
+        out_file = Path(
+            f'{directory_paths["Results Path"]}/{batch}_Drude.json')
+        batch_dictionary = fp.catalogue_batch_dictionary(
+            parent=parent,
+            batch_name=batch,
+            entries=entries)
+        checkpoint.append_journal(
+            journal_path=journal,
+            batch=batch,
+            status='Started')
+        try:
+            if 'Load Error' in batch_inputs.keys():
+                raise batch_inputs['Load Error']
+            batch_dictionary.update(batch_inputs['S4 Parameters'])
+            outputs = process_batch(
+                index=batch_indices[batch],
+                batch=batch,
+                batch_inputs=batch_inputs,
+                batch_dictionary=batch_dictionary,
+                drude_parameters=drude_parameters,
+                directory_paths=directory_paths,
+                render=arguments.overlay is None,
+                scaffold=scaffold,
+                hall_mobilities=hall_mobilities)
+            with metrics.registry.timer(stage='save'):
+                io.save_json_dicts(
+                    out_path=out_file,
+                    dictionary=batch_dictionary)
+                if arguments.database:
+                    database.insert_batch(
+                        connection=results_database,
+                        batch=batch,
+                        dictionary=batch_dictionary,
+                        results_file=out_file,
+                        parent=parent)
+        except Exception:
+            checkpoint.append_journal(
+                journal_path=journal,
+                batch=batch,
+                status='Failed')
+            metrics.registry.increment(
+                name='drude_batches_total',
+                labels={'status': 'Failed'})
+            if not arguments.queue:
+                raise
+            traceback.print_exc()
+            jobqueue.fail_batch(
+                connection=queue,
+                batch=batch,
+                worker=arguments.worker,
+                error=traceback.format_exc(limit=1))
+            continue
+        gate_failures = batch_dictionary.get('Fit Gate Failures', [])
+        metrics.registry.increment(
+            name='drude_batches_total',
+            labels={'status': 'Rejected' if gate_failures else 'Completed'})
+        if not arguments.queue:
+            metrics.registry.set_gauge(
+                name='drude_pending_batches',
+                value=len(pending_batches)
+                - metrics.registry.counter_total(name='drude_batches_total'))
+        ndjson_output = ndjson.write_record(
+            output=ndjson_output,
+            record=ndjson.batch_record(
+                batch=batch,
+                status='Rejected' if gate_failures else 'Completed',
+                batch_dictionary=batch_dictionary,
+                results_file=out_file,
+                outputs=outputs))
+        if gate_failures and retry_rejected:
+            checkpoint.append_journal(
+                journal_path=journal,
+                batch=batch,
+                status='Rejected',
+                outputs=[out_file])
+            if arguments.queue:
+                jobqueue.reject_batch(
+                    connection=queue,
+                    batch=batch,
+                    worker=arguments.worker,
+                    error='; '.join(gate_failures))
+            continue
+        checkpoint.append_journal(
+            journal_path=journal,
+            batch=batch,
+            status='Completed',
+            outputs=outputs + [out_file])
+        if arguments.queue:
+            jobqueue.complete_batch(
+                connection=queue,
+                batch=batch,
+                worker=arguments.worker)
+    if arguments.overlay is not None:
+        overlay_batches(
+            batches=arguments.overlay or list(batches),
+            drude_parameters=drude_parameters,
+            directory_paths=directory_paths,
+            profile=render_profile)
+    if scaffold is not None:
+        plot.close_scaffold(scaffold=scaffold)
+    ndjson.close_output(output=ndjson_output)
+    stop_exporting(
+        stop=stop_metrics,
+        metrics_file=arguments.metrics_file)
+    if arguments.database:
+        results_database.close()
+    if arguments.queue:
+        stop_heartbeat.set()
+        print(jobqueue.queue_status(connection=queue))
@@ -0,0 +1,54 @@
+import numpy as np
+import src.fileIO as io
+import src.models as models
+import src.filepaths as fp
+import src.transfermatrix as tm
+
+from pathlib import Path
+
+
+if __name__ == '__main__':
+    root = Path().absolute()
+    info, directory_paths = fp.get_directory_paths(root_path=root)
+    stack_parameters = io.load_json(
+        file_path=Path(f'{root}/Stack_parameters.json'))
+    results_files = sorted(
+        Path(directory_paths['Results Path']).glob('*_Drude.json'))
+
+    wavelength_range = stack_parameters['Wavelength nm Range']
+    wavelengths = np.arange(
+        wavelength_range[0],
+        wavelength_range[1],
+        wavelength_range[2])
+    angular_frequencies = tm.wavelengths_to_angularfrequencies(
+        wavelengths=wavelengths)
+    for results_file in results_files:
+        batch = results_file.stem.replace('_Drude', '')
+        out_file = Path(f'{directory_paths["Results Path"]}/{batch}_Stack.json')
+        results_dictionary = io.load_json(file_path=results_file)
+        if (not models.is_fitted(results_dictionary=results_dictionary)
+                or results_dictionary.get('Fit Gate Failures')):
+            continue
+        print(f'{batch}')
+        layers = tm.build_stack_layers(
+            stack_parameters=stack_parameters,
+            angular_frequency=angular_frequencies,
+            results_dictionary=results_dictionary)
+        response = tm.stack_response(
+            wavelengths=wavelengths,
+            angles=stack_parameters['Angles Degrees'],
+            layers=layers,
+            incident_permittivity=stack_parameters['Incident Permittivity'],
+            substrate_permittivity=complex(
+                *stack_parameters['Substrate Permittivity']),
+            polarisation=stack_parameters['Polarisation'])
+        stack_dictionary = {
+            'Batch Name': batch,
+            'Wavelength': [w for w in wavelengths],
+            'Angles Degrees': stack_parameters['Angles Degrees'],
+            'Layers': stack_parameters['Layers']}
+        stack_dictionary.update({
+            key: value.tolist() for key, value in response.items()})
+        io.save_json_dicts(
+            out_path=out_file,
+            dictionary=stack_dictionary)
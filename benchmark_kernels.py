@@ -0,0 +1,153 @@
+import time
+import argparse
+import numpy as np
+import src.fileIO as io
+import src.kernels as kernels
+import src.models as models
+
+
+def best_time(function,
+              repeats=5):
+    '''
+    Best wall time of repeated calls, after one untimed call so JIT
+    compilation is not counted.
+    Args:
+        function: <callable> no-argument workload
+        repeats: <int> timed calls
+    Returns:
+        seconds: <float> fastest call
+    '''
+    function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def kernel_workloads(seed=0):
+    '''
+    Synthetic workloads at the sizes the pipeline uses: repeated model and
+    jacobian calls of one fit, batched model and jacobian evaluations of many
+    parameter sets (uncertainty samples), a combined fit and a sweep grid.
+    Args:
+        seed: <int> random seed
+    Returns:
+        workloads: <dict> {workload name: no-argument callable}
+    '''
+    generator = np.random.default_rng(seed)
+    omega = np.linspace(1E13, 5E14, 400)
+    samples = np.column_stack([
+        generator.uniform(1E24, 1E26, 2000),
+        generator.uniform(0.2, 0.5, 2000),
+        generator.uniform(3, 5, 2000),
+        generator.uniform(1E13, 1E14, 2000)])
+    truth = samples[0]
+    function, jacobian = models.stacked_model(model='Drude Full')
+    x = np.concatenate([omega, omega])
+    clean = function(x, *truth)
+    noisy = clean * (1 + 0.01 * generator.standard_normal(clean.size))
+    permittivity = {
+        'Real Permittivity': noisy[:omega.size],
+        'Imaginary Permittivity': noisy[omega.size:],
+        'Real Permittivity Error': 0.01 * np.abs(clean[:omega.size]) + 1E-3,
+        'Imaginary Permittivity Error': (
+            0.01 * np.abs(clean[omega.size:]) + 1E-3)}
+    bounds = (
+        (1E23, 0.05, 1, 1E12),
+        (1E27, 2, 10, 1E15))
+
+    def fit_calls():
+        for _ in range(200):
+            function(x, *truth)
+            jacobian(x, *truth)
+
+    return {
+        'Fit Model And Jacobian x200': fit_calls,
+        'Batched Model': lambda: models.drude_full_permittivity(
+            angular_frequency=omega,
+            parameters=samples),
+        'Batched Jacobian': lambda: models.drude_full_gradient(
+            angular_frequency=omega,
+            parameters=samples),
+        'Model Fit': lambda: models.optimize_model(
+            model='Drude Full',
+            angular_frequency=omega,
+            permittivity=permittivity,
+            initial_guesses=truth * [2, 0.8, 1.1, 1.5],
+            bounds=bounds,
+            variable_names=models.drude_names()),
+        'Sweep Grid': lambda: kernels.drude_grid(
+            angular_frequency=omega,
+            carrier_densities=samples[:, 0],
+            effective_masses=np.linspace(0.2, 0.5, 8),
+            epsilon_infinity=4,
+            relaxation_time=1E14,
+            mode='Full',
+            dtype=np.complex64)}
+
+
+def benchmark_backends(repeats=5):
+    '''
+    Time every kernel workload on each available backend.
+    Args:
+        repeats: <int> timed calls per workload
+    Returns:
+        results: <dict> {workload name: {backend: seconds, "Speed Up": NumPy
+                    / Numba time}}
+    '''
+    results = {}
+    for backend in ['NumPy', 'Numba']:
+        if kernels.set_backend(backend=backend) != backend:
+            continue
+        start = time.perf_counter()
+        workloads = kernel_workloads()
+        for name, function in workloads.items():
+            results.setdefault(name, {})[backend] = best_time(
+                function=function,
+                repeats=repeats)
+        results.setdefault('Total Including Compile', {})[backend] = (
+            time.perf_counter() - start)
+    for timings in results.values():
+        if 'Numba' in timings.keys():
+            timings['Speed Up'] = timings['NumPy'] / timings['Numba']
+    return results
+
+
+def parse_arguments():
+    '''
+    Command line options for the kernel benchmark.
+    Args:
+        None
+    Returns:
+        arguments: <argparse.Namespace> parsed arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Compare the NumPy and Numba Drude kernel backends.')
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=5,
+        help='timed calls per workload, the best is reported')
+    parser.add_argument(
+        '--json',
+        default=None,
+        help='also save the timings to this json file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    results = benchmark_backends(repeats=arguments.repeats)
+    print(f'{"Workload":<30}{"NumPy s":>12}{"Numba s":>12}{"Speed Up":>10}')
+    for name, timings in results.items():
+        numba_time = timings.get('Numba', np.nan)
+        speed_up = timings.get('Speed Up', np.nan)
+        print(
+            f'{name:<30}{timings["NumPy"]:>12.4g}{numba_time:>12.4g}'
+            f'{speed_up:>10.2f}')
+    if arguments.json:
+        io.save_json_dicts(
+            out_path=arguments.json,
+            dictionary=results)
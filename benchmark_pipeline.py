@@ -0,0 +1,505 @@
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import scipy
+
+''' Headless plotting, the benchmark runs without a display '''
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import matplotlib
+import src.fileIO as io
+import src.analysis as anal
+import src.kernels as kernels
+import src.metrics as metrics
+
+from pathlib import Path
+
+
+''' Bump when the workload or the baseline layout changes, so timings of
+different workloads are never compared '''
+BENCHMARK_VERSION = 3
+PIPELINE_PATH = Path(
+    f'{Path(__file__).absolute().parent}/batch_drude_permittivity.py')
+STAGES = [
+    'Run',
+    'Discovery',
+    'Load',
+    'Fit',
+    'Kramers Kronig',
+    'Uncertainty',
+    'Plot',
+    'Save']
+''' Stages timed by the pipeline, by their metrics registry label '''
+METRIC_STAGES = {
+    'Discovery': 'discovery',
+    'Load': 'load',
+    'Fit': 'fit',
+    'Kramers Kronig': 'kramers_kronig',
+    'Uncertainty': 'uncertainty',
+    'Plot': 'plot',
+    'Save': 'save'}
+TRUE_DRUDE = {
+    'Effective Mass': 0.35,
+    'Epsilon Infinity': 4.0,
+    'Relaxation Time': 1E16,
+    'Mobility': 30.0}
+
+
+def write_workload(directory_path,
+                   batches=8,
+                   gratings=12,
+                   seed=0):
+    '''
+    Write a synthetic data set in the layout the pipeline reads: a 4PP
+    directory of sheet resistance csv files, an S4 directory of grating
+    results and a Hall directory of mobility exports. Gratings are generated
+    from a known Drude permittivity with 1 % noise, below the plasma
+    frequency so the real permittivity stays positive, so every fit converges
+    and every stage runs.
+    Args:
+        directory_path: <string> directory to write 4PP, S4 and Hall into
+        batches: <int> number of batches
+        gratings: <int> gratings (data points) per batch
+        seed: <int> random seed
+    Returns:
+        None
+    '''
+    generator = np.random.default_rng(seed)
+    Path(f'{directory_path}/4PP').mkdir(parents=True, exist_ok=True)
+    Path(f'{directory_path}/S4').mkdir(parents=True, exist_ok=True)
+    Path(f'{directory_path}/Hall').mkdir(parents=True, exist_ok=True)
+    peaks = np.linspace(550, 950, gratings)
+    omega = 2 * np.pi * anal.wavelength_or_frequency(
+        wavelength_or_frequency=peaks * 1E-9)
+    film_thickness = 100.0
+    for index in range(batches):
+        batch = f'B{index + 1}'
+        carrier_density = 2E26 * (1 + 0.1 * index)
+        permittivity = anal.complex_drude_permittivity(
+            x=omega,
+            carrier_density=carrier_density,
+            effective_mass=TRUE_DRUDE['Effective Mass'],
+            epsilon_infinity=TRUE_DRUDE['Epsilon Infinity'],
+            relaxation_time=TRUE_DRUDE['Relaxation Time'],
+            mode='Approximate')
+        permittivity *= 1 + 0.01 * generator.standard_normal(gratings)
+        index_extinction = np.sqrt(permittivity)
+
+        ''' Sheet resistance giving the carrier density at the mobility '''
+        unit_density = anal.calculate_carrier_concs(
+            conductivity=anal.average_sample_conductivity(
+                film_thicknesses=[film_thickness],
+                sheet_resistances=[1.0]),
+            mobility=TRUE_DRUDE['Mobility'])['Carrier Density']
+        sheet_resistances = (unit_density / carrier_density) * (
+            1 + 0.01 * generator.standard_normal(20))
+        with open(f'{directory_path}/4PP/{batch}_01.csv', 'w') as outfile:
+            outfile.write('Rs,Err\n')
+            for resistance in sheet_resistances:
+                outfile.write(f'{resistance},0.1\n')
+
+        S4_results = {'Gratings': [f'G{g + 1}' for g in range(gratings)]}
+        for grating, (peak, value) in enumerate(zip(peaks, index_extinction)):
+            name = f'G{grating + 1}'
+            thickness = film_thickness + generator.normal(0, 1)
+            S4_results[name] = {
+                f'{name}_TE Variables': {
+                    'S4 Strings': ['material_n', 'material_k',
+                                   'film_thickness'],
+                    'S4 Guesses': [value.real, value.imag / 10, thickness]},
+                f'{name}_TM Variables': {
+                    'S4 Strings': ['material_n', 'material_k',
+                                   'film_thickness'],
+                    'S4 Guesses': [value.real + 1E-4, value.imag / 10,
+                                   thickness + 1]},
+                f'{name}_TE Optimizer Errors': [0.01, 0.003, 1.0],
+                f'{name}_TE Fano Fit Parameters': ['Peak', 'Width'],
+                f'{name}_TE Fano Fit': [peak, 5.0],
+                f'{name}_TE Fano Errors': [0.5, 0.1],
+                f'{name}_TE Figure Of Merit': 10.0,
+                f'{name}_TM Figure Of Merit': 12.0}
+        io.save_json_dicts(
+            out_path=f'{directory_path}/S4/{batch}_grating_S4.json',
+            dictionary=S4_results)
+        hall_mobilities = TRUE_DRUDE['Mobility'] * (
+            1 + 0.01 * generator.standard_normal(5))
+        with open(f'{directory_path}/Hall/{batch}_hall.csv', 'w') as outfile:
+            outfile.write('Mobility (cm2/Vs),Mobility Error (cm2/Vs)\n')
+            for mobility in hall_mobilities:
+                outfile.write(f'{mobility},0.3\n')
+
+
+def write_settings(directory_path,
+                   info,
+                   drude_parameters,
+                   seed=0):
+    '''
+    Write the info.json and Drude_parameters.json the pipeline reads from its
+    working directory. info is used as shipped, so discovery runs with the
+    shipped patterns and search settings. Mobilities come from the
+    workload's Hall files, so "Mobilities" is dropped, and the optional
+    Kramers-Kronig and uncertainty stages are enabled (seeded) so every stage
+    is timed.
+    Args:
+        directory_path: <string> workload directory
+        info: <dict> information dictionary (info.json)
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        seed: <int> uncertainty sampling seed
+    Returns:
+        None
+    '''
+    drude_parameters = {
+        key: value for key, value in drude_parameters.items()
+        if key != 'Mobilities'}
+    drude_parameters['Kramers Kronig'] = dict(
+        drude_parameters.get('Kramers Kronig') or {},
+        Enabled=True)
+    drude_parameters['Uncertainty'] = dict(
+        drude_parameters.get('Uncertainty') or {},
+        Enabled=True,
+        Seed=seed)
+    io.save_json_dicts(
+        out_path=Path(f'{directory_path}/info.json'),
+        dictionary=info)
+    io.save_json_dicts(
+        out_path=Path(f'{directory_path}/Drude_parameters.json'),
+        dictionary=drude_parameters)
+
+
+def stage_seconds():
+    '''
+    Seconds timed into each pipeline stage so far, from the metrics registry.
+    Args:
+        None
+    Returns:
+        seconds: <dict> METRIC_STAGES name: total seconds
+    '''
+    return {
+        stage: metrics.registry.histogram_sum(
+            name='drude_stage_seconds',
+            labels={'stage': label})
+        for stage, label in METRIC_STAGES.items()}
+
+
+def run_pipeline(directory_path,
+                 batches,
+                 kernel_backend='NumPy'):
+    '''
+    Run batch_drude_permittivity.py once on the workload, as from the command
+    line in directory_path: discovery with the written info.json, the
+    prefetching main loop with its checkpoint journal, process_batch and
+    save. Results are cleared first so the journal does not skip batches.
+    Stage times are read from the pipeline's own metrics registry timers.
+    Args:
+        directory_path: <string> workload directory (write_workload and
+                        write_settings)
+        batches: <int> number of batches in the workload
+        kernel_backend: <string> Drude kernel backend to run with
+    Returns:
+        seconds: <dict> stage name: seconds, "Run" for the whole run
+    '''
+    results_path = Path(f'{directory_path}/Results')
+    shutil.rmtree(results_path, ignore_errors=True)
+    results_path.mkdir()
+    working_directory = os.getcwd()
+    arguments = sys.argv
+    start_seconds = stage_seconds()
+    start = time.perf_counter()
+    try:
+        os.chdir(directory_path)
+        sys.argv = [
+            f'{PIPELINE_PATH}',
+            '--kernel-backend',
+            kernel_backend]
+        runpy.run_path(f'{PIPELINE_PATH}', run_name='__main__')
+    finally:
+        os.chdir(working_directory)
+        sys.argv = arguments
+    seconds = {'Run': time.perf_counter() - start}
+    seconds.update({
+        stage: value - start_seconds[stage]
+        for stage, value in stage_seconds().items()})
+    plots = len(list(results_path.glob('*_Drude.png')))
+    if plots < batches:
+        raise ValueError(
+            f'{batches - plots} of {batches} batches stopped before the '
+            'plot, the workload no longer runs every stage')
+    return seconds
+
+
+def benchmark_pipeline(info,
+                       drude_parameters,
+                       batches=8,
+                       gratings=12,
+                       repeats=7,
+                       seed=0):
+    '''
+    Time each pipeline stage on the synthetic workload, keeping the median of
+    repeats runs, then measure the run's peak traced memory in one more run
+    (tracing slows the code, so it is kept out of the timed runs). Everything
+    runs in a temporary directory with no network access, and the pipeline's
+    progress messages are discarded.
+    Args:
+        info: <dict> information dictionary (info.json)
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        batches: <int> number of batches
+        gratings: <int> gratings (data points) per batch
+        repeats: <int> timed runs, the median is kept per stage
+        seed: <int> random seed
+    Returns:
+        results: <dict> benchmark version, workload, environment and per stage
+                    seconds, with the run's peak memory in MB
+    '''
+    with tempfile.TemporaryDirectory() as directory_path, \
+            open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        write_workload(
+            directory_path=directory_path,
+            batches=batches,
+            gratings=gratings,
+            seed=seed)
+        write_settings(
+            directory_path=directory_path,
+            info=info,
+            drude_parameters=drude_parameters,
+            seed=seed)
+        runs = [
+            run_pipeline(
+                directory_path=directory_path,
+                batches=batches,
+                kernel_backend=kernels.get_backend())
+            for _ in range(max(int(repeats), 1))]
+        tracemalloc.start()
+        try:
+            run_pipeline(
+                directory_path=directory_path,
+                batches=batches,
+                kernel_backend=kernels.get_backend())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    stages = {
+        stage: {'Seconds': float(np.median([run[stage] for run in runs]))}
+        for stage in STAGES}
+    stages['Run']['Peak Memory MB'] = peak / 1E6
+    return {
+        'Version': BENCHMARK_VERSION,
+        'Workload': {
+            'Batches': batches,
+            'Gratings': gratings,
+            'Repeats': repeats,
+            'Statistic': 'Median',
+            'Seed': seed,
+            'Kernel Backend': kernels.get_backend()},
+        'Environment': {
+            'Python': platform.python_version(),
+            'NumPy': np.__version__,
+            'SciPy': scipy.__version__,
+            'Matplotlib': matplotlib.__version__,
+            'Platform': platform.platform(),
+            'Processor': platform.machine()},
+        'Created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'Max RSS MB': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1E3,
+        'Stages': stages}
+
+
+def compare_results(baseline,
+                    current,
+                    threshold=0.25,
+                    memory_threshold=0.25,
+                    min_seconds=0.05,
+                    min_memory=1.0):
+    '''
+    Compare a benchmark run against the baseline, stage by stage. A stage
+    regresses when it is slower (or uses more memory) than the baseline by
+    more than the relative threshold and by more than the absolute minimum,
+    so timer noise on millisecond stages does not fail the gate.
+    Args:
+        baseline: <dict> baseline results (benchmark_pipeline)
+        current: <dict> current results (benchmark_pipeline)
+        threshold: <float> allowed relative slow down, 0.25 is 25 %
+        memory_threshold: <float> allowed relative peak memory increase
+        min_seconds: <float> slow downs smaller than this always pass
+        min_memory: <float> memory increases smaller than this (MB) always
+                    pass
+    Returns:
+        comparison: <dict> "Rows" (stage, measure, baseline, current, change,
+                    regressed) and "Regressions" descriptions
+    '''
+    rows = []
+    regressions = []
+    measures = [
+        ('Seconds', 's', threshold, min_seconds),
+        ('Peak Memory MB', 'MB', memory_threshold, min_memory)]
+    for stage in STAGES:
+        for measure, unit, limit, minimum in measures:
+            before = baseline['Stages'].get(stage, {}).get(measure)
+            after = current['Stages'].get(stage, {}).get(measure)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before > 0 else 0.0
+            regressed = change > limit and after - before > minimum
+            rows.append({
+                'Stage': stage,
+                'Measure': measure,
+                'Unit': unit,
+                'Baseline': before,
+                'Current': after,
+                'Change': change,
+                'Regressed': regressed})
+            if regressed:
+                regressions.append(
+                    f'{stage} {measure}: {before:.4g} {unit} -> '
+                    f'{after:.4g} {unit} ({change:+.1%}, limit {limit:+.0%})')
+    return {'Rows': rows, 'Regressions': regressions}
+
+
+def format_comparison(comparison):
+    '''
+    Readable table of a baseline comparison.
+    Args:
+        comparison: <dict> compare_results output
+    Returns:
+        text: <string> table, one row per stage and measure
+    '''
+    lines = [
+        f'{"Stage":<16}{"Measure":<16}{"Baseline":>12}{"Current":>12}'
+        f'{"Change":>10}',
+        '-' * 66]
+    for row in comparison['Rows']:
+        flag = '  REGRESSED' if row['Regressed'] else ''
+        lines.append(
+            f'{row["Stage"]:<16}{row["Measure"]:<16}'
+            f'{row["Baseline"]:>12.4g}{row["Current"]:>12.4g}'
+            f'{row["Change"]:>+10.1%}{flag}')
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    '''
+    Command line options for the benchmark gate.
+    Args:
+        None
+    Returns:
+        arguments: <argparse.Namespace> parsed arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipeline stages on a synthetic workload '
+                    'and fail if any stage regresses against the baseline.')
+    parser.add_argument(
+        '--baseline',
+        default='Benchmark_baseline.json',
+        help='baseline results file')
+    parser.add_argument(
+        '--update-baseline',
+        action='store_true',
+        help='write this run as the new baseline instead of comparing')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.25,
+        help='allowed relative slow down per stage, 0.25 is 25 %%')
+    parser.add_argument(
+        '--memory-threshold',
+        type=float,
+        default=0.25,
+        help='allowed relative peak memory increase per stage')
+    parser.add_argument(
+        '--min-seconds',
+        type=float,
+        default=0.05,
+        help='slow downs below this many seconds always pass')
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=7,
+        help='timed runs, the median is kept per stage')
+    parser.add_argument(
+        '--kernel-backend',
+        default='NumPy',
+        choices=kernels.BACKENDS,
+        help='Drude kernel backend to benchmark')
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='also save this run to a json file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    root = Path(__file__).absolute().parent
+    kernels.set_backend(backend=arguments.kernel_backend)
+    info = io.load_json(file_path=Path(f'{root}/info.json'))
+    drude_parameters = io.load_json(
+        file_path=Path(f'{root}/Drude_parameters.json'))
+    baseline_path = Path(arguments.baseline)
+    baseline = None
+    if not arguments.update_baseline:
+        if not io.is_valid_json(file_path=baseline_path):
+            print(
+                f'No baseline at {baseline_path}, '
+                'run with --update-baseline to create one')
+            sys.exit(2)
+        baseline = io.load_json(file_path=baseline_path)
+        if baseline.get('Version') != BENCHMARK_VERSION:
+            print(
+                f'Baseline version {baseline.get("Version")} does not match '
+                f'benchmark version {BENCHMARK_VERSION}, rerun with '
+                '--update-baseline')
+            sys.exit(2)
+        workload = baseline['Workload']
+        if workload['Kernel Backend'] != kernels.get_backend():
+            print(
+                f'Baseline was run with the {workload["Kernel Backend"]} '
+                f'kernels, this run uses {kernels.get_backend()}')
+            sys.exit(2)
+
+    current = benchmark_pipeline(
+        info=info,
+        drude_parameters=drude_parameters,
+        batches=baseline['Workload']['Batches'] if baseline else 8,
+        gratings=baseline['Workload']['Gratings'] if baseline else 12,
+        repeats=arguments.repeats,
+        seed=baseline['Workload']['Seed'] if baseline else 0)
+    if arguments.output:
+        io.save_json_dicts(
+            out_path=arguments.output,
+            dictionary=current)
+    if arguments.update_baseline:
+        io.save_json_dicts(
+            out_path=baseline_path,
+            dictionary=current)
+        print(json.dumps(current['Stages'], indent=2))
+        print(f'Baseline written to {baseline_path}')
+        sys.exit(0)
+
+    comparison = compare_results(
+        baseline=baseline,
+        current=current,
+        threshold=arguments.threshold,
+        memory_threshold=arguments.memory_threshold,
+        min_seconds=arguments.min_seconds)
+    print(format_comparison(comparison=comparison))
+    for key, value in baseline['Environment'].items():
+        if current['Environment'].get(key) != value:
+            print(
+                f'Note: {key} differs from the baseline '
+                f'({value} -> {current["Environment"].get(key)})')
+    if comparison['Regressions']:
+        print(f'\n{len(comparison["Regressions"])} regression(s):')
+        for regression in comparison['Regressions']:
+            print(f'  {regression}')
+        sys.exit(1)
+    print('\nNo regressions')
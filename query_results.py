@@ -0,0 +1,84 @@
+import argparse
+import datetime
+import src.database as db
+
+
+def parse_arguments():
+    '''
+    Command line options for querying the results database.
+    Args:
+        None
+    Returns:
+        arguments: <argparse.Namespace> parsed arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Filter and export batches from the results database.')
+    parser.add_argument(
+        'database',
+        help='path to results database')
+    parser.add_argument(
+        '--where',
+        action='append',
+        default=[],
+        help='filter such as "Real Carrier Density > 1E26", repeatable')
+    parser.add_argument(
+        '--since',
+        default=None,
+        help='earliest fit time as an ISO date, e.g. 2026-09-01')
+    parser.add_argument(
+        '--until',
+        default=None,
+        help='latest fit time as an ISO date')
+    parser.add_argument(
+        '--days',
+        type=float,
+        default=None,
+        help='only batches fitted in the last N days')
+    parser.add_argument(
+        '--column',
+        action='append',
+        default=[],
+        help='parameter to include in the output, repeatable')
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=None,
+        help='maximum number of batches')
+    parser.add_argument(
+        '--export',
+        default=None,
+        help='write results to a .csv or .json file instead of printing')
+    parser.add_argument(
+        '--names',
+        action='store_true',
+        help='list queryable parameter names and exit')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    connection = db.connect_database(database_path=arguments.database)
+    if arguments.names:
+        for name in db.parameter_names(connection=connection):
+            print(name)
+    else:
+        since = arguments.since
+        if arguments.days is not None:
+            since = (
+                datetime.datetime.now()
+                - datetime.timedelta(days=arguments.days)).timestamp()
+        rows = db.query_batches(
+            connection=connection,
+            filters=[db.parse_filter(expression=w) for w in arguments.where],
+            since=since,
+            until=arguments.until,
+            columns=arguments.column,
+            limit=arguments.limit)
+        if arguments.export:
+            db.export_rows(
+                rows=rows,
+                out_path=arguments.export)
+        else:
+            for row in rows:
+                print(', '.join(f'{key}: {value}' for key, value in row.items()))
+    connection.close()
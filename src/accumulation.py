@@ -0,0 +1,222 @@
+import hashlib
+import numpy as np
+import src.analysis as anal
+
+from src.cache import DrudeCurveCache
+
+
+ELECTRON_CHARGE = 1.60217663E-19
+VACUUM_PERMITTIVITY = 8.854E-12
+
+''' Whole bias x sublayer x frequency arrays, so few entries and a byte cap '''
+profile_cache = DrudeCurveCache(
+    max_entries=8,
+    max_bytes=256 * 1024 ** 2)
+
+
+def accumulation_sheet_densities(bias_voltages,
+                                 oxide_permittivity,
+                                 oxide_thickness,
+                                 flatband_voltage=0.0):
+    '''
+    Sheet carrier density induced in the TCO by a bias across the gate
+    dielectric (parallel plate capacitor). Negative values deplete the film.
+    Args:
+        bias_voltages: <array> applied bias voltages in V
+        oxide_permittivity: <float> relative permittivity of gate dielectric
+        oxide_thickness: <float> gate dielectric thickness in nm
+        flatband_voltage: <float> flat band voltage in V
+    Returns:
+        sheet_densities: <array> induced sheet carrier densities in m^-2
+    '''
+    bias_voltages = np.atleast_1d(np.asarray(bias_voltages, dtype=float))
+    capacitance = (
+        VACUUM_PERMITTIVITY * oxide_permittivity / (oxide_thickness * 1E-9))
+    return capacitance * (bias_voltages - flatband_voltage) / ELECTRON_CHARGE
+
+
+def discretise_film(film_thickness,
+                    sublayers,
+                    accumulation_thickness=None):
+    '''
+    Split the TCO film into sublayers, ordered from the dielectric interface.
+    The first accumulation_thickness nm are divided into sublayers - 1 equal
+    slices and the remaining bulk forms the final sublayer. Without an
+    accumulation thickness the whole film is divided equally.
+    Args:
+        film_thickness: <float> TCO film thickness in nm
+        sublayers: <int> number of sublayers
+        accumulation_thickness: <float> thickness of the resolved region in nm
+    Returns:
+        boundaries: <array> sublayer boundary depths in nm, length
+                    sublayers + 1
+    '''
+    if accumulation_thickness is None or (
+            accumulation_thickness >= film_thickness or sublayers < 2):
+        return np.linspace(0, film_thickness, sublayers + 1)
+    return np.append(
+        np.linspace(0, accumulation_thickness, sublayers),
+        film_thickness)
+
+
+def carrier_profiles(background_density,
+                     sheet_densities,
+                     boundaries,
+                     screening_length):
+    '''
+    Depth-resolved carrier density for each bias. The induced sheet density is
+    distributed with an exponential (Thomas-Fermi) decay from the dielectric
+    interface, integrated exactly over each sublayer so the discretised
+    profile conserves the induced charge. Under strong depletion a sublayer
+    cannot go below zero carriers, so densities are clipped at zero and the
+    profile then holds less than the induced charge; bias_permittivities
+    reports the charge lost as "Clipped Sheet Densities".
+    Args:
+        background_density: <float> uniform film carrier density in m^-3
+        sheet_densities: <array> induced sheet densities in m^-2, shape (V,)
+        boundaries: <array> sublayer boundary depths in nm, shape (S + 1,)
+        screening_length: <float> screening length in nm
+    Returns:
+        profiles: <array> carrier density per sublayer in m^-3, shape (V, S)
+    '''
+    boundaries = np.asarray(boundaries, dtype=float)
+    decay = np.exp(-boundaries / screening_length)
+    fractions = (decay[:-1] - decay[1:]) / (decay[0] - decay[-1])
+    thicknesses = np.diff(boundaries) * 1E-9
+    induced = (
+        np.asarray(sheet_densities, dtype=float)[:, np.newaxis]
+        * (fractions / thicknesses)[np.newaxis, :])
+    return np.clip(background_density + induced, 0, None)
+
+
+def profile_permittivities(angular_frequency,
+                           profiles,
+                           effective_mass,
+                           epsilon_infinity,
+                           relaxation_time,
+                           mode='Approximate'):
+    '''
+    Map carrier profiles to complex Drude permittivity in one vectorised pass.
+    Results are cached per parameter set in profile_cache, bounded by entries
+    and bytes, and returned read-only.
+    Args:
+        angular_frequency: <array> angular frequencies in rad/s, shape (W,)
+        profiles: <array> carrier densities in m^-3, shape (V, S)
+        effective_mass: <float> effective mass material multiplier
+        epsilon_infinity: <float> high frequency permittivity
+        relaxation_time: <float> relaxation time of electrons
+        mode: <string> Drude form, "Full" or "Approximate"
+                (analysis.complex_drude_permittivity)
+    Returns:
+        permittivities: <array> complex permittivity, shape (V, S, W)
+    '''
+    profiles = np.ascontiguousarray(profiles, dtype=float)
+    angular_frequency = np.ascontiguousarray(angular_frequency, dtype=float)
+    profiles_hash = hashlib.sha1(profiles.tobytes()).hexdigest()
+
+    def evaluate():
+        return anal.complex_drude_permittivity(
+            x=angular_frequency,
+            carrier_density=profiles[..., np.newaxis],
+            effective_mass=effective_mass,
+            epsilon_infinity=epsilon_infinity,
+            relaxation_time=relaxation_time,
+            mode=mode)
+    return profile_cache.get_or_compute(
+        name=f'Profile Permittivities {mode} {profiles.shape} {profiles_hash}',
+        parameters=[effective_mass, epsilon_infinity, relaxation_time],
+        angular_frequency=angular_frequency,
+        function=evaluate)
+
+
+def accumulation_layers(boundaries,
+                        permittivities,
+                        name='TCO'):
+    '''
+    Convert sublayer permittivities into transfer-matrix layers, ordered from
+    the dielectric interface into the film. Each layer carries a (V, W)
+    permittivity so stack_response returns a (V, A, W) bias sweep. Reverse the
+    list when light reaches the film from the side away from the dielectric.
+    Args:
+        boundaries: <array> sublayer boundary depths in nm
+        permittivities: <array> complex permittivity, shape (V, S, W)
+        name: <string> layer name prefix
+    Returns:
+        layers: <array> layer dictionaries for stack_response
+    '''
+    return [
+        {
+            'Name': f'{name} {index}',
+            'Thickness': thickness,
+            'Permittivity': permittivities[:, index, :]}
+        for index, thickness in enumerate(np.diff(boundaries))]
+
+
+def bias_permittivities(bias_voltages,
+                        angular_frequency,
+                        background_density,
+                        effective_mass,
+                        epsilon_infinity,
+                        relaxation_time,
+                        film_thickness,
+                        oxide_permittivity,
+                        oxide_thickness,
+                        sublayers=50,
+                        screening_length=1.0,
+                        accumulation_thickness=None,
+                        flatband_voltage=0.0,
+                        mode='Approximate'):
+    '''
+    Bias-dependent accumulation layer model. Builds depth-resolved carrier
+    profiles for every bias voltage and maps them to Drude permittivity.
+    Args:
+        bias_voltages: <array> applied bias voltages in V, shape (V,)
+        angular_frequency: <array> angular frequencies in rad/s, shape (W,)
+        background_density: <float> film carrier density in m^-3
+        effective_mass: <float> effective mass material multiplier
+        epsilon_infinity: <float> high frequency permittivity
+        relaxation_time: <float> relaxation time of electrons
+        film_thickness: <float> TCO film thickness in nm
+        oxide_permittivity: <float> relative permittivity of gate dielectric
+        oxide_thickness: <float> gate dielectric thickness in nm
+        sublayers: <int> number of sublayers
+        screening_length: <float> screening length in nm
+        accumulation_thickness: <float> thickness of resolved region in nm
+        flatband_voltage: <float> flat band voltage in V
+        mode: <string> Drude form, "Full" or "Approximate"
+                (analysis.complex_drude_permittivity)
+    Returns:
+        accumulation: <dict> sublayer boundaries, sheet densities, carrier
+                        profiles, sheet densities lost to clipping depleted
+                        sublayers at zero (carrier_profiles), permittivities
+    '''
+    sheet_densities = accumulation_sheet_densities(
+        bias_voltages=bias_voltages,
+        oxide_permittivity=oxide_permittivity,
+        oxide_thickness=oxide_thickness,
+        flatband_voltage=flatband_voltage)
+    boundaries = discretise_film(
+        film_thickness=film_thickness,
+        sublayers=sublayers,
+        accumulation_thickness=accumulation_thickness)
+    profiles = carrier_profiles(
+        background_density=background_density,
+        sheet_densities=sheet_densities,
+        boundaries=boundaries,
+        screening_length=screening_length)
+    clipped_sheet_densities = sheet_densities - np.sum(
+        (profiles - background_density) * np.diff(boundaries) * 1E-9,
+        axis=1)
+    permittivities = profile_permittivities(
+        angular_frequency=angular_frequency,
+        profiles=profiles,
+        effective_mass=effective_mass,
+        epsilon_infinity=epsilon_infinity,
+        relaxation_time=relaxation_time,
+        mode=mode)
+    return {
+        'Sublayer Boundaries': boundaries,
+        'Sheet Densities': sheet_densities,
+        'Carrier Profiles': profiles,
+        'Clipped Sheet Densities': clipped_sheet_densities,
+        'Permittivities': permittivities}
@@ -1,8 +1,12 @@
 import math
 import numpy as np
 import scipy.optimize as opt
+import src.metrics as metrics
 
 
+''' What happens to a batch whose fits fail the "Fit Gates" '''
+FIT_GATE_ACTIONS = ['Skip Plot', 'Retry']
+
 def standard_quadrature(calculated_parameter,
                         variables,
                         errors):
@@ -125,13 +129,35 @@ def calc_permittivities(refractive_indices,
             e for e in imaginary_permittivities_errors]}
 
 
+def average_hall_mobility(mobilities,
+                          mobility_errors=None):
+    '''
+    Average repeated Hall mobility measurements. The error combines the
+    spread of the repeats with the mean instrument error in quadrature.
+    Args:
+        mobilities: <array> measured mobilities in cm2/Vs
+        mobility_errors: <array> instrument errors of the mobilities, optional
+    Returns:
+        mobility: <dict> mobility, mobility error in cm2/Vs
+    '''
+    mobility_error = np.std(mobilities)
+    if mobility_errors is not None:
+        mobility_error = math.sqrt(
+            mobility_error ** 2 + np.mean(mobility_errors) ** 2)
+    return {
+        'Mobility': float(np.mean(mobilities)),
+        'Mobility Error': float(mobility_error)}
+
+
 def calculate_carrier_concs(conductivity,
-                            mobility):
+                            mobility,
+                            mobility_error=0.0):
     '''
     Calculate carrier concentration from electron mobility and conductivity.
     Args:
         conductivity: <dict> conductivity dictionary
         mobility: <float> mobility in cm2/Vs
+        mobility_error: <float> mobility error in cm2/Vs
     Returns:
         carrier_density: <dict> carrier density, carrier error
     '''
@@ -140,8 +166,8 @@ def calculate_carrier_concs(conductivity,
         / (mobility * 1E-4 * 1.60217663E-19))
     carrier_error = standard_quadrature(
         calculated_parameter=carrier_density,
-        variables=[conductivity['Conductivity']],
-        errors=[conductivity['Conductivity Error']])
+        variables=[conductivity['Conductivity'], mobility],
+        errors=[conductivity['Conductivity Error'], mobility_error])
     return {
         'Carrier Density': carrier_density,
         'Carrier Error': carrier_error}
@@ -224,22 +250,78 @@ def get_real_guesses_bounds(carrier_density,
         'Real Bounds': bounds}
 
 
+def plasmafrequency_squared(carrier_density,
+                            effective_mass):
+    '''
+    Calculate the squared plasma frequency from the Drude model.
+    Args:
+        carrier_density: <float/array> free carrier density in m-3
+        effective_mass: <float/array> elemental effective mass
+    Returns:
+        plasma_frequency_squared: <float/array> squared plasma frequency
+    '''
+    return (
+        (carrier_density * (1.60217663E-19 ** 2))
+        / (8.854E-12 * effective_mass * 9.11E-31))
+
+
 def plasmafrequency(carrier_density,
                     effective_mass):
     '''
     Calculate the plasma frequency from the Drude model.
     Args:
-        carrier_density: <float> free carrier density in m-3
-        effective_mass: <float> elemental effective mass
+        carrier_density: <float/array> free carrier density in m-3
+        effective_mass: <float/array> elemental effective mass
     Returns:
-        plasma_frequency: <float> plasma frequency
+        plasma_frequency: <float/array> plasma frequency
     '''
-    plasma_frequency = math.sqrt(
-        (carrier_density * (1.60217663E-19 ** 2))
-        / (8.854E-12 * effective_mass * 9.11E-31))
+    plasma_frequency = np.sqrt(plasmafrequency_squared(
+        carrier_density=carrier_density,
+        effective_mass=effective_mass))
     return plasma_frequency
 
 
+def complex_drude_permittivity(x,
+                               carrier_density,
+                               effective_mass,
+                               epsilon_infinity,
+                               relaxation_time,
+                               mode='Full'):
+    '''
+    Complex Drude permittivity in a single pass, with the squared plasma
+    frequency computed once per parameter set. Parameters broadcast against x,
+    so many parameter sets can be evaluated at once.
+    Modes:
+        "Full": eps_inf (1 - wp^2 / (w^2 + i w tau)), the complete Drude form
+        "Approximate": eps_inf (1 - wp^2 / w^2) + i eps_inf wp^2 / (w tau),
+            real_drude_equation and imag_drude_equation as used by the fits.
+            This is not one limit of the full form: the real part is its low
+            damping limit (tau << w) and the imaginary part its opposite,
+            tau >> w, limit, so the pair is not Kramers-Kronig consistent
+    Args:
+        x: <float/array> angular frequency
+        carrier_density: <float/array> carrier density in m^-3
+        effective_mass: <float/array> effective mass material multiplier
+        epsilon_infinity: <float/array> high frequency permittivity
+        relaxation_time: <float/array> relaxation time of electrons (1/T where
+                        T is time between collisions)
+        mode: <string> "Full" or "Approximate"
+    Returns:
+        drude: <complex array> complex drude permittivity
+    '''
+    screened_plasma = epsilon_infinity * plasmafrequency_squared(
+        carrier_density=carrier_density,
+        effective_mass=effective_mass)
+    if mode == 'Full':
+        return epsilon_infinity - screened_plasma / (
+            x ** 2 + 1j * x * relaxation_time)
+    if mode == 'Approximate':
+        return (
+            epsilon_infinity - screened_plasma / x ** 2
+            + 1j * screened_plasma / (x * relaxation_time))
+    raise ValueError(f'Unknown Drude mode "{mode}"')
+
+
 def real_drude_equation(x,
                         plasma_frequency,
                         epsilon_infinity):
@@ -302,19 +384,24 @@ def optimize_real_drude(angular_frequency,
                             and epsilon infinity
         bounds: <tuple> (lower, upper) error bounds
     Returns:
-        results: <dict> popt, sqrt(diag(pcov)) from optimizer
+        results: <dict> popt, sqrt(diag(pcov)), pcov from optimizer
     '''
-    popt, pcov = opt.curve_fit(
+    popt, pcov, infodict, _, _ = opt.curve_fit(
         f=real_drude_permittivity,
         xdata=angular_frequency,
         ydata=real_permittivity,
         p0=initial_guesses,
         sigma=real_permittivity_error,
-        bounds=bounds)
+        bounds=bounds,
+        full_output=True)
+    metrics.count_fit(
+        fit='Real',
+        evaluations=infodict['nfev'])
     errors = np.sqrt(np.diag(pcov))
     return {
         'Real Results': [result for result in popt],
-        'Real Errors': [error for error in errors]}
+        'Real Errors': [error for error in errors],
+        'Real Covariance': pcov.tolist()}
 
 
 def get_imag_guesses_bounds(variables,
@@ -421,16 +508,130 @@ def optimize_imag_drude(angular_frequency,
                         mass and epsilon infinity
         bounds: <tuple> (lower, upper) error bounds
     Returns:
-        results: <dict> popt, sqrt(diag(pcov)) from optimizer
+        results: <dict> popt, sqrt(diag(pcov)), pcov from optimizer
     '''
-    popt, pcov = opt.curve_fit(
+    popt, pcov, infodict, _, _ = opt.curve_fit(
         f=imag_drude_permittivity,
         xdata=angular_frequency,
         ydata=imag_permittivity,
         p0=initial_guesses,
         sigma=imag_permittivity_error,
-        bounds=bounds)
+        bounds=bounds,
+        full_output=True)
+    metrics.count_fit(
+        fit='Imaginary',
+        evaluations=infodict['nfev'])
     errors = np.sqrt(np.diag(pcov))
     return {
         'Imaginary Results': [result for result in popt],
-        'Imaginary Errors': [error for error in errors]}
+        'Imaginary Errors': [error for error in errors],
+        'Imaginary Covariance': pcov.tolist()}
+
+
+def fit_diagnostics(prefix,
+                    model,
+                    angular_frequency,
+                    permittivity,
+                    permittivity_error,
+                    variable_names,
+                    results,
+                    covariance,
+                    bounds,
+                    bound_tolerance=1E-3):
+    '''
+    Goodness of fit diagnostics for an optimizer result, evaluated on all data
+    points at once. The covariance condition number is taken from the
+    correlation matrix so that it does not depend on parameter units.
+    Args:
+        prefix: <string> "Real" or "Imaginary", prefixes the dictionary keys
+        model: <function> fitted model, model(x, *results)
+        angular_frequency: <array> angular frequency values of x data points
+        permittivity: <array> permittivity values of x data points
+        permittivity_error: <array> permittivity errors of x data points
+        variable_names: <array> fitted variable names
+        results: <array> popt array from optimizer
+        covariance: <array> pcov array from optimizer
+        bounds: <tuple> (lower, upper) bounds used by the optimizer
+        bound_tolerance: <float> fraction of the bound range within which a
+                        parameter counts as at its bound
+    Returns:
+        diagnostics: <dict> reduced chi squared, residual norm, covariance
+                    condition number and names of parameters at bounds
+    '''
+    x = np.asarray(angular_frequency, dtype=float)
+    y = np.asarray(permittivity, dtype=float)
+    sigma = np.asarray(permittivity_error, dtype=float)
+    popt = np.asarray(results, dtype=float)
+    pcov = np.asarray(covariance, dtype=float)
+    residuals = y - model(x, *popt)
+    degrees_of_freedom = y.size - popt.size
+    chi_squared = np.sum((residuals / sigma) ** 2)
+    if degrees_of_freedom > 0:
+        reduced_chi_squared = chi_squared / degrees_of_freedom
+    else:
+        reduced_chi_squared = np.nan
+    lowers, uppers = (np.asarray(bound, dtype=float) for bound in bounds)
+    margin = bound_tolerance * (uppers - lowers)
+    at_bounds = (popt - lowers <= margin) | (uppers - popt <= margin)
+    if np.all(np.isfinite(pcov)):
+        scale = np.sqrt(np.abs(np.diag(pcov)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = pcov / np.outer(scale, scale)
+        condition = (
+            np.linalg.cond(correlation)
+            if np.all(np.isfinite(correlation)) else np.inf)
+    else:
+        condition = np.inf
+    return {
+        f'{prefix} Reduced Chi Squared': float(reduced_chi_squared),
+        f'{prefix} Residual Norm': float(np.linalg.norm(residuals)),
+        f'{prefix} Covariance Condition': float(condition),
+        f'{prefix} Parameters At Bounds': [
+            name for name, bound in zip(variable_names, at_bounds) if bound]}
+
+
+def fit_gate_failures(prefix,
+                      diagnostics,
+                      fit_gates):
+    '''
+    Check fit diagnostics against the user set fit quality gates. Gates that
+    are not set, and diagnostics that are undefined (no degrees of freedom),
+    always pass.
+    Args:
+        prefix: <string> "Real" or "Imaginary"
+        diagnostics: <dict> diagnostics from fit_diagnostics
+        fit_gates: <dict> user set gates (Drude_parameters.json "Fit Gates")
+    Returns:
+        failures: <array> descriptions of failed gates, empty if the fit passes
+    '''
+    failures = []
+    limits = [
+        ('Max Reduced Chi Squared', 'Reduced Chi Squared'),
+        ('Max Residual Norm', 'Residual Norm'),
+        ('Max Covariance Condition', 'Covariance Condition')]
+    for gate, key in limits:
+        limit = fit_gates.get(gate)
+        value = diagnostics[f'{prefix} {key}']
+        if limit is not None and not np.isnan(value) and value > limit:
+            failures.append(f'{prefix} {key} {value:.3g} > {limit:.3g}')
+    at_bounds = diagnostics[f'{prefix} Parameters At Bounds']
+    if not fit_gates.get('Allow Parameters At Bounds', True) and at_bounds:
+        failures.append(
+            f'{prefix} parameters at bounds: {", ".join(at_bounds)}')
+    return failures
+
+
+def fit_gate_action(fit_gates):
+    '''
+    Action for batches failing the fit gates, "Skip Plot" unless set.
+    Args:
+        fit_gates: <dict> user set gates (Drude_parameters.json "Fit Gates")
+    Returns:
+        action: <string> one of FIT_GATE_ACTIONS
+    '''
+    action = fit_gates.get('Action') or 'Skip Plot'
+    if action not in FIT_GATE_ACTIONS:
+        raise ValueError(
+            f'Unknown fit gate action "{action}", '
+            f'choose from {", ".join(FIT_GATE_ACTIONS)}')
+    return action
@@ -0,0 +1,229 @@
+import hashlib
+import threading
+import numpy as np
+import src.analysis as anal
+
+from collections import OrderedDict
+
+
+class DrudeCurveCache:
+    '''
+    Bounded least recently used cache of evaluated Drude curves. Entries are
+    keyed by (curve name, rounded parameters, rounded frequency grid) and
+    evicted once either the entry count or the total array size exceeds its
+    limit. Cached arrays are returned read-only.
+    '''
+    def __init__(self,
+                 max_entries=256,
+                 max_bytes=64 * 1024 ** 2,
+                 significant_figures=9):
+        '''
+        Args:
+            max_entries: <int> maximum number of cached curves
+            max_bytes: <int> maximum total size of cached arrays in bytes
+            significant_figures: <int> parameters and grids are rounded to this
+                                    many significant figures to form keys
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.significant_figures = significant_figures
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self,
+                 name,
+                 parameters,
+                 angular_frequency):
+        '''
+        Cache key from curve name, parameters and frequency grid, rounded to
+        the cache significant figures.
+        Args:
+            name: <string> curve identifier
+            parameters: <array> curve parameters
+            angular_frequency: <array> angular frequency grid
+        Returns:
+            key: <tuple> hashable cache key
+        '''
+        digits = self.significant_figures - 1
+        rounded_parameters = tuple(
+            f'{float(parameter):.{digits}e}' for parameter in parameters)
+        grid = np.asarray(angular_frequency, dtype=float)
+        scale = np.max(np.abs(grid)) if grid.size else 1.0
+        rounded_grid = np.round(grid / (scale or 1.0), digits)
+        grid_hash = hashlib.sha1(rounded_grid.tobytes()).hexdigest()
+        return (name, rounded_parameters, grid.shape, grid_hash)
+
+    def get_or_compute(self,
+                       name,
+                       parameters,
+                       angular_frequency,
+                       function):
+        '''
+        Return the cached curve for the key or evaluate function(), store it
+        and evict least recently used entries beyond the limits.
+        Args:
+            name: <string> curve identifier
+            parameters: <array> curve parameters
+            angular_frequency: <array> angular frequency grid
+            function: <callable> no-argument function evaluating the curve
+        Returns:
+            curve: <array> read-only curve array
+        '''
+        key = self.make_key(
+            name=name,
+            parameters=parameters,
+            angular_frequency=angular_frequency)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        curve = np.array(function())
+        curve.setflags(write=False)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = curve
+                self.current_bytes += curve.nbytes
+            while self._entries and (
+                    len(self._entries) > self.max_entries
+                    or self.current_bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return curve
+
+    def clear(self):
+        '''
+        Empty the cache and reset statistics.
+        Args:
+            None
+        Returns:
+            None
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.current_bytes = 0
+
+    def statistics(self):
+        '''
+        Cache hit/miss statistics.
+        Args:
+            None
+        Returns:
+            statistics: <dict> hits, misses, hit rate, evictions, entries, bytes
+        '''
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'Cache Hits': self.hits,
+                'Cache Misses': self.misses,
+                'Cache Hit Rate': self.hits / requests if requests else 0.0,
+                'Cache Evictions': self.evictions,
+                'Cache Entries': len(self._entries),
+                'Cache Bytes': self.current_bytes}
+
+
+curve_cache = DrudeCurveCache()
+
+
+def real_drude_curve(angular_frequency,
+                     real_results,
+                     cache=curve_cache):
+    '''
+    Cached real Drude permittivity curve for a fitted parameter set.
+    Args:
+        angular_frequency: <array> angular frequencies in rad/s
+        real_results: <array> carrier density, effective mass, epsilon infinity
+        cache: <DrudeCurveCache> cache to use, None to evaluate directly
+    Returns:
+        drude_permittivity: <array> real permittivity at each frequency
+    '''
+    angular_frequency = np.asarray(angular_frequency, dtype=float)
+
+    def evaluate():
+        return anal.real_drude_permittivity(
+            x=angular_frequency,
+            carrier_density=real_results[0],
+            effective_mass=real_results[1],
+            epsilon_infinity=real_results[2])
+    if cache is None:
+        return evaluate()
+    return cache.get_or_compute(
+        name='Real Drude',
+        parameters=real_results,
+        angular_frequency=angular_frequency,
+        function=evaluate)
+
+
+def imag_drude_curve(angular_frequency,
+                     imag_results,
+                     cache=curve_cache):
+    '''
+    Cached imaginary Drude permittivity curve for a fitted parameter set.
+    Args:
+        angular_frequency: <array> angular frequencies in rad/s
+        imag_results: <array> carrier density, effective mass, epsilon
+                        infinity, relaxation time
+        cache: <DrudeCurveCache> cache to use, None to evaluate directly
+    Returns:
+        drude_permittivity: <array> imaginary permittivity at each frequency
+    '''
+    angular_frequency = np.asarray(angular_frequency, dtype=float)
+
+    def evaluate():
+        return anal.imag_drude_permittivity(
+            x=angular_frequency,
+            carrier_density=imag_results[0],
+            effective_mass=imag_results[1],
+            epsilon_infinity=imag_results[2],
+            relaxation_time=imag_results[3])
+    if cache is None:
+        return evaluate()
+    return cache.get_or_compute(
+        name='Imaginary Drude',
+        parameters=imag_results,
+        angular_frequency=angular_frequency,
+        function=evaluate)
+
+
+def complex_drude_curve(angular_frequency,
+                        results,
+                        mode='Full',
+                        cache=curve_cache):
+    '''
+    Cached complex Drude permittivity curve for one parameter set, evaluated
+    in a single pass (analysis.complex_drude_permittivity).
+    Args:
+        angular_frequency: <array> angular frequencies in rad/s
+        results: <array> carrier density, effective mass, epsilon infinity,
+                    relaxation time
+        mode: <string> Drude form, "Full" or "Approximate"
+        cache: <DrudeCurveCache> cache to use, None to evaluate directly
+    Returns:
+        drude_permittivity: <array> complex permittivity at each frequency
+    '''
+    angular_frequency = np.asarray(angular_frequency, dtype=float)
+
+    def evaluate():
+        return anal.complex_drude_permittivity(
+            x=angular_frequency,
+            carrier_density=results[0],
+            effective_mass=results[1],
+            epsilon_infinity=results[2],
+            relaxation_time=results[3],
+            mode=mode)
+    if cache is None:
+        return evaluate()
+    return cache.get_or_compute(
+        name=f'{mode} Complex Drude',
+        parameters=results,
+        angular_frequency=angular_frequency,
+        function=evaluate)
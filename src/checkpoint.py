@@ -0,0 +1,87 @@
+import time
+
+from pathlib import Path
+from src.fileIO import append_json_line, is_valid_json, load_json_lines
+
+
+def journal_path(results_path,
+                 worker=None):
+    '''
+    Path to the run checkpoint journal in the results directory. Job queue
+    workers may share the results directory on a filesystem without file
+    locking, so each worker keeps its own journal; the queue database is
+    the shared record of batch state.
+    Args:
+        results_path: <string> path to results directory
+        worker: <string> job queue worker name, None outside queue mode
+    Returns:
+        journal_path: <Path> path to journal file
+    '''
+    if worker is not None:
+        return Path(f'{results_path}/run_journal_{worker}.jsonl')
+    return Path(f'{results_path}/run_journal.jsonl')
+
+
+def append_journal(journal_path,
+                   batch,
+                   status,
+                   outputs=()):
+    '''
+    Append one record to the checkpoint journal and flush it to disk. The
+    journal is append-only, one json object per line, so a crash can at worst
+    truncate the final line, which is terminated before the next record.
+    Args:
+        journal_path: <string> path to journal file
+        batch: <string> batch name
+        status: <string> "Started", "Completed", "Rejected", or "Failed"
+        outputs: <array> paths of files written for the batch
+    Returns:
+        None
+    '''
+    append_json_line(
+        file_path=journal_path,
+        record={
+            'Batch Name': f'{batch}',
+            'Status': status,
+            'Time': time.time(),
+            'Outputs': [f'{output}' for output in outputs]})
+
+
+def load_journal(journal_path):
+    '''
+    Latest journal record for every batch. Lines that do not parse (a record
+    cut short by a crash) are ignored.
+    Args:
+        journal_path: <string> path to journal file
+    Returns:
+        records: <dict> batch name: latest record
+    '''
+    return {
+        record['Batch Name']: record
+        for record in load_json_lines(file_path=journal_path)}
+
+
+def batch_finished(records,
+                   batch,
+                   results_file):
+    '''
+    Decide whether a batch can be skipped on resume. A batch journalled as
+    completed is finished if all of its recorded outputs still exist and its
+    results file parses. A batch that was started but never completed is
+    recomputed whatever files it left behind. Results from runs before the
+    journal existed are accepted only if the json parses completely.
+    Args:
+        records: <dict> journal records from load_journal
+        batch: <string> batch name
+        results_file: <string> path to batch json results file
+    Returns:
+        finished: <bool>
+    '''
+    record = records.get(f'{batch}')
+    if record is None:
+        return is_valid_json(file_path=results_file)
+    if record['Status'] != 'Completed':
+        return False
+    return (
+        all(Path(output).is_file() for output in record['Outputs'])
+        and is_valid_json(file_path=results_file))
@@ -0,0 +1,276 @@
+import csv
+import json
+import time
+import socket
+import sqlite3
+import numpy as np
+
+from datetime import datetime, timezone
+from src.fileIO import convert
+
+
+OPERATORS = ['<=', '>=', '!=', '<', '>', '=']
+
+
+def connect_database(database_path):
+    '''
+    Open (and create if needed) the indexed SQLite results database.
+    Args:
+        database_path: <string> path to database file
+    Returns:
+        connection: <sqlite3.Connection> database connection
+    '''
+    connection = sqlite3.connect(f'{database_path}', timeout=60)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(
+        'CREATE TABLE IF NOT EXISTS batches ('
+        'batch TEXT PRIMARY KEY, '
+        'parent TEXT, '
+        'fitted REAL NOT NULL, '
+        'host TEXT, '
+        'results_file TEXT, '
+        'dictionary TEXT NOT NULL);'
+        'CREATE TABLE IF NOT EXISTS parameters ('
+        'batch TEXT NOT NULL REFERENCES batches (batch) ON DELETE CASCADE, '
+        'name TEXT NOT NULL, '
+        'value REAL, '
+        'error REAL, '
+        'PRIMARY KEY (batch, name));'
+        'CREATE INDEX IF NOT EXISTS parameters_name_value '
+        'ON parameters (name, value);'
+        'CREATE INDEX IF NOT EXISTS batches_fitted ON batches (fitted);')
+    return connection
+
+
+def is_number(value):
+    '''
+    Check value is a real number (not a bool).
+    Args:
+        value: <object> value to check
+    Returns:
+        number: <bool>
+    '''
+    return (
+        isinstance(value, (int, float, np.integer, np.floating))
+        and not isinstance(value, (bool, np.bool_)))
+
+
+def batch_parameters(dictionary):
+    '''
+    Extract queryable scalar parameters from a batch results dictionary,
+    keyed exactly as save_json_dicts writes them. Scalars pick up their
+    "<key> Error" partner; fitted result lists are expanded as
+    "<Real/Imaginary/Model> <variable name>" with their optimizer errors.
+    Args:
+        dictionary: <dict> batch results dictionary
+    Returns:
+        parameters: <dict> name: (value, error)
+    '''
+    parameters = {}
+    for key, value in dictionary.items():
+        if key.endswith(' Error') or not is_number(value):
+            continue
+        error = dictionary.get(f'{key} Error')
+        parameters[key] = (float(value), float(error) if is_number(error)
+                           else None)
+    for prefix in ['Real', 'Imaginary', 'Model']:
+        names = dictionary.get(f'{prefix} Variable Names', [])
+        results = dictionary.get(f'{prefix} Results', [])
+        errors = dictionary.get(f'{prefix} Errors', [None] * len(results))
+        for name, value, error in zip(names, results, errors):
+            parameters[f'{prefix} {name}'] = (
+                float(value),
+                float(error) if is_number(error) else None)
+    return parameters
+
+
+def insert_batch(connection,
+                 batch,
+                 dictionary,
+                 results_file=None,
+                 parent=None):
+    '''
+    Write one batch's inputs, fitted parameters, covariances and provenance.
+    Re-inserting a batch replaces the previous record.
+    Args:
+        connection: <sqlite3.Connection> database connection
+        batch: <string> batch name
+        dictionary: <dict> batch results dictionary
+        results_file: <string> path of the batch json results file
+        parent: <string> parent directory identifier
+    Returns:
+        None
+    '''
+    parameters = batch_parameters(dictionary=dictionary)
+    with connection:
+        connection.execute(
+            'DELETE FROM parameters WHERE batch = ?',
+            (f'{batch}',))
+        connection.execute(
+            'INSERT OR REPLACE INTO batches '
+            '(batch, parent, fitted, host, results_file, dictionary) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                f'{batch}',
+                parent,
+                time.time(),
+                socket.gethostname(),
+                None if results_file is None else f'{results_file}',
+                json.dumps(dictionary, default=convert)))
+        connection.executemany(
+            'INSERT INTO parameters (batch, name, value, error) '
+            'VALUES (?, ?, ?, ?)',
+            [
+                (f'{batch}', name, value, error)
+                for name, (value, error) in parameters.items()])
+
+
+def parse_filter(expression):
+    '''
+    Parse a filter string such as "Real Carrier Density > 1E26".
+    Args:
+        expression: <string> "<parameter name> <operator> <value>"
+    Returns:
+        filter: <tuple> (name, operator, value)
+    '''
+    for operator in OPERATORS:
+        if operator in expression:
+            name, value = expression.split(operator, 1)
+            return name.strip(), operator, float(value)
+    raise ValueError(f'No comparison operator in filter "{expression}"')
+
+
+def to_timestamp(value):
+    '''
+    Convert an ISO date/datetime string or number to a unix timestamp.
+    Args:
+        value: <string/float> ISO date or unix timestamp
+    Returns:
+        timestamp: <float> unix timestamp
+    '''
+    if is_number(value):
+        return float(value)
+    moment = datetime.fromisoformat(f'{value}')
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment.timestamp()
+
+
+def query_batches(connection,
+                  filters=(),
+                  since=None,
+                  until=None,
+                  columns=(),
+                  limit=None):
+    '''
+    Find batches matching every filter, e.g.
+    query_batches(connection, [('Real Carrier Density', '>', 1E26)],
+                  since='2026-09-01').
+    Args:
+        connection: <sqlite3.Connection> database connection
+        filters: <array> (parameter name, operator, value) tuples
+        since: <string/float> earliest fit time (ISO date or unix time)
+        until: <string/float> latest fit time (ISO date or unix time)
+        columns: <array> parameter names to return with each batch
+        limit: <int> maximum number of batches
+    Returns:
+        rows: <array> dictionaries of batch name, fit time, host and columns
+    '''
+    ''' One left join per requested column pivots parameters into the row '''
+    selected = ['batches.batch', 'batches.fitted', 'batches.host']
+    joins = []
+    arguments = []
+    for index, name in enumerate(columns):
+        selected.extend([
+            f'column{index}.value AS value{index}',
+            f'column{index}.error AS error{index}'])
+        joins.append(
+            f'LEFT JOIN parameters AS column{index} '
+            f'ON column{index}.batch = batches.batch '
+            f'AND column{index}.name = ?')
+        arguments.append(name)
+    clauses = []
+    for name, operator, value in filters:
+        if operator not in OPERATORS:
+            raise ValueError(f'Unknown operator "{operator}"')
+        clauses.append(
+            'batches.batch IN (SELECT batch FROM parameters '
+            f'WHERE name = ? AND value {operator} ?)')
+        arguments.extend([name, value])
+    if since is not None:
+        clauses.append('batches.fitted >= ?')
+        arguments.append(to_timestamp(value=since))
+    if until is not None:
+        clauses.append('batches.fitted <= ?')
+        arguments.append(to_timestamp(value=until))
+    statement = ' '.join(
+        [f'SELECT {", ".join(selected)} FROM batches'] + joins)
+    if clauses:
+        statement += ' WHERE ' + ' AND '.join(clauses)
+    statement += ' ORDER BY batches.fitted DESC'
+    if limit is not None:
+        statement += f' LIMIT {int(limit)}'
+    ''' Plain tuples, sqlite3.Row lookups by name dominate large queries '''
+    cursor = connection.cursor()
+    cursor.row_factory = None
+    keys = ['Batch Name', 'Fitted', 'Host']
+    for name in columns:
+        keys.extend([name, f'{name} Error'])
+    rows = []
+    for row in cursor.execute(statement, arguments):
+        row = dict(zip(keys, row))
+        row['Fitted'] = datetime.fromtimestamp(
+            row['Fitted'], tz=timezone.utc).isoformat()
+        rows.append(row)
+    return rows
+
+
+def load_batch(connection,
+               batch):
+    '''
+    Full results dictionary stored for a batch.
+    Args:
+        connection: <sqlite3.Connection> database connection
+        batch: <string> batch name
+    Returns:
+        dictionary: <dict> batch results dictionary, None if not stored
+    '''
+    row = connection.execute(
+        'SELECT dictionary FROM batches WHERE batch = ?',
+        (f'{batch}',)).fetchone()
+    return None if row is None else json.loads(row['dictionary'])
+
+
+def parameter_names(connection):
+    '''
+    All parameter names stored in the database.
+    Args:
+        connection: <sqlite3.Connection> database connection
+    Returns:
+        names: <array> sorted parameter names
+    '''
+    return [
+        row['name'] for row in connection.execute(
+            'SELECT DISTINCT name FROM parameters ORDER BY name')]
+
+
+def export_rows(rows,
+                out_path):
+    '''
+    Export query rows to csv, or json if out_path ends in .json.
+    Args:
+        rows: <array> query rows from query_batches
+        out_path: <string> path to save
+    Returns:
+        None
+    '''
+    if f'{out_path}'.endswith('.json'):
+        with open(out_path, 'w') as outfile:
+            json.dump(rows, outfile, indent=2, default=convert)
+            outfile.write('\n')
+        return
+    fieldnames = list(rows[0].keys()) if rows else ['Batch Name']
+    with open(out_path, 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
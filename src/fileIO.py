@@ -1,7 +1,12 @@
+import os
+import csv
 import json
 import math
 import numpy as np
 
+from pathlib import Path
+from contextlib import contextmanager
+
 
 def load_json(file_path):
     '''
@@ -24,23 +29,106 @@ def convert(o):
     raise TypeError
 
 
+@contextmanager
+def atomic_write(out_path):
+    '''
+    Write to a temporary file beside out_path and rename it over out_path only
+    once writing has finished, so readers and later runs never see a partially
+    written file. The temporary file is removed if writing fails.
+    Args:
+        out_path: <string> path to final file
+    Returns:
+        temporary_path: <Path> path to write to inside the with block
+    '''
+    out_path = Path(out_path)
+    temporary_path = out_path.with_name(f'.{out_path.name}.{os.getpid()}.tmp')
+    try:
+        yield temporary_path
+        os.replace(temporary_path, out_path)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+
+
 def save_json_dicts(out_path,
                     dictionary):
     '''
-    Save dictionary to json file.
+    Save dictionary to json file. The file is written atomically.
     Args:
         out_path: <string> path to file, including file name and extension
         dictionary: <dict> python dictionary to save out
     Returns:
         None
     '''
-    with open(out_path, 'w') as outfile:
-        json.dump(
-            dictionary,
-            outfile,
-            indent=2,
-            default=convert)
-        outfile.write('\n')
+    with atomic_write(out_path=out_path) as temporary_path:
+        with open(temporary_path, 'w') as outfile:
+            json.dump(
+                dictionary,
+                outfile,
+                indent=2,
+                default=convert)
+            outfile.write('\n')
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+
+def append_json_line(file_path,
+                     record):
+    '''
+    Append one record as a json line and flush it to disk. A line cut short by
+    a crash is terminated before the next record is written, so at worst the
+    final line of the file is lost.
+    Args:
+        file_path: <string> path to json lines file
+        record: <dict> record to append
+    Returns:
+        None
+    '''
+    with open(file_path, 'a+b') as file:
+        line = json.dumps(record, default=convert) + '\n'
+        if file.tell() > 0:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                line = '\n' + line
+        file.write(line.encode())
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def load_json_lines(file_path):
+    '''
+    Load every record of a json lines file. Lines that do not parse (a record
+    cut short by a crash) are ignored.
+    Args:
+        file_path: <string> path to json lines file
+    Returns:
+        records: <array> records in file order, empty if no file
+    '''
+    records = []
+    if not Path(file_path).is_file():
+        return records
+    with open(file_path, 'r') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def is_valid_json(file_path):
+    '''
+    Check a json file exists and parses completely.
+    Args:
+        file_path: <string> path to file
+    Returns:
+        valid: <bool>
+    '''
+    try:
+        load_json(file_path=file_path)
+    except (OSError, ValueError):
+        return False
+    return True
 
 
 def load_sheet_resistance(file_path):
@@ -59,6 +147,42 @@ def load_sheet_resistance(file_path):
     return sheet_resistances
 
 
+def load_hall_measurements(file_path):
+    '''
+    Load Hall mobilities from an instrument csv export with a header row. The
+    mobility column is the first whose name starts with "Mobility" (units may
+    follow, e.g. "Mobility (cm2/Vs)"), and a column naming both mobility and
+    error, if any, holds its errors. Case is ignored and the sign of the
+    mobility (carrier type) is dropped.
+    Args:
+        file_path: <string> path to file
+    Returns:
+        hall_measurements: <dict> mobilities in cm2/Vs and their errors (None
+                            when the file has no error column)
+    '''
+    with open(file_path, 'r', newline='') as file:
+        rows = [row for row in csv.reader(file) if row]
+    if len(rows) < 2:
+        raise ValueError(f'No Hall measurements in {file_path}')
+    header = [name.strip().lower() for name in rows[0]]
+    error_columns = [
+        index for index, name in enumerate(header)
+        if 'mobility' in name and 'err' in name]
+    mobility_columns = [
+        index for index, name in enumerate(header)
+        if name.startswith('mobility') and index not in error_columns]
+    if not mobility_columns:
+        raise ValueError(f'No mobility column in {file_path}')
+    columns = mobility_columns[:1] + error_columns[:1]
+    values = np.array([
+        [float(row[index]) for index in columns]
+        for row in rows[1:]])
+    return {
+        'Mobility': np.abs(values[:, 0]),
+        'Mobility Error': (
+            np.abs(values[:, 1]) if error_columns else None)}
+
+
 def get_refractiveindex(grating_name,
                         grating_dictionary):
     '''
@@ -1,26 +1,8 @@
 import os
 
+from fnmatch import fnmatch
 from pathlib import Path
-from sys import platform
 from src.fileIO import load_json
-from src.GUI import prompt_for_path
-
-
-def check_platform():
-    '''
-    Check operating system.
-    Args:
-        None
-    Returns:
-        operating_system: <string> "Windows", "Linux", or "Mac"
-    '''
-    if platform == 'linux' or platform == 'linux2':
-        operating_system = 'Linux'
-    elif platform == 'darwin':
-        operating_system = 'Mac'
-    elif platform == 'win32':
-        operating_system = 'Windows'
-    return operating_system
 
 
 def get_directory_paths(root_path):
@@ -42,158 +24,170 @@ def get_directory_paths(root_path):
     return info, directory_paths
 
 
-def extractfile(directory_path,
-                file_string):
+def split_sample_strings(parent_directory,
+                         file_name):
     '''
-    Pull file from directory path.
+    Split file name into primary and secondary strings. S4 files keep every
+    remaining field in the secondary string, other files only the second.
     Args:
-        directory_path: <string> path to file
-        file_string: <string> string contained within file name
+        parent_directory: <string> file type, the catalogued directory name
+                            (e.g. "4PP" or "S4", not a sub-directory)
+        file_name: <string> file name without path or extensions
     Returns:
-        array: <array> array of selected files
+        primary_string: <string> batch identifier
+        secondary_string: <string> sample identifier within the batch
     '''
-    directory_list = sorted(os.listdir(directory_path))
-    return [file for file in directory_list if file_string in file]
+    file_split = file_name.split('_')
+    if parent_directory == 'S4':
+        secondary_string = '_'.join(file_split[1:])
+    else:
+        secondary_string = file_split[1] if len(file_split) > 1 else ''
+    return file_split[0], secondary_string
 
 
-def get_files_paths(directory_path,
-                    file_string):
+def catalogue_entry(file_path,
+                    stat_result,
+                    parent_directory=None):
     '''
-    Get target files and directory paths depending on the operating system.
+    Catalogue entry for one file, parsed once. The parent directory names the
+    file type, so files in sub-directories of a recursive search are given
+    the name of the catalogued directory rather than their own folder.
     Args:
-        directory_path: <string> path to data directory
-        file_string: <string> file extension (e.g. .csv)
+        file_path: <string> path to file
+        stat_result: <os.stat_result> file status
+        parent_directory: <string> catalogued directory name (e.g. "S4"),
+                            defaults to the directory holding the file
     Returns:
-        file_paths: <string> path to files
-    '''
-    operating_system = check_platform()
-    if operating_system == 'Linux' or operating_system == 'Mac':
-        file_list = extractfile(
-            directory_path=directory_path,
-            file_string=file_string)
-        file_paths = [Path(f'{directory_path}/{file}') for file in file_list]
-    elif operating_system == 'Windows':
-        file_paths = prompt_for_path(
-            default=directory_path,
-            title='Select Target File(s)',
-            file_path=True,
-            file_type=[(f'{file_string}', f'*{file_string}')])
-    return file_paths
+        entry: <dict> parent directory, file name, file path, primary and
+                secondary strings, size in bytes, modification time
+    '''
+    file_path = Path(file_path)
+    parent_directory = parent_directory or file_path.parent.name
+    file_name = os.path.splitext(file_path.name)[0]
+    primary_string, secondary_string = split_sample_strings(
+        parent_directory=parent_directory,
+        file_name=file_name)
+    return {
+        'Parent Directory': parent_directory,
+        'File Name': file_name,
+        'File Path': file_path,
+        'Primary String': primary_string,
+        'Secondary String': secondary_string,
+        'Size': stat_result.st_size,
+        'Modified': stat_result.st_mtime}
 
 
-def get_parent_directory(file_path):
+def catalogue_directory(directory_path,
+                        file_string,
+                        pattern=None,
+                        recursive=False):
     '''
-    Find parent directory name of target file.
+    Single os.scandir pass over a data directory, optionally recursive,
+    recording the sample metadata of every matching file. A pattern is
+    matched against file names with fnmatch; a leading "**/" (glob style)
+    also makes the pass recursive.
     Args:
-        file_path: <string> path to file
+        directory_path: <string> path to data directory
+        file_string: <string> string contained within file name
+        pattern: <string> file name pattern (e.g. "*.csv" or "**/*_01.csv"),
+                    overrides file_string
+        recursive: <bool> descend into sub-directories
     Returns:
-        parent_directory: <string> parent directory name (not path)
+        catalogue: <array> catalogue entries sorted by file path
     '''
-    dirpath = os.path.dirname(file_path)
-    dirpathsplit = dirpath.split('\\')
-    parent_directory = dirpathsplit[-1]
-    return parent_directory
+    if pattern:
+        recursive = recursive or pattern.startswith('**/')
+        pattern = Path(pattern).name
+    parent_directory = Path(directory_path).name
+    catalogue = []
+    directories = [f'{directory_path}']
+    while directories:
+        with os.scandir(directories.pop()) as scan:
+            for entry in scan:
+                if entry.is_dir():
+                    if recursive:
+                        directories.append(entry.path)
+                elif (fnmatch(entry.name, pattern) if pattern
+                      else file_string in entry.name):
+                    catalogue.append(catalogue_entry(
+                        file_path=entry.path,
+                        stat_result=entry.stat(),
+                        parent_directory=parent_directory))
+    return sorted(catalogue, key=lambda entry: f'{entry["File Path"]}')
 
 
-def get_filename(file_path):
+def catalogue_files(file_paths,
+                    parent_directory=None):
     '''
-    Splits file path to remove directory path and file extensions.
+    Catalogue an explicit list of files (e.g. selected interactively).
     Args:
-        file_path: <string> path to file
+        file_paths: <array> paths to files
+        parent_directory: <string> catalogued directory name (e.g. "S4"),
+                            defaults to the directory holding each file
     Returns:
-        file_name: <string> file name without path or extensions
+        catalogue: <array> catalogue entries in the given order
     '''
-    return os.path.splitext(os.path.basename(file_path))[0]
+    return [
+        catalogue_entry(
+            file_path=file_path,
+            stat_result=os.stat(file_path),
+            parent_directory=parent_directory)
+        for file_path in file_paths]
 
 
-def probe_sample_information(file_path):
+def index_catalogue(catalogue):
     '''
-    Pull sample parameters from file name string for various processes.
+    Group catalogue entries by primary string (batch).
     Args:
-        file_path: <string> path to file
+        catalogue: <array> catalogue entries
     Returns:
-        sample_parameters: <dict>
+        index: <dict> primary string: catalogue entries
     '''
-    parent_directory = get_parent_directory(file_path=file_path)
-    file_name = get_filename(file_path=file_path)
-    file_split = file_name.split('_')
-    return {
-        'Parent Directory': parent_directory,
-        f'{parent_directory} File Name': file_name,
-        f'{parent_directory} File Path': f'{file_path}',
-        f'{parent_directory} Primary String': file_split[0],
-        f'{parent_directory} Secondary String': file_split[1]}
+    index = {}
+    for entry in catalogue:
+        index.setdefault(entry['Primary String'], []).append(entry)
+    return index
 
 
-def S4_sample_information(file_path):
+def catalogue_sample_information(entry):
     '''
-    Pull sample parameters for file name string for various processes.
+    Sample parameters of a catalogue entry, keyed by its parent directory.
     Args:
-        file_path: <string> path to file
+        entry: <dict> catalogue entry
     Returns:
         sample_parameters: <dict>
     '''
-    parent_directory = get_parent_directory(file_path=file_path)
-    file_name = get_filename(file_path=file_path)
-    file_split = file_name.split('_')
+    parent_directory = entry['Parent Directory']
     return {
-        "Parent Directory": parent_directory,
-        f'{parent_directory} File Name': file_name,
-        f'{parent_directory} File Path': f'{file_path}',
-        f'{parent_directory} Primary String': file_split[0],
-        f'{parent_directory} Secondary String': '_'.join(file_split[1:])}
+        'Parent Directory': parent_directory,
+        f'{parent_directory} File Name': entry['File Name'],
+        f'{parent_directory} File Path': f'{entry["File Path"]}',
+        f'{parent_directory} Primary String': entry['Primary String'],
+        f'{parent_directory} Secondary String': entry['Secondary String']}
 
 
-def sample_information(file_path):
+def catalogue_batches(catalogue):
     '''
-    Pull sample parameters based on which type of file is being analysed.
+    Group a catalogue into batches for loop processing.
     Args:
-        file_path: <string> path to file
+        catalogue: <array> catalogue entries
     Returns:
-        sample_parameters: <dict>
+        parent: <string> parent directory string
+        batches: <dict> batch indicators: catalogue entries for the batch
     '''
-    parent_directory = get_parent_directory(file_path=file_path)
-    if parent_directory == '4PP':
-        sample_parameters = probe_sample_information(file_path=file_path)
-    elif parent_directory == 'S4':
-        sample_parameters = S4_sample_information(file_path=file_path)
-    else:
-        sample_parameters = {}
-    return sample_parameters
+    parent = catalogue[-1]['Parent Directory'] if catalogue else None
+    return parent, index_catalogue(catalogue=catalogue)
 
 
-def get_all_batches(file_paths):
+def catalogue_batch_dictionary(parent,
+                               batch_name,
+                               entries):
     '''
-    Find all sample batches in series of file paths and append file paths to
-    batch names for loop processing.
-    Args:
-        file_paths: <array> array of target file paths
-    Returns:
-        parent: <string> parent directory string
-        batches: <dict>
-            Batch inidicators: respective file paths for all samples in batch
-    '''
-    batches = {}
-    for file in file_paths:
-        sample_parameters = sample_information(file_path=file)
-        parent = sample_parameters['Parent Directory']
-        key = f'{parent} Primary String'
-        if sample_parameters[key] in batches.keys():
-            batches[f'{sample_parameters[key]}'].append(file)
-        else:
-            batches.update({f'{sample_parameters[key]}': [file]})
-    return parent, batches
-
-
-def update_batch_dictionary(parent,
-                            batch_name,
-                            file_paths):
-    '''
-    Update batch results dictionary.
+    Batch results dictionary of a batch's catalogue entries.
     Args:
         parent: <string> parent directory identifier
         batch_name: <string> batch name identifier
-        file_paths: <array> list of target file paths
+        entries: <array> catalogue entries for the batch
     Returns:
         batch_dictionary: <dict>
             Batch Name
@@ -201,49 +195,64 @@ def update_batch_dictionary(parent,
             File Paths
             Secondary Strings
     '''
-    batch_dictionary = {
+    return {
         f'{parent} Batch Name': batch_name,
-        f'{parent} File Name': [],
-        f'{parent} File Path': [],
-        f'{parent} Secondary String': []}
-    for file in file_paths:
-        sample_parameters = sample_information(file_path=file)
-        for key, value in sample_parameters.items():
-            if key in batch_dictionary.keys():
-                batch_dictionary[key].append(value)
-    return batch_dictionary
-
-
-def find_S4_measurement(S4_path,
-                        sample_details,
-                        file_string):
-    '''
-    Find S4 measurement file for current sample.
+        f'{parent} File Name': [entry['File Name'] for entry in entries],
+        f'{parent} File Path': [f'{entry["File Path"]}' for entry in entries],
+        f'{parent} Secondary String': [
+            entry['Secondary String'] for entry in entries]}
+
+
+def catalogue_S4_measurement(S4_index,
+                             batch_name):
+    '''
+    Find the S4 measurement files of a batch, a dictionary lookup instead of
+    a directory listing per batch.
     Args:
-        S4_path: <string> path to S4 directory
-        sample_details: <dict> dictionary containing all sample information
-        file_string: <string> file path extension for S4 file
+        S4_index: <dict> indexed S4 catalogue (index_catalogue)
+        batch_name: <string> batch name (primary string)
     Returns:
         S4_file: <array> path to S4 file or empty if no file
-        S4_details: <dict> S4 parameters (same as sample_information)
-    '''
-    parent = sample_details['Parent Directory']
-    primary = f'{parent} Primary String'
-    try:
-        S4_files = extractfile(
-            directory_path=S4_path,
-            file_string=file_string)
-        S4_file = []
-        S4_details = {}
-        for file in S4_files:
-            file_path = Path(f'{S4_path}/{file}')
-            S4_info = sample_information(file_path=file_path)
-            S4_parent = S4_info['Parent Directory']
-            S4_primary = f'{S4_parent} Primary String'
-            if S4_info[S4_primary] == sample_details[primary]:
-                S4_file.append(file_path)
-                S4_details.update(S4_info)
-    except:
-        S4_file = []
-        S4_details = {"S4 String": "No S4 File"}
+        S4_details: <dict> S4 parameters (catalogue_sample_information)
+    '''
+    if S4_index is None:
+        return [], {"S4 String": "No S4 File"}
+    S4_file = []
+    S4_details = {}
+    for entry in S4_index.get(f'{batch_name}', []):
+        S4_file.append(entry['File Path'])
+        S4_details.update(catalogue_sample_information(entry=entry))
     return S4_file, S4_details
+
+
+def discover_files(directory_path,
+                   file_string,
+                   pattern=None,
+                   recursive=False,
+                   interactive=False):
+    '''
+    Catalogue target files without user interaction on any platform, unless
+    interactive selection is explicitly requested. The tkinter GUI module is
+    only imported in interactive mode.
+    Args:
+        directory_path: <string> path to data directory
+        file_string: <string> string contained within file name
+        pattern: <string> file name pattern (e.g. "*.csv" or
+                    "**/*_01.csv"), overrides file_string
+        recursive: <bool> descend into sub-directories
+        interactive: <bool> select files with the tkinter file dialog
+    Returns:
+        catalogue: <array> catalogue entries
+    '''
+    if interactive:
+        from src.GUI import prompt_for_path
+        return catalogue_files(file_paths=prompt_for_path(
+            default=directory_path,
+            title='Select Target File(s)',
+            file_path=True,
+            file_type=[(f'{file_string}', f'*{file_string}')]))
+    return catalogue_directory(
+        directory_path=directory_path,
+        file_string=file_string,
+        pattern=pattern,
+        recursive=recursive)
@@ -0,0 +1,98 @@
+import src.fileIO as io
+import src.analysis as anal
+import src.filepaths as fp
+
+
+def load_hall_mobilities(catalogue):
+    '''
+    Load every Hall measurement file once and average the mobilities of each
+    batch (primary string), pooling the repeats of all of its files. A file
+    that cannot be read is reported and skipped, and a batch left with no
+    mobilities is dropped, so it falls back to the configured mobilities.
+    Args:
+        catalogue: <array> Hall catalogue entries (filepaths.discover_files)
+    Returns:
+        hall_mobilities: <dict> batch name: mobility, mobility error in
+                        cm2/Vs, and the Hall file paths
+    '''
+    hall_mobilities = {}
+    for batch, entries in fp.index_catalogue(catalogue=catalogue).items():
+        mobilities = []
+        mobility_errors = []
+        file_paths = []
+        for entry in entries:
+            try:
+                measurements = io.load_hall_measurements(
+                    file_path=entry['File Path'])
+            except (OSError, ValueError, IndexError) as error:
+                print(f'Hall file {entry["File Path"]} skipped: {error}')
+                continue
+            mobilities.extend(measurements['Mobility'])
+            if measurements['Mobility Error'] is not None:
+                mobility_errors.extend(measurements['Mobility Error'])
+            file_paths.append(f'{entry["File Path"]}')
+        if not mobilities:
+            continue
+        hall_mobilities[batch] = dict(
+            anal.average_hall_mobility(
+                mobilities=mobilities,
+                mobility_errors=mobility_errors or None),
+            **{'Hall File Path': file_paths})
+    return hall_mobilities
+
+
+def discover_hall_mobilities(info,
+                             directory_paths):
+    '''
+    Catalogue and load the Hall measurements in the "Hall Path" directory of
+    info.json, matched with "Hall Pattern" when set.
+    Args:
+        info: <dict> information dictionary (info.json)
+        directory_paths: <dict> directory paths from info.json
+    Returns:
+        hall_mobilities: <dict> batch name: mobility (load_hall_mobilities),
+                        empty without a Hall directory
+    '''
+    if 'Hall Path' not in directory_paths.keys():
+        return {}
+    try:
+        catalogue = fp.discover_files(
+            directory_path=directory_paths['Hall Path'],
+            file_string='.csv',
+            pattern=info.get('Hall Pattern'),
+            recursive=info.get('Recursive Search', False))
+    except OSError:
+        return {}
+    return load_hall_mobilities(catalogue=catalogue)
+
+
+def batch_mobility(batch,
+                   hall_mobilities,
+                   drude_parameters):
+    '''
+    Mobility of a batch, from its Hall measurements if there are any,
+    otherwise from "Mobilities" in drude_parameters, given as a mobility or
+    as [mobility, mobility error].
+    Args:
+        batch: <string> batch name
+        hall_mobilities: <dict> Hall mobilities (load_hall_mobilities)
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+    Returns:
+        mobility: <dict> mobility, mobility error in cm2/Vs and mobility
+                    source, None if the batch has no mobility
+    '''
+    if f'{batch}' in (hall_mobilities or {}).keys():
+        return dict(
+            hall_mobilities[f'{batch}'],
+            **{'Mobility Source': 'Hall'})
+    mobility = drude_parameters.get('Mobilities', {}).get(f'{batch}')
+    if mobility is None:
+        return None
+    if isinstance(mobility, list):
+        mobility, mobility_error = mobility
+    else:
+        mobility_error = 0.0
+    return {
+        'Mobility': mobility,
+        'Mobility Error': mobility_error,
+        'Mobility Source': 'Drude Parameters'}
@@ -0,0 +1,131 @@
+import numba
+import numpy as np
+
+
+''' n e^2 / (eps_0 m_e), as in analysis.plasmafrequency_squared '''
+PLASMA_CONSTANT = (1.60217663E-19 ** 2) / (8.854E-12 * 9.11E-31)
+
+
+@numba.njit(parallel=True, cache=True)
+def drude_grid(angular_frequency,
+               carrier_densities,
+               effective_masses,
+               epsilon_infinity,
+               relaxation_time,
+               full,
+               out):
+    '''
+    Complex Drude permittivity over a carrier density x effective mass x
+    angular frequency grid, one fused loop per (density, mass) pair in
+    parallel, written into out.
+    Args:
+        angular_frequency: <array> (W,) angular frequencies in rad/s
+        carrier_densities: <array> (N,) carrier densities in m^-3
+        effective_masses: <array> (M,) effective mass multipliers
+        epsilon_infinity: <float> high frequency permittivity
+        relaxation_time: <float> relaxation time of electrons
+        full: <bool> full Drude form, otherwise the approximate form
+        out: <array> (N, M, W) complex output array
+    Returns:
+        None
+    '''
+    masses = effective_masses.size
+    for index in numba.prange(carrier_densities.size * masses):
+        density = index // masses
+        mass = index % masses
+        screened = (
+            epsilon_infinity * PLASMA_CONSTANT * carrier_densities[density]
+            / effective_masses[mass])
+        for point in range(angular_frequency.size):
+            w = angular_frequency[point]
+            if full:
+                out[density, mass, point] = epsilon_infinity - screened / (
+                    w * w + 1j * w * relaxation_time)
+            else:
+                out[density, mass, point] = (
+                    epsilon_infinity - screened / (w * w)
+                    + 1j * screened / (w * relaxation_time))
+
+
+@numba.njit(parallel=True, cache=True)
+def drude_model(angular_frequency,
+                parameters,
+                full):
+    '''
+    Complex Drude permittivity of many parameter sets, in parallel over the
+    sets.
+    Args:
+        angular_frequency: <array> (W,) angular frequencies in rad/s
+        parameters: <array> (S, 4) carrier density, effective mass, epsilon
+                    infinity and relaxation time
+        full: <bool> full Drude form, otherwise the approximate form
+    Returns:
+        permittivity: <array> (S, W) complex permittivity
+    '''
+    out = np.empty(
+        (parameters.shape[0], angular_frequency.size),
+        dtype=np.complex128)
+    for sample in numba.prange(parameters.shape[0]):
+        epsilon_infinity = parameters[sample, 2]
+        relaxation_time = parameters[sample, 3]
+        screened = (
+            epsilon_infinity * PLASMA_CONSTANT * parameters[sample, 0]
+            / parameters[sample, 1])
+        for point in range(angular_frequency.size):
+            w = angular_frequency[point]
+            if full:
+                out[sample, point] = epsilon_infinity - screened / (
+                    w * w + 1j * w * relaxation_time)
+            else:
+                out[sample, point] = (
+                    epsilon_infinity - screened / (w * w)
+                    + 1j * screened / (w * relaxation_time))
+    return out
+
+
+@numba.njit(parallel=True, cache=True)
+def drude_gradient(angular_frequency,
+                   parameters,
+                   full):
+    '''
+    Analytic derivatives of the complex Drude permittivity with respect to
+    carrier density, effective mass, epsilon infinity and relaxation time,
+    in parallel over the parameter sets.
+    Args:
+        angular_frequency: <array> (W,) angular frequencies in rad/s
+        parameters: <array> (S, 4) Drude parameters
+        full: <bool> full Drude form, otherwise the approximate form
+    Returns:
+        gradient: <array> (S, W, 4) complex d(eps)/d(parameter)
+    '''
+    out = np.empty(
+        (parameters.shape[0], angular_frequency.size, 4),
+        dtype=np.complex128)
+    for sample in numba.prange(parameters.shape[0]):
+        carrier_density = parameters[sample, 0]
+        effective_mass = parameters[sample, 1]
+        epsilon_infinity = parameters[sample, 2]
+        relaxation_time = parameters[sample, 3]
+        screened = (
+            epsilon_infinity * PLASMA_CONSTANT * carrier_density
+            / effective_mass)
+        for point in range(angular_frequency.size):
+            w = angular_frequency[point]
+            if full:
+                denominator = w * w + 1j * w * relaxation_time
+                term = screened / denominator
+                out[sample, point, 0] = -term / carrier_density
+                out[sample, point, 1] = term / effective_mass
+                out[sample, point, 2] = 1 - term / epsilon_infinity
+                out[sample, point, 3] = term * 1j * w / denominator
+            else:
+                drude_term = screened / (w * w)
+                imag_term = screened / (w * relaxation_time)
+                out[sample, point, 0] = (
+                    -drude_term + 1j * imag_term) / carrier_density
+                out[sample, point, 1] = (
+                    drude_term - 1j * imag_term) / effective_mass
+                out[sample, point, 2] = (
+                    1 - (drude_term - 1j * imag_term) / epsilon_infinity)
+                out[sample, point, 3] = -1j * imag_term / relaxation_time
+    return out
@@ -0,0 +1,293 @@
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+
+def default_worker_name():
+    '''
+    Worker identifier from host name and process id.
+    Args:
+        None
+    Returns:
+        worker: <string> worker name
+    '''
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def connect_queue(queue_path,
+                  timeout=60):
+    '''
+    Open (and create if needed) the SQLite job queue. Connections use
+    autocommit so that claims can take an explicit write lock.
+    Args:
+        queue_path: <string> path to queue database
+        timeout: <float> seconds to wait for the database lock
+    Returns:
+        connection: <sqlite3.Connection> queue connection
+    '''
+    connection = sqlite3.connect(
+        f'{queue_path}',
+        timeout=timeout,
+        isolation_level=None)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        'batch TEXT PRIMARY KEY, '
+        "status TEXT NOT NULL DEFAULT 'pending', "
+        'worker TEXT, '
+        'attempts INTEGER NOT NULL DEFAULT 0, '
+        'claimed REAL, '
+        'heartbeat REAL, '
+        'finished REAL, '
+        'error TEXT)')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, heartbeat)')
+    return connection
+
+
+def enqueue_batches(connection,
+                    batches):
+    '''
+    Add batches to the queue. Batches already queued keep their state, so
+    every worker can enqueue the same discovery results safely.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        batches: <array> batch names
+    Returns:
+        None
+    '''
+    with connection:
+        connection.executemany(
+            'INSERT OR IGNORE INTO jobs (batch) VALUES (?)',
+            [(f'{batch}',) for batch in batches])
+
+
+def reclaim_stale_jobs(connection,
+                       stale_after,
+                       max_attempts=3):
+    '''
+    Return running jobs whose worker has not sent a heartbeat within
+    stale_after seconds (crashed or killed workers) to the pending state.
+    Jobs already attempted max_attempts times are marked failed instead, so
+    a batch that crashes every worker that claims it is not retried forever.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        stale_after: <float> heartbeat age in seconds before reclaiming
+        max_attempts: <int> attempts before giving up on the batch
+    Returns:
+        reclaimed: <int> number of jobs reclaimed or failed
+    '''
+    cursor = connection.execute(
+        'UPDATE jobs SET '
+        "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+        "worker = NULL, error = 'Worker stopped sending heartbeats' "
+        "WHERE status = 'running' AND heartbeat < ?",
+        (max_attempts, time.time() - stale_after))
+    return cursor.rowcount
+
+
+def claim_batch(connection,
+                worker,
+                stale_after=300,
+                max_attempts=3,
+                known_batches=None):
+    '''
+    Atomically claim the next pending batch. The claim runs inside a write
+    transaction, so two workers can never claim the same batch.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        worker: <string> worker name
+        stale_after: <float> heartbeat age in seconds before reclaiming
+        max_attempts: <int> attempts before giving up on a reclaimed batch
+        known_batches: <set> batch names this worker can process, None for
+                        any; other batches are left pending for other workers
+    Returns:
+        batch: <string> claimed batch name, None when the queue is empty
+    '''
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        reclaim_stale_jobs(
+            connection=connection,
+            stale_after=stale_after,
+            max_attempts=max_attempts)
+        batch = None
+        for (pending,) in connection.execute(
+                "SELECT batch FROM jobs WHERE status = 'pending' "
+                'ORDER BY rowid'):
+            if known_batches is None or pending in known_batches:
+                batch = pending
+                break
+        if batch is None:
+            connection.execute('COMMIT')
+            return None
+        now = time.time()
+        connection.execute(
+            "UPDATE jobs SET status = 'running', worker = ?, "
+            'attempts = attempts + 1, claimed = ?, heartbeat = ?, error = NULL '
+            'WHERE batch = ?',
+            (worker, now, now, batch))
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    return batch
+
+
+def heartbeat(connection,
+              worker):
+    '''
+    Refresh the heartbeat of every job held by the worker.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        worker: <string> worker name
+    Returns:
+        None
+    '''
+    connection.execute(
+        'UPDATE jobs SET heartbeat = ? '
+        "WHERE status = 'running' AND worker = ?",
+        (time.time(), worker))
+
+
+def complete_batch(connection,
+                   batch,
+                   worker):
+    '''
+    Mark a claimed batch as done. Call only after results are written; results
+    are written to a fixed path per batch, so a job reclaimed and repeated by
+    another worker produces the same files.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        batch: <string> batch name
+        worker: <string> worker name
+    Returns:
+        owned: <bool> False if the job had been reclaimed by another worker
+    '''
+    cursor = connection.execute(
+        "UPDATE jobs SET status = 'done', finished = ? "
+        "WHERE batch = ? AND worker = ? AND status = 'running'",
+        (time.time(), f'{batch}', worker))
+    return cursor.rowcount == 1
+
+
+def fail_batch(connection,
+               batch,
+               worker,
+               error,
+               max_attempts=3):
+    '''
+    Record a failed attempt. The batch returns to the queue until it has been
+    attempted max_attempts times, after which it is marked failed.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        batch: <string> batch name
+        worker: <string> worker name
+        error: <string> error description
+        max_attempts: <int> attempts before giving up on the batch
+    Returns:
+        None
+    '''
+    connection.execute(
+        'UPDATE jobs SET '
+        "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+        'worker = NULL, error = ?, finished = ? '
+        "WHERE batch = ? AND worker = ? AND status = 'running'",
+        (max_attempts, f'{error}', time.time(), f'{batch}', worker))
+
+
+def reject_batch(connection,
+                 batch,
+                 worker,
+                 error):
+    '''
+    Mark a claimed batch whose fit failed the fit gates as rejected. Fits are
+    deterministic, so a rejected batch is not returned to the queue; it stays
+    rejected until the queue is recreated.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        batch: <string> batch name
+        worker: <string> worker name
+        error: <string> failed fit gates
+    Returns:
+        None
+    '''
+    connection.execute(
+        "UPDATE jobs SET status = 'rejected', error = ?, finished = ? "
+        "WHERE batch = ? AND worker = ? AND status = 'running'",
+        (f'{error}', time.time(), f'{batch}', worker))
+
+
+def queue_status(connection):
+    '''
+    Number of jobs in each state.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+    Returns:
+        status: <dict> job counts keyed by state
+    '''
+    return dict(connection.execute(
+        'SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+
+def start_heartbeat(queue_path,
+                    worker,
+                    interval=30):
+    '''
+    Send heartbeats for the worker's jobs from a background thread with its
+    own connection, so long fits do not look like crashed workers.
+    Args:
+        queue_path: <string> path to queue database
+        worker: <string> worker name
+        interval: <float> seconds between heartbeats
+    Returns:
+        stop: <threading.Event> set to stop the heartbeat thread
+    '''
+    stop = threading.Event()
+
+    def beat():
+        connection = connect_queue(queue_path=queue_path)
+        try:
+            while not stop.wait(interval):
+                heartbeat(
+                    connection=connection,
+                    worker=worker)
+        finally:
+            connection.close()
+
+    threading.Thread(target=beat, daemon=True).start()
+    return stop
+
+
+def claimed_batches(connection,
+                    worker,
+                    batches,
+                    stale_after=300,
+                    max_attempts=3):
+    '''
+    Lazily claim batches from the queue, yielding the catalogue entries for
+    each. Only batches in this worker's catalogue are claimed; batches other
+    hosts discovered stay pending for them.
+    Suitable as the input of prefetch.prefetch_batches, which only claims as
+    many batches ahead as its prefetch depth.
+    Args:
+        connection: <sqlite3.Connection> queue connection
+        worker: <string> worker name
+        batches: <dict> batch names and catalogue entries
+                    (filepaths.catalogue_batches)
+        stale_after: <float> heartbeat age in seconds before reclaiming
+        max_attempts: <int> attempts before giving up on a reclaimed batch
+    Returns:
+        claimed: <generator> (batch name, catalogue entries)
+    '''
+    known_batches = {f'{batch}' for batch in batches}
+    while True:
+        batch = claim_batch(
+            connection=connection,
+            worker=worker,
+            stale_after=stale_after,
+            max_attempts=max_attempts,
+            known_batches=known_batches)
+        if batch is None:
+            return
+        yield batch, batches[batch]
@@ -0,0 +1,183 @@
+import os
+import numpy as np
+import src.analysis as anal
+
+
+BACKENDS = ['Auto', 'NumPy', 'Numba']
+_backend = {'Name': 'NumPy', 'Kernels': None}
+
+
+def set_backend(backend='Auto'):
+    '''
+    Select the Drude kernel backend at runtime. "Numba" compiles fused,
+    parallel loops (src/jitkernels.py) on first use and "Auto" selects it
+    when numba is installed; both fall back to NumPy when it is not. The
+    choice is exported in DRUDE_KERNEL_BACKEND so worker processes make the
+    same one.
+    Args:
+        backend: <string> "Auto", "NumPy" or "Numba" (BACKENDS)
+    Returns:
+        backend: <string> backend in use, "NumPy" or "Numba"
+    '''
+    if backend not in BACKENDS:
+        raise ValueError(
+            f'Unknown kernel backend "{backend}", '
+            f'choose from {", ".join(BACKENDS)}')
+    _backend['Name'] = 'NumPy'
+    _backend['Kernels'] = None
+    if backend != 'NumPy':
+        try:
+            import src.jitkernels as jitkernels
+            _backend['Name'] = 'Numba'
+            _backend['Kernels'] = jitkernels
+        except ImportError:
+            if backend == 'Numba':
+                print('numba is not installed, using the NumPy kernels')
+    os.environ['DRUDE_KERNEL_BACKEND'] = _backend['Name']
+    return _backend['Name']
+
+
+def get_backend():
+    '''
+    Kernel backend in use.
+    Args:
+        None
+    Returns:
+        backend: <string> "NumPy" or "Numba"
+    '''
+    return _backend['Name']
+
+
+def jit_enabled():
+    '''
+    Check the Numba kernels are selected.
+    Args:
+        None
+    Returns:
+        enabled: <bool>
+    '''
+    return _backend['Kernels'] is not None
+
+
+def full_mode(mode):
+    '''
+    Translate a Drude mode to the flag used by the compiled kernels.
+    Args:
+        mode: <string> Drude form, "Full" or "Approximate"
+                (analysis.complex_drude_permittivity)
+    Returns:
+        full: <bool>
+    '''
+    if mode not in ['Full', 'Approximate']:
+        raise ValueError(f'Unknown Drude mode "{mode}"')
+    return mode == 'Full'
+
+
+def drude_grid(angular_frequency,
+               carrier_densities,
+               effective_masses,
+               epsilon_infinity,
+               relaxation_time,
+               mode='Approximate',
+               dtype=np.complex128):
+    '''
+    Complex Drude permittivity over a carrier density x effective mass x
+    angular frequency grid, for sweeps and lookup tables.
+    Args:
+        angular_frequency: <array> (W,) angular frequencies in rad/s
+        carrier_densities: <array> (N,) carrier densities in m^-3
+        effective_masses: <array> (M,) effective mass multipliers
+        epsilon_infinity: <float> high frequency permittivity
+        relaxation_time: <float> relaxation time of electrons
+        mode: <string> Drude form, "Full" or "Approximate"
+        dtype: <numpy.dtype> complex output type
+    Returns:
+        permittivity: <array> (N, M, W) complex permittivity
+    '''
+    omega = np.ascontiguousarray(angular_frequency, dtype=float)
+    densities = np.ascontiguousarray(carrier_densities, dtype=float)
+    masses = np.ascontiguousarray(effective_masses, dtype=float)
+    full = full_mode(mode=mode)
+    if not jit_enabled():
+        return anal.complex_drude_permittivity(
+            x=omega[np.newaxis, np.newaxis, :],
+            carrier_density=densities[:, np.newaxis, np.newaxis],
+            effective_mass=masses[np.newaxis, :, np.newaxis],
+            epsilon_infinity=epsilon_infinity,
+            relaxation_time=relaxation_time,
+            mode=mode).astype(dtype, copy=False)
+    out = np.empty((densities.size, masses.size, omega.size), dtype=dtype)
+    _backend['Kernels'].drude_grid(
+        omega,
+        densities,
+        masses,
+        float(epsilon_infinity),
+        float(relaxation_time),
+        full,
+        out)
+    return out
+
+
+def drude_model(angular_frequency,
+                parameters,
+                mode='Approximate'):
+    '''
+    Complex Drude permittivity for one or many parameter sets.
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4) carrier density, effective mass, epsilon
+                    infinity and relaxation time
+        mode: <string> Drude form, "Full" or "Approximate"
+    Returns:
+        permittivity: <array> (..., W) complex permittivity
+    '''
+    omega = np.ascontiguousarray(angular_frequency, dtype=float)
+    parameters = np.asarray(parameters, dtype=float)
+    full = full_mode(mode=mode)
+    if not jit_enabled():
+        parameters = parameters[..., np.newaxis, :]
+        return anal.complex_drude_permittivity(
+            x=omega,
+            carrier_density=parameters[..., 0],
+            effective_mass=parameters[..., 1],
+            epsilon_infinity=parameters[..., 2],
+            relaxation_time=parameters[..., 3],
+            mode=mode)
+    return _backend['Kernels'].drude_model(
+        omega,
+        np.ascontiguousarray(parameters.reshape(-1, 4)),
+        full).reshape(parameters.shape[:-1] + omega.shape)
+
+
+def drude_gradient(angular_frequency,
+                   parameters,
+                   mode='Approximate'):
+    '''
+    Analytic derivatives of the complex Drude permittivity. Without the
+    compiled kernels these are models.drude_gradient ("Approximate") and
+    models.drude_lorentz_gradient without oscillators ("Full").
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4) Drude parameters
+        mode: <string> Drude form, "Full" or "Approximate"
+    Returns:
+        gradient: <array> (..., W, 4) complex d(eps)/d(parameter)
+    '''
+    omega = np.ascontiguousarray(angular_frequency, dtype=float)
+    parameters = np.asarray(parameters, dtype=float)
+    full = full_mode(mode=mode)
+    if not jit_enabled():
+        ''' Imported here as models imports this module '''
+        import src.models as models
+        gradient = (
+            models.drude_lorentz_gradient if full else models.drude_gradient)
+        return gradient(
+            angular_frequency=omega,
+            parameters=parameters)
+    return _backend['Kernels'].drude_gradient(
+        omega,
+        np.ascontiguousarray(parameters.reshape(-1, 4)),
+        full).reshape(parameters.shape[:-1] + omega.shape + (4,))
+
+
+set_backend(backend=os.environ.get('DRUDE_KERNEL_BACKEND', 'NumPy'))
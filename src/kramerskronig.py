@@ -0,0 +1,161 @@
+import numpy as np
+import scipy.fft as fft
+import src.models as models
+import src.analysis as anal
+
+
+def hilbert_transform(values):
+    '''
+    FFT Hilbert transform, (1 / pi) P int f(t) / (x - t) dt, of an odd function
+    sampled on the uniform grid k dw, k = 0 ... N - 1. The odd extension is
+    laid out circularly with zero padding between the positive and negative
+    halves, so the transform is O(N log N) without wrap-around.
+    Args:
+        values: <array> (N,) samples of the odd function, values[0] at zero
+    Returns:
+        transform: <array> (N,) Hilbert transform on the same grid
+    '''
+    values = np.asarray(values, dtype=float)
+    count = values.size
+    length = fft.next_fast_len(4 * count)
+    extended = np.zeros(length)
+    extended[:count] = values
+    extended[length - count + 1:] = -values[:0:-1]
+    spectrum = fft.rfft(extended)
+    spectrum *= -1j
+    spectrum[0] = 0
+    return fft.irfft(spectrum, n=length)[:count]
+
+
+def kramers_kronig_real(frequency_step,
+                        imag_permittivity,
+                        reference_damping=None):
+    '''
+    Real permittivity, less its high frequency limit, implied by the imaginary
+    permittivity through the Kramers-Kronig relation
+    eps_r(w) - eps_r(inf) = (1 / pi) P int eps_i(w') / (w' - w) dw'.
+    The free carrier 1 / w pole of eps_i is removed first as a reference
+    Drude term with known real part, with the pole strength extrapolated from
+    the first two grid points, so the grid spacing should resolve the damping.
+    Args:
+        frequency_step: <float> grid spacing dw in rad/s, the grid is k dw
+        imag_permittivity: <array> (N,) imaginary permittivity on the grid,
+                            the value at zero frequency is ignored
+        reference_damping: <float> damping of the reference Drude term in
+                            rad/s, defaults to a tenth of the grid range
+    Returns:
+        real_permittivity: <array> (N,) real permittivity less eps_r(inf)
+    '''
+    imag_permittivity = np.asarray(imag_permittivity, dtype=float)
+    omega = np.arange(imag_permittivity.size) * frequency_step
+    if reference_damping is None:
+        reference_damping = omega[-1] / 10
+    conductivity_term = omega[1:3] * imag_permittivity[1:3]
+    pole = (
+        (omega[2] ** 2 * conductivity_term[0]
+         - omega[1] ** 2 * conductivity_term[1])
+        / (omega[2] ** 2 - omega[1] ** 2))
+    damping_squared = reference_damping ** 2
+    reference_imag = np.zeros_like(omega)
+    reference_imag[1:] = pole * damping_squared / (
+        omega[1:] * (omega[1:] ** 2 + damping_squared))
+    reference_real = -pole * reference_damping / (omega ** 2 + damping_squared)
+    remainder = imag_permittivity - reference_imag
+    remainder[0] = 0
+    return reference_real - hilbert_transform(values=remainder)
+
+
+def causal_permittivity(angular_frequency,
+                        results_dictionary):
+    '''
+    Real and imaginary permittivity of a fitted batch in a causal form. The
+    approximate Drude forms of the two stage fit are not a Kramers-Kronig
+    pair for any parameters, so its real part is the full Drude form with
+    the real results and the imaginary results' damping, and its imaginary
+    part the full Drude form with the imaginary results. The check then
+    measures how far the two parameter sets disagree. Models fitted to both
+    parts together are used as fitted.
+    Args:
+        angular_frequency: <array> angular frequency grid in rad/s
+        results_dictionary: <dict> fitted batch results dictionary
+    Returns:
+        permittivity: <tuple> real and imaginary permittivity arrays
+    '''
+    if 'Model Results' in results_dictionary.keys():
+        permittivity = models.results_permittivity(
+            angular_frequency=angular_frequency,
+            results_dictionary=results_dictionary)
+        return permittivity.real, permittivity.imag
+    real_results = results_dictionary['Real Results']
+    imag_results = results_dictionary['Imaginary Results']
+    real_permittivity = anal.complex_drude_permittivity(
+        x=angular_frequency,
+        carrier_density=real_results[0],
+        effective_mass=real_results[1],
+        epsilon_infinity=real_results[2],
+        relaxation_time=imag_results[3],
+        mode='Full').real
+    imag_permittivity = anal.complex_drude_permittivity(
+        x=angular_frequency,
+        carrier_density=imag_results[0],
+        effective_mass=imag_results[1],
+        epsilon_infinity=imag_results[2],
+        relaxation_time=imag_results[3],
+        mode='Full').imag
+    return real_permittivity, imag_permittivity
+
+
+def kramers_kronig_check(angular_frequency,
+                         results_dictionary,
+                         extension=8,
+                         tolerance=0.05):
+    '''
+    Check the fitted real permittivity of a batch against the real part
+    implied by its fitted imaginary permittivity (causal_permittivity). The
+    imaginary curve is evaluated on a uniform grid from zero to extension
+    times the batch range at the batch grid spacing, transformed, and
+    compared with the fitted real curve on the batch grid after removing the
+    best constant offset, which estimates eps_r(inf).
+
+    Limitation: for the two stage Drude fit this is close to tautological.
+    The imaginary fit is bounded by the real fit's results, and both curves
+    share the imaginary fit's damping, so consistent two stage fits deviate
+    by about 1E-6. Only fits whose two parameter sets drift apart are caught,
+    and the measured permittivity points are not checked. Treat it as a
+    check on fits of both parts together (Model Results) and a coarse check
+    on the two stage fit.
+    Args:
+        angular_frequency: <array> batch angular frequency grid in rad/s
+        results_dictionary: <dict> fitted batch results dictionary
+        extension: <float> uniform grid range as a multiple of the batch range,
+                    reduces the truncation error of the transform
+        tolerance: <float> largest relative deviation counted as consistent
+    Returns:
+        consistency: <dict> relative RMS deviation, maximum absolute deviation,
+                    offset and whether the fit is consistent
+    '''
+    omega = np.sort(np.asarray(angular_frequency, dtype=float))
+    frequency_step = np.min(np.diff(omega))
+    points = int(np.ceil(extension * omega[-1] / frequency_step)) + 1
+    uniform_omega = np.arange(points) * frequency_step
+    imag_permittivity = np.zeros(points)
+    _, imag_permittivity[1:] = causal_permittivity(
+        angular_frequency=uniform_omega[1:],
+        results_dictionary=results_dictionary)
+    implied_real = np.interp(
+        omega,
+        uniform_omega,
+        kramers_kronig_real(
+            frequency_step=frequency_step,
+            imag_permittivity=imag_permittivity))
+    fitted_real, _ = causal_permittivity(
+        angular_frequency=omega,
+        results_dictionary=results_dictionary)
+    offset = np.mean(fitted_real - implied_real)
+    residuals = fitted_real - implied_real - offset
+    error = np.sqrt(np.mean(residuals ** 2) / np.mean(fitted_real ** 2))
+    return {
+        'Kramers Kronig Deviation': float(error),
+        'Kramers Kronig Max Deviation': float(np.max(np.abs(residuals))),
+        'Kramers Kronig Offset': float(offset),
+        'Kramers Kronig Consistent': bool(error <= tolerance)}
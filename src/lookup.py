@@ -0,0 +1,331 @@
+import numpy as np
+import src.kernels as kernels
+
+from pathlib import Path
+from src.fileIO import atomic_write, load_json, save_json_dicts
+
+
+def drude_permittivity_grid(carrier_densities,
+                            angular_frequencies,
+                            effective_mass,
+                            epsilon_infinity,
+                            relaxation_time,
+                            mode='Approximate'):
+    '''
+    Evaluate complex Drude permittivity over a carrier density x angular
+    frequency grid with the selected kernel backend (kernels.drude_grid).
+    Args:
+        carrier_densities: <array> carrier densities in m^-3, shape (N,)
+        angular_frequencies: <array> angular frequencies in rad/s, shape (W,)
+        effective_mass: <float> effective mass material multiplier
+        epsilon_infinity: <float> high frequency permittivity
+        relaxation_time: <float> relaxation time of electrons
+        mode: <string> Drude form, "Full" or "Approximate"
+                (analysis.complex_drude_permittivity)
+    Returns:
+        permittivity: <array> complex permittivity, shape (N, W)
+    '''
+    return kernels.drude_grid(
+        angular_frequency=angular_frequencies,
+        carrier_densities=carrier_densities,
+        effective_masses=[effective_mass],
+        epsilon_infinity=epsilon_infinity,
+        relaxation_time=relaxation_time,
+        mode=mode)[:, 0, :]
+
+
+class PermittivityLookupTable:
+    '''
+    Precomputed complex Drude permittivity on a log-spaced carrier density x
+    angular frequency grid, with vectorised bilinear interpolation in log
+    coordinates. Effective mass, epsilon infinity and relaxation time are fixed
+    per table.
+
+    The table is not faster than evaluating the closed form: four gathers
+    from the table cost more than analysis.complex_drude_permittivity on the
+    same points (about 0.09 s against 0.03 s for 1E6 queries). It exists to
+    save a fixed grid once and memory-map it read-only into many processes
+    (save, load), not to speed up single evaluations.
+    '''
+    def __init__(self,
+                 density_range,
+                 frequency_range,
+                 table,
+                 effective_mass,
+                 epsilon_infinity,
+                 relaxation_time,
+                 error_bound=None,
+                 mode='Approximate'):
+        '''
+        Args:
+            density_range: <array> [min, max] carrier density in m^-3
+            frequency_range: <array> [min, max] angular frequency in rad/s
+            table: <array> complex permittivity, shape (N, W)
+            effective_mass: <float> effective mass material multiplier
+            epsilon_infinity: <float> high frequency permittivity
+            relaxation_time: <float> relaxation time of electrons
+            error_bound: <float> maximum absolute interpolation error measured
+                            between grid points when the table was built
+            mode: <string> Drude form, "Full" or "Approximate"
+                    (analysis.complex_drude_permittivity)
+        '''
+        self.density_range = [float(v) for v in density_range]
+        self.frequency_range = [float(v) for v in frequency_range]
+        self.table = table
+        self.effective_mass = float(effective_mass)
+        self.epsilon_infinity = float(epsilon_infinity)
+        self.relaxation_time = float(relaxation_time)
+        self.error_bound = error_bound
+        self.mode = mode
+        self._log_densities = np.log(self.density_range)
+        self._log_frequencies = np.log(self.frequency_range)
+
+        ''' Grid position = log(value) * scale - offset, along each axis '''
+        self._density_scale = (table.shape[0] - 1) / np.diff(
+            self._log_densities)[0]
+        self._density_offset = self._log_densities[0] * self._density_scale
+        self._frequency_scale = (table.shape[1] - 1) / np.diff(
+            self._log_frequencies)[0]
+        self._frequency_offset = (
+            self._log_frequencies[0] * self._frequency_scale)
+        self._flat_table = table.reshape(-1)
+
+    @property
+    def carrier_densities(self):
+        '''
+        Carrier density grid in m^-3.
+        '''
+        return np.geomspace(*self.density_range, self.table.shape[0])
+
+    @property
+    def angular_frequencies(self):
+        '''
+        Angular frequency grid in rad/s.
+        '''
+        return np.geomspace(*self.frequency_range, self.table.shape[1])
+
+    @classmethod
+    def build(cls,
+              density_range,
+              frequency_range,
+              effective_mass,
+              epsilon_infinity,
+              relaxation_time,
+              resolution=(256, 256),
+              tolerance=None,
+              max_bytes=64E6,
+              mode='Approximate'):
+        '''
+        Build a table at the requested resolution. When a tolerance is given
+        the axis with the larger interpolation error is refined, one axis at
+        a time, until the error between grid points (midpoint_errors) is
+        below the tolerance. Raises rather than growing the table beyond
+        max_bytes.
+        Args:
+            density_range: <array> [min, max] carrier density in m^-3
+            frequency_range: <array> [min, max] angular frequency in rad/s
+            effective_mass: <float> effective mass material multiplier
+            epsilon_infinity: <float> high frequency permittivity
+            relaxation_time: <float> relaxation time of electrons
+            resolution: <tuple> (density points, frequency points)
+            tolerance: <float> maximum absolute permittivity error
+            max_bytes: <float> upper limit on the table size in bytes
+            mode: <string> Drude form, "Full" or "Approximate"
+                    (analysis.complex_drude_permittivity)
+        Returns:
+            lookup_table: <PermittivityLookupTable>
+        '''
+        densities, frequencies = resolution
+        itemsize = np.dtype(np.complex128).itemsize
+        if densities * frequencies * itemsize > max_bytes:
+            raise ValueError(
+                f'Lookup table resolution {tuple(resolution)} exceeds '
+                f'{max_bytes / 1E6:.0f} MB')
+        while True:
+            table = drude_permittivity_grid(
+                carrier_densities=np.geomspace(*density_range, densities),
+                angular_frequencies=np.geomspace(
+                    *frequency_range, frequencies),
+                effective_mass=effective_mass,
+                epsilon_infinity=epsilon_infinity,
+                relaxation_time=relaxation_time,
+                mode=mode)
+            lookup_table = cls(
+                density_range=density_range,
+                frequency_range=frequency_range,
+                table=table,
+                effective_mass=effective_mass,
+                epsilon_infinity=epsilon_infinity,
+                relaxation_time=relaxation_time,
+                mode=mode)
+            errors = lookup_table.midpoint_errors()
+            lookup_table.error_bound = max(errors.values())
+            if tolerance is None or lookup_table.error_bound <= tolerance:
+                return lookup_table
+            if errors['Carrier Density'] >= errors['Angular Frequency']:
+                densities = 2 * densities - 1
+            else:
+                frequencies = 2 * frequencies - 1
+            if densities * frequencies * itemsize > max_bytes:
+                raise ValueError(
+                    f'Lookup table error {lookup_table.error_bound:.3g} above '
+                    f'tolerance {tolerance:.3g} at resolution '
+                    f'{table.shape}, refining further exceeds '
+                    f'{max_bytes / 1E6:.0f} MB')
+
+    def midpoint_errors(self):
+        '''
+        Maximum absolute interpolation error midway between grid points along
+        each axis and at the cell centres, where bilinear interpolation error
+        is largest.
+        Args:
+            None
+        Returns:
+            errors: <dict> carrier density, angular frequency and cell centre
+                    maximum absolute permittivity errors
+        '''
+        carrier_densities = self.carrier_densities
+        angular_frequencies = self.angular_frequencies
+        log_densities = np.log(carrier_densities)
+        log_frequencies = np.log(angular_frequencies)
+        density_midpoints = np.exp(
+            (log_densities[:-1] + log_densities[1:]) / 2)
+        frequency_midpoints = np.exp(
+            (log_frequencies[:-1] + log_frequencies[1:]) / 2)
+        errors = {}
+        for name, densities, frequencies in [
+                ('Carrier Density', density_midpoints, angular_frequencies),
+                ('Angular Frequency', carrier_densities, frequency_midpoints),
+                ('Cell Centre', density_midpoints, frequency_midpoints)]:
+            exact = drude_permittivity_grid(
+                carrier_densities=densities,
+                angular_frequencies=frequencies,
+                effective_mass=self.effective_mass,
+                epsilon_infinity=self.epsilon_infinity,
+                relaxation_time=self.relaxation_time,
+                mode=self.mode)
+            interpolated = self.interpolate(
+                carrier_density=densities[:, np.newaxis],
+                angular_frequency=frequencies[np.newaxis, :])
+            errors[name] = float(np.max(np.abs(interpolated - exact)))
+        return errors
+
+    def measure_error(self):
+        '''
+        Maximum absolute interpolation error between grid points.
+        Args:
+            None
+        Returns:
+            error: <float> maximum absolute permittivity error
+        '''
+        return max(self.midpoint_errors().values())
+
+    def interpolate(self,
+                    carrier_density,
+                    angular_frequency):
+        '''
+        Vectorised bilinear interpolation of complex permittivity. Inputs are
+        broadcast against each other.
+        Args:
+            carrier_density: <array> carrier densities in m^-3
+            angular_frequency: <array> angular frequencies in rad/s
+        Returns:
+            permittivity: <array> complex permittivity, broadcast shape
+        '''
+        log_density = np.log(np.asarray(carrier_density, dtype=float))
+        log_frequency = np.log(np.asarray(angular_frequency, dtype=float))
+        margin = 1E-9
+        if (log_density.min(initial=np.inf)
+                < self._log_densities[0] - margin
+                or log_density.max(initial=-np.inf)
+                > self._log_densities[1] + margin
+                or log_frequency.min(initial=np.inf)
+                < self._log_frequencies[0] - margin
+                or log_frequency.max(initial=-np.inf)
+                > self._log_frequencies[1] + margin):
+            raise ValueError('Query outside lookup table range')
+        density_position = (
+            log_density * self._density_scale - self._density_offset)
+        frequency_position = (
+            log_frequency * self._frequency_scale - self._frequency_offset)
+        density_index = np.clip(
+            density_position.astype(np.intp), 0, self.table.shape[0] - 2)
+        frequency_index = np.clip(
+            frequency_position.astype(np.intp), 0, self.table.shape[1] - 2)
+        density_weight = density_position - density_index
+        frequency_weight = frequency_position - frequency_index
+
+        ''' One flat index per query, the cell's other corners are offsets '''
+        columns = self.table.shape[1]
+        index = density_index * columns + frequency_index
+        lower = self._flat_table.take(index)
+        lower += (self._flat_table.take(index + 1) - lower) * frequency_weight
+        index += columns
+        upper = self._flat_table.take(index)
+        upper += (self._flat_table.take(index + 1) - upper) * frequency_weight
+        lower += (upper - lower) * density_weight
+        return lower
+
+    def __call__(self,
+                 carrier_density,
+                 angular_frequency):
+        '''
+        Shorthand for interpolate.
+        '''
+        return self.interpolate(
+            carrier_density=carrier_density,
+            angular_frequency=angular_frequency)
+
+    def save(self,
+             out_path):
+        '''
+        Save table to out_path (.npy) with a json metadata file alongside, so
+        it can be loaded, or memory-mapped, by other processes.
+        Args:
+            out_path: <string> path to .npy file
+        Returns:
+            None
+        '''
+        out_path = Path(out_path)
+        with atomic_write(out_path=out_path.with_suffix('.npy')) as \
+                temporary_path, open(temporary_path, 'wb') as outfile:
+            np.save(outfile, np.ascontiguousarray(self.table))
+        save_json_dicts(
+            out_path=out_path.with_suffix('.json'),
+            dictionary={
+                'Carrier Density Range': self.density_range,
+                'Angular Frequency Range': self.frequency_range,
+                'Resolution': list(self.table.shape),
+                'Effective Mass': self.effective_mass,
+                'Epsilon Infinity': self.epsilon_infinity,
+                'Relaxation Time': self.relaxation_time,
+                'Drude Mode': self.mode,
+                'Error Bound': self.error_bound})
+
+    @classmethod
+    def load(cls,
+             file_path,
+             mmap=True):
+        '''
+        Load a saved table. With mmap the table is memory-mapped read-only so
+        worker processes share the same pages instead of copies.
+        Args:
+            file_path: <string> path to .npy file
+            mmap: <bool> memory-map the table
+        Returns:
+            lookup_table: <PermittivityLookupTable>
+        '''
+        file_path = Path(file_path)
+        metadata = load_json(file_path=file_path.with_suffix('.json'))
+        table = np.load(
+            file_path.with_suffix('.npy'),
+            mmap_mode='r' if mmap else None)
+        return cls(
+            density_range=metadata['Carrier Density Range'],
+            frequency_range=metadata['Angular Frequency Range'],
+            table=table,
+            effective_mass=metadata['Effective Mass'],
+            epsilon_infinity=metadata['Epsilon Infinity'],
+            relaxation_time=metadata['Relaxation Time'],
+            error_bound=metadata['Error Bound'],
+            mode=metadata.get('Drude Mode', 'Approximate'))
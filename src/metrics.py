@@ -0,0 +1,368 @@
+import time
+import threading
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.fileIO import atomic_write
+
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30, 60)
+
+
+class MetricsRegistry:
+    '''
+    Thread safe run metrics: counters, gauges and histograms keyed by metric
+    name and labels, rendered in the Prometheus text exposition format.
+    Collectors are called at render time for values owned elsewhere (cache
+    statistics, queue depth).
+    '''
+    def __init__(self):
+        self.start_time = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self,
+                 name,
+                 description):
+        '''
+        Set the help text rendered for a metric.
+        Args:
+            name: <string> metric name
+            description: <string> help text
+        Returns:
+            None
+        '''
+        self._help[name] = description
+
+    def increment(self,
+                  name,
+                  amount=1,
+                  labels=None):
+        '''
+        Add to a counter.
+        Args:
+            name: <string> metric name, ending in _total by convention
+            amount: <float> amount to add
+            labels: <dict> metric labels
+        Returns:
+            None
+        '''
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self,
+                  name,
+                  value,
+                  labels=None):
+        '''
+        Set a gauge.
+        Args:
+            name: <string> metric name
+            value: <float> gauge value
+            labels: <dict> metric labels
+        Returns:
+            None
+        '''
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self,
+                name,
+                value,
+                labels=None,
+                buckets=LATENCY_BUCKETS):
+        '''
+        Record one observation in a histogram.
+        Args:
+            name: <string> metric name
+            value: <float> observed value
+            labels: <dict> metric labels
+            buckets: <tuple> bucket upper bounds, used when the histogram is
+                        first observed
+        Returns:
+            None
+        '''
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, {
+                'Buckets': tuple(buckets),
+                'Counts': [0] * len(buckets),
+                'Sum': 0.0,
+                'Count': 0})
+            for index, bound in enumerate(histogram['Buckets']):
+                if value <= bound:
+                    histogram['Counts'][index] += 1
+            histogram['Sum'] += value
+            histogram['Count'] += 1
+
+    @contextmanager
+    def timer(self,
+              stage,
+              name='drude_stage_seconds'):
+        '''
+        Time the with block into the stage latency histogram.
+        Args:
+            stage: <string> stage label
+            name: <string> histogram name
+        Returns:
+            None
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(
+                name=name,
+                value=time.perf_counter() - start,
+                labels={'stage': stage})
+
+    def counter_total(self,
+                      name):
+        '''
+        Sum of a counter over all of its labels.
+        Args:
+            name: <string> metric name
+        Returns:
+            total: <float>
+        '''
+        with self._lock:
+            return sum(
+                value for (key, _), value in self._counters.items()
+                if key == name)
+
+    def histogram_sum(self,
+                      name,
+                      labels=None):
+        '''
+        Sum of the observations in one histogram, e.g. the total seconds
+        timed into a stage.
+        Args:
+            name: <string> metric name
+            labels: <dict> metric labels
+        Returns:
+            total: <float> 0 when nothing has been observed
+        '''
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            return self._histograms.get(key, {}).get('Sum', 0.0)
+
+    def add_collector(self,
+                      collector):
+        '''
+        Register a callable returning {metric name: value} gauges, or
+        {metric name: {label tuple: value}}, evaluated at every render.
+        Args:
+            collector: <callable> no-argument collector
+        Returns:
+            None
+        '''
+        self._collectors.append(collector)
+
+    def render(self):
+        '''
+        All metrics in the Prometheus text exposition format.
+        Args:
+            None
+        Returns:
+            text: <string> metrics text
+        '''
+        gauges = {'drude_uptime_seconds': {(): time.time() - self.start_time}}
+        for collector in self._collectors:
+            for name, value in collector().items():
+                if isinstance(value, dict):
+                    gauges.setdefault(name, {}).update(value)
+                else:
+                    gauges.setdefault(name, {})[()] = value
+        with self._lock:
+            counters = {}
+            for (name, labels), value in self._counters.items():
+                counters.setdefault(name, {})[labels] = value
+            for (name, labels), value in self._gauges.items():
+                gauges.setdefault(name, {})[labels] = value
+            histograms = {}
+            for (name, labels), histogram in self._histograms.items():
+                histograms.setdefault(name, {})[labels] = dict(
+                    histogram,
+                    Counts=list(histogram['Counts']))
+
+        lines = []
+        for kind, metrics in [('counter', counters), ('gauge', gauges)]:
+            for name in sorted(metrics):
+                lines.extend(self._header(name=name, kind=kind))
+                for labels, value in sorted(metrics[name].items()):
+                    lines.append(
+                        f'{name}{format_labels(labels)} {float(value):.17g}')
+        for name in sorted(histograms):
+            lines.extend(self._header(name=name, kind='histogram'))
+            for labels, histogram in sorted(histograms[name].items()):
+                for bound, count in zip(
+                        histogram['Buckets'],
+                        histogram['Counts']):
+                    lines.append(
+                        f'{name}_bucket'
+                        f'{format_labels(labels + (("le", f"{bound:g}"),))} '
+                        f'{count}')
+                lines.append(
+                    f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))}'
+                    f' {histogram["Count"]}')
+                lines.append(
+                    f'{name}_sum{format_labels(labels)} '
+                    f'{histogram["Sum"]:.17g}')
+                lines.append(
+                    f'{name}_count{format_labels(labels)} '
+                    f'{histogram["Count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def _header(self,
+                name,
+                kind):
+        '''
+        HELP and TYPE lines of a metric.
+        '''
+        header = []
+        if name in self._help.keys():
+            header.append(f'# HELP {name} {self._help[name]}')
+        header.append(f'# TYPE {name} {kind}')
+        return header
+
+
+def format_labels(labels):
+    '''
+    Prometheus label set from (name, value) pairs.
+    Args:
+        labels: <tuple> sorted (name, value) pairs
+    Returns:
+        text: <string> label set, empty without labels
+    '''
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{name}="' + f'{value}'.replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels)
+    return f'{{{pairs}}}'
+
+
+registry = MetricsRegistry()
+_write_lock = threading.Lock()
+
+
+def timed(iterable,
+          stage):
+    '''
+    Iterate while timing each wait for the next item into the stage latency
+    histogram, e.g. the time a consumer waits on prefetched batches.
+    Args:
+        iterable: <iterable> items to yield
+        stage: <string> stage label
+    Returns:
+        items: <generator> the items of iterable
+    '''
+    iterator = iter(iterable)
+    while True:
+        with registry.timer(stage=stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count_fit(fit,
+              evaluations):
+    '''
+    Count one curve_fit call and its model function evaluations.
+    Args:
+        fit: <string> fit label, e.g. "Real", "Imaginary" or "Model"
+        evaluations: <int> function evaluations (curve_fit infodict "nfev")
+    Returns:
+        None
+    '''
+    registry.increment(
+        name='drude_curve_fit_calls_total',
+        labels={'fit': fit})
+    registry.increment(
+        name='drude_curve_fit_evaluations_total',
+        amount=evaluations,
+        labels={'fit': fit})
+
+
+def write_textfile(out_path,
+                   registry=registry):
+    '''
+    Write the metrics to a Prometheus text file, atomically so a collector
+    (e.g. the node exporter textfile collector) never reads a partial file.
+    Writes from several threads are serialised.
+    Args:
+        out_path: <string> path to .prom file
+        registry: <MetricsRegistry> metrics to write
+    Returns:
+        None
+    '''
+    text = registry.render()
+    with _write_lock, atomic_write(out_path=out_path) as temporary_path:
+        with open(temporary_path, 'w') as outfile:
+            outfile.write(text)
+
+
+def start_exporter(textfile=None,
+                   port=None,
+                   interval=15,
+                   host='127.0.0.1',
+                   registry=registry):
+    '''
+    Export the metrics from background threads: rewrite a text file every
+    interval seconds and/or serve them over HTTP at /metrics on a local port.
+    Args:
+        textfile: <string> path to .prom file, None for no file
+        port: <int> HTTP port, None for no endpoint
+        interval: <float> seconds between text file writes
+        host: <string> HTTP interface to bind
+        registry: <MetricsRegistry> metrics to export
+    Returns:
+        stop: <threading.Event> set to stop exporting; call write_textfile
+                afterwards for the final values
+    '''
+    stop = threading.Event()
+    if textfile is not None:
+        def write():
+            while not stop.wait(interval):
+                write_textfile(out_path=textfile, registry=registry)
+        threading.Thread(target=write, daemon=True).start()
+
+    if port is not None:
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type',
+                    'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', f'{len(body)}')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def shutdown():
+            stop.wait()
+            server.shutdown()
+            server.server_close()
+        threading.Thread(target=shutdown, daemon=True).start()
+    return stop
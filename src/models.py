@@ -0,0 +1,455 @@
+import numpy as np
+import scipy.optimize as opt
+import src.cache as cache
+import src.analysis as anal
+import src.kernels as kernels
+import src.metrics as metrics
+
+
+DRUDE_NAMES = [
+    'Carrier Density',
+    'Effective Mass',
+    'Epsilon Infinity',
+    'Relaxation Time']
+LORENTZ_NAMES = [
+    'Strength',
+    'Resonance Frequency',
+    'Damping']
+
+
+def drude_names(oscillators=0):
+    '''
+    Parameter names of the Drude model.
+    Args:
+        oscillators: <int> unused, the Drude model has no oscillators
+    Returns:
+        names: <array> parameter names
+    '''
+    return list(DRUDE_NAMES)
+
+
+def drude_permittivity(angular_frequency,
+                       parameters):
+    '''
+    Complex permittivity of the Drude model used by the real and imaginary
+    fits, eps_inf (1 - wp^2 / w^2) + i eps_inf wp^2 / (w tau) (the
+    "Approximate" mode of analysis.complex_drude_permittivity).
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4) carrier density, effective mass, epsilon
+                    infinity and relaxation time
+    Returns:
+        permittivity: <array> (..., W) complex permittivity
+    '''
+    return kernels.drude_model(
+        angular_frequency=angular_frequency,
+        parameters=parameters,
+        mode='Approximate')
+
+
+def drude_gradient(angular_frequency,
+                   parameters):
+    '''
+    Analytic derivatives of the Drude model permittivity. With wp^2
+    proportional to n / m every derivative is a ratio of the model terms.
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4) Drude parameters
+    Returns:
+        gradient: <array> (..., W, 4) complex d(eps)/d(parameter)
+    '''
+    if kernels.jit_enabled():
+        return kernels.drude_gradient(
+            angular_frequency=angular_frequency,
+            parameters=parameters,
+            mode='Approximate')
+    permittivity = drude_permittivity(
+        angular_frequency=angular_frequency,
+        parameters=parameters)
+    parameters = np.asarray(parameters, dtype=float)[..., np.newaxis, :]
+    epsilon_infinity = parameters[..., 2]
+    drude_term = epsilon_infinity - permittivity.real
+    imag_permittivity = permittivity.imag
+    return np.stack([
+        -drude_term / parameters[..., 0]
+        + 1j * imag_permittivity / parameters[..., 0],
+        drude_term / parameters[..., 1]
+        - 1j * imag_permittivity / parameters[..., 1],
+        1 - drude_term / epsilon_infinity
+        + 1j * imag_permittivity / epsilon_infinity,
+        -1j * imag_permittivity / parameters[..., 3]], axis=-1)
+
+
+def drude_full_permittivity(angular_frequency,
+                            parameters):
+    '''
+    Complex permittivity of the full Drude form,
+    eps_inf (1 - wp^2 / (w^2 + i w tau)), with tau the damping rate.
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4) Drude parameters
+    Returns:
+        permittivity: <array> (..., W) complex permittivity
+    '''
+    return kernels.drude_model(
+        angular_frequency=angular_frequency,
+        parameters=parameters,
+        mode='Full')
+
+
+def drude_full_gradient(angular_frequency,
+                        parameters):
+    '''
+    Analytic derivatives of the full Drude form, the Drude-Lorentz gradient
+    without oscillators.
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4) Drude parameters
+    Returns:
+        gradient: <array> (..., W, 4) complex d(eps)/d(parameter)
+    '''
+    if kernels.jit_enabled():
+        return kernels.drude_gradient(
+            angular_frequency=angular_frequency,
+            parameters=parameters,
+            mode='Full')
+    return drude_lorentz_gradient(
+        angular_frequency=angular_frequency,
+        parameters=parameters)
+
+
+def drude_lorentz_names(oscillators=1):
+    '''
+    Parameter names of the Drude-Lorentz model.
+    Args:
+        oscillators: <int> number of Lorentz oscillators
+    Returns:
+        names: <array> Drude names followed by each oscillator's strength,
+                resonance frequency and damping
+    '''
+    return DRUDE_NAMES + [
+        f'Oscillator {index + 1} {name}'
+        for index in range(oscillators)
+        for name in LORENTZ_NAMES]
+
+
+def drude_lorentz_terms(angular_frequency,
+                        parameters):
+    '''
+    Free carrier and oscillator terms of the Drude-Lorentz model,
+    eps = eps_inf - eps_inf wp^2 / (w^2 + i w gamma)
+            + sum_j f_j w_j^2 / (w_j^2 - w^2 - i w G_j),
+    where the Drude relaxation time is the damping rate gamma.
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4 + 3 J) Drude-Lorentz parameters
+    Returns:
+        terms: <tuple> (..., W) Drude term, (..., W) Drude denominator,
+                (..., W, J) oscillator terms and denominators, (..., 1, J)
+                strengths, resonances and dampings
+    '''
+    omega = np.asarray(angular_frequency, dtype=float)
+    parameters = np.asarray(parameters, dtype=float)
+    drude = parameters[..., np.newaxis, :4]
+    drude_denominator = omega ** 2 + 1j * omega * drude[..., 3]
+    drude_term = drude[..., 2] * anal.plasmafrequency_squared(
+        carrier_density=drude[..., 0],
+        effective_mass=drude[..., 1]) / drude_denominator
+    oscillators = parameters[..., np.newaxis, 4:].reshape(
+        parameters.shape[:-1] + (1, (parameters.shape[-1] - 4) // 3, 3))
+    strength = oscillators[..., 0]
+    resonance = oscillators[..., 1]
+    damping = oscillators[..., 2]
+    w = omega[:, np.newaxis]
+    lorentz_denominator = resonance ** 2 - w ** 2 - 1j * w * damping
+    lorentz_terms = strength * resonance ** 2 / lorentz_denominator
+    return (
+        drude_term,
+        drude_denominator,
+        lorentz_terms,
+        lorentz_denominator,
+        strength,
+        resonance,
+        damping)
+
+
+def drude_lorentz_permittivity(angular_frequency,
+                               parameters):
+    '''
+    Complex permittivity of the Drude-Lorentz model (drude_lorentz_terms).
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4 + 3 J) Drude-Lorentz parameters
+    Returns:
+        permittivity: <array> (..., W) complex permittivity
+    '''
+    drude_term, _, lorentz_terms, *_ = drude_lorentz_terms(
+        angular_frequency=angular_frequency,
+        parameters=parameters)
+    epsilon_infinity = np.asarray(parameters, dtype=float)[..., np.newaxis, 2]
+    return epsilon_infinity - drude_term + np.sum(lorentz_terms, axis=-1)
+
+
+def drude_lorentz_gradient(angular_frequency,
+                           parameters):
+    '''
+    Analytic derivatives of the Drude-Lorentz permittivity.
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4 + 3 J) Drude-Lorentz parameters
+    Returns:
+        gradient: <array> (..., W, 4 + 3 J) complex d(eps)/d(parameter)
+    '''
+    omega = np.asarray(angular_frequency, dtype=float)
+    parameters = np.asarray(parameters, dtype=float)
+    (drude_term,
+     drude_denominator,
+     lorentz_terms,
+     lorentz_denominator,
+     strength,
+     resonance,
+     damping) = drude_lorentz_terms(
+        angular_frequency=omega,
+        parameters=parameters)
+    drude = parameters[..., np.newaxis, :4]
+    drude_gradients = np.stack([
+        -drude_term / drude[..., 0],
+        drude_term / drude[..., 1],
+        1 - drude_term / drude[..., 2],
+        drude_term * 1j * omega / drude_denominator], axis=-1)
+    w = omega[:, np.newaxis]
+    lorentz_gradients = np.stack([
+        resonance ** 2 / lorentz_denominator,
+        2 * strength * resonance * (-w ** 2 - 1j * w * damping)
+        / lorentz_denominator ** 2,
+        lorentz_terms * 1j * w / lorentz_denominator], axis=-1)
+    lorentz_gradients = lorentz_gradients.reshape(
+        lorentz_gradients.shape[:-2] + (-1,))
+    return np.concatenate([drude_gradients, lorentz_gradients], axis=-1)
+
+
+MODELS = {
+    'Drude': {
+        'Names': drude_names,
+        'Permittivity': drude_permittivity,
+        'Gradient': drude_gradient},
+    'Drude Full': {
+        'Names': drude_names,
+        'Permittivity': drude_full_permittivity,
+        'Gradient': drude_full_gradient},
+    'Drude Lorentz': {
+        'Names': drude_lorentz_names,
+        'Permittivity': drude_lorentz_permittivity,
+        'Gradient': drude_lorentz_gradient}}
+
+
+def get_model(model):
+    '''
+    Look up a registered dispersion model.
+    Args:
+        model: <string> model name (MODELS)
+    Returns:
+        model: <dict> names, permittivity and gradient functions
+    '''
+    if model not in MODELS:
+        raise ValueError(
+            f'Unknown dispersion model "{model}", '
+            f'registered models: {", ".join(MODELS)}')
+    return MODELS[model]
+
+
+def model_permittivity(model,
+                       angular_frequency,
+                       parameters):
+    '''
+    Complex permittivity of a registered model, served from the shared curve
+    cache for single parameter sets.
+    Args:
+        model: <string> model name (MODELS)
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (P,) or (..., P) model parameters
+    Returns:
+        permittivity: <array> (..., W) complex permittivity
+    '''
+    function = get_model(model=model)['Permittivity']
+    parameters = np.asarray(parameters, dtype=float)
+    if parameters.ndim > 1:
+        return function(angular_frequency, parameters)
+    return cache.curve_cache.get_or_compute(
+        name=f'{model} Permittivity',
+        parameters=parameters,
+        angular_frequency=angular_frequency,
+        function=lambda: function(angular_frequency, parameters))
+
+
+def get_model_guesses_bounds(model,
+                             carrier_density,
+                             drude_parameters):
+    '''
+    Get model variable names, guesses and bounds. The carrier density guess
+    and bounds come from the measured carrier density, the other Drude
+    variables from the user "Names", "Guesses" and "Bounds", and each entry of
+    "Lorentz Oscillators" adds one oscillator's strength, resonance frequency
+    and damping guesses and bounds.
+    Args:
+        model: <string> model name (MODELS)
+        carrier_density: <dict> carrier density in m^-3, with errors
+        drude_parameters: <dict> user input guess dictionary
+                            (Drude_parameters.json)
+    Returns:
+        guesses_bounds: <dict> dictionary containing variable names, guesses,
+                        and bounds (bounds set for optimize curve_fit)
+    '''
+    oscillators = (
+        drude_parameters.get('Lorentz Oscillators', [])
+        if model == 'Drude Lorentz' else [])
+    names = get_model(model=model)['Names'](oscillators=len(oscillators))
+    guesses = {
+        name: guess for name, guess
+        in zip(drude_parameters['Names'], drude_parameters['Guesses'])}
+    bounds = {
+        name: bound for name, bound
+        in zip(drude_parameters['Names'], drude_parameters['Bounds'])}
+    guesses['Carrier Density'] = carrier_density['Carrier Density']
+    bounds['Carrier Density'] = [
+        max(carrier_density['Carrier Density']
+            - carrier_density['Carrier Error'], 0),
+        carrier_density['Carrier Density'] + carrier_density['Carrier Error']]
+    for index, oscillator in enumerate(oscillators):
+        for name, guess, bound in zip(
+                LORENTZ_NAMES,
+                oscillator['Guesses'],
+                oscillator['Bounds']):
+            guesses[f'Oscillator {index + 1} {name}'] = guess
+            bounds[f'Oscillator {index + 1} {name}'] = bound
+    return {
+        'Model Variable Names': names,
+        'Model Initial Guesses': [guesses[name] for name in names],
+        'Model Bounds': (
+            tuple(bounds[name][0] for name in names),
+            tuple(bounds[name][1] for name in names))}
+
+
+def stacked_model(model):
+    '''
+    Real and imaginary permittivity of a model stacked into one real array,
+    for fitting both parts together. The x data is the angular frequency grid
+    repeated twice, [w, w].
+    Args:
+        model: <string> model name (MODELS)
+    Returns:
+        functions: <tuple> stacked model f(x, *parameters) and its jacobian
+    '''
+    functions = get_model(model=model)
+
+    def stacked_permittivity(x, *parameters):
+        omega = x[:x.size // 2]
+        permittivity = functions['Permittivity'](omega, np.array(parameters))
+        return np.concatenate([permittivity.real, permittivity.imag])
+
+    def stacked_gradient(x, *parameters):
+        omega = x[:x.size // 2]
+        gradient = functions['Gradient'](omega, np.array(parameters))
+        return np.concatenate([gradient.real, gradient.imag])
+
+    return stacked_permittivity, stacked_gradient
+
+
+def optimize_model(model,
+                   angular_frequency,
+                   permittivity,
+                   initial_guesses,
+                   bounds,
+                   variable_names):
+    '''
+    Fit a registered model to the real and imaginary permittivity together,
+    weighted by the permittivity errors, with the analytic model jacobian.
+    Args:
+        model: <string> model name (MODELS)
+        angular_frequency: <array> angular frequency values of x data points
+        permittivity: <dict> real and imaginary permittivities with errors
+        initial_guesses: <array> variable guesses
+        bounds: <tuple> (lower, upper) bounds
+        variable_names: <array> variable names, for the diagnostics
+    Returns:
+        results: <dict> model name, popt, sqrt(diag(pcov)), pcov and fit
+                diagnostics from the optimizer
+    '''
+    function, jacobian = stacked_model(model=model)
+    omega = np.asarray(angular_frequency, dtype=float)
+    x = np.concatenate([omega, omega])
+    y = np.concatenate([
+        permittivity['Real Permittivity'],
+        permittivity['Imaginary Permittivity']])
+    sigma = np.concatenate([
+        permittivity['Real Permittivity Error'],
+        permittivity['Imaginary Permittivity Error']])
+    popt, pcov, infodict, _, _ = opt.curve_fit(
+        f=function,
+        xdata=x,
+        ydata=y,
+        p0=initial_guesses,
+        sigma=sigma,
+        bounds=bounds,
+        jac=jacobian,
+        x_scale='jac',
+        full_output=True)
+    metrics.count_fit(
+        fit='Model',
+        evaluations=infodict['nfev'])
+    errors = np.sqrt(np.diag(pcov))
+    results = {
+        'Model': model,
+        'Model Results': [result for result in popt],
+        'Model Errors': [error for error in errors],
+        'Model Covariance': pcov.tolist()}
+    results.update(anal.fit_diagnostics(
+        prefix='Model',
+        model=function,
+        angular_frequency=x,
+        permittivity=y,
+        permittivity_error=sigma,
+        variable_names=variable_names,
+        results=popt,
+        covariance=pcov,
+        bounds=bounds))
+    return results
+
+
+def results_permittivity(angular_frequency,
+                         results_dictionary):
+    '''
+    Complex permittivity of a fitted batch whatever model it was fitted with.
+    Batches fitted with the two stage Drude fit use their real and imaginary
+    results for the real and imaginary parts.
+    Args:
+        angular_frequency: <array> angular frequency grid
+        results_dictionary: <dict> fitted batch results dictionary
+    Returns:
+        permittivity: <array> complex permittivity
+    '''
+    if 'Model Results' in results_dictionary.keys():
+        return model_permittivity(
+            model=results_dictionary['Model'],
+            angular_frequency=angular_frequency,
+            parameters=results_dictionary['Model Results'])
+    real_permittivity = cache.real_drude_curve(
+        angular_frequency=angular_frequency,
+        real_results=results_dictionary['Real Results'])
+    imag_permittivity = cache.imag_drude_curve(
+        angular_frequency=angular_frequency,
+        imag_results=results_dictionary['Imaginary Results'])
+    return real_permittivity + 1j * imag_permittivity
+
+
+def is_fitted(results_dictionary):
+    '''
+    Check a batch results dictionary holds a complete fit.
+    Args:
+        results_dictionary: <dict> batch results dictionary
+    Returns:
+        fitted: <bool>
+    '''
+    return (
+        'Model Results' in results_dictionary.keys()
+        or 'Imaginary Results' in results_dictionary.keys())
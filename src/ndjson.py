@@ -0,0 +1,126 @@
+import sys
+import json
+import math
+import time
+import socket
+import numpy as np
+import src.database as database
+
+from pathlib import Path
+
+
+def to_builtin(value):
+    '''
+    Convert a value to built-in python types for json. Arrays convert in one
+    tolist call rather than element by element through a default hook, and
+    non-finite floats become None so every line is strict json.
+    Args:
+        value: <object> value to convert
+    Returns:
+        value: <object> json serialisable value
+    '''
+    if isinstance(value, dict):
+        return {f'{key}': to_builtin(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, Path):
+        return f'{value}'
+    return value
+
+
+def open_output(target):
+    '''
+    Open an NDJSON output: "-" for stdout, "tcp://host:port" for a socket, or
+    a path, appended to, which may be a named pipe.
+    Args:
+        target: <string> output target
+    Returns:
+        output: <file> line buffered text stream
+    '''
+    if target == '-':
+        return sys.stdout
+    if target.startswith('tcp://'):
+        host, port = target[len('tcp://'):].rsplit(':', 1)
+        return socket.create_connection((host, int(port))).makefile(
+            'w',
+            buffering=1)
+    return open(target, 'a', buffering=1)
+
+
+def close_output(output):
+    '''
+    Close an NDJSON output opened with open_output, leaving stdout open.
+    Args:
+        output: <file> output stream
+    Returns:
+        None
+    '''
+    if output is not None and output not in (sys.stdout, sys.__stdout__):
+        output.close()
+
+
+def batch_record(batch,
+                 status,
+                 batch_dictionary,
+                 results_file=None,
+                 outputs=()):
+    '''
+    Compact summary of one finished batch: fitted parameters with errors,
+    fit diagnostics (database.batch_parameters), fit gate failures and the
+    files the batch was read from and written to.
+    Args:
+        batch: <string> batch name
+        status: <string> journal status, "Completed" or "Rejected"
+        batch_dictionary: <dict> batch results dictionary
+        results_file: <string> path to batch json results file
+        outputs: <array> paths of other files written for the batch
+    Returns:
+        record: <dict> batch record
+    '''
+    return {
+        'Batch Name': f'{batch}',
+        'Status': status,
+        'Time': time.time(),
+        'Model': batch_dictionary.get('Model', 'Drude'),
+        'Parameters': database.batch_parameters(dictionary=batch_dictionary),
+        'Parameters At Bounds': {
+            key: value for key, value in batch_dictionary.items()
+            if key.endswith('Parameters At Bounds')},
+        'Fit Gate Failures': batch_dictionary.get('Fit Gate Failures', []),
+        'Input Files': {
+            key: value for key, value in batch_dictionary.items()
+            if key.endswith('File Path')},
+        'Results File': results_file,
+        'Outputs': list(outputs)}
+
+
+def write_record(output,
+                 record):
+    '''
+    Write one record as a compact json line and flush it so consumers see it
+    straight away. A consumer that has gone away closes the output rather than
+    stopping the run, the results are still written to disk.
+    Args:
+        output: <file> output stream, None when closed
+        record: <dict> record to write
+    Returns:
+        output: <file> output stream, None if the consumer has gone away
+    '''
+    if output is None:
+        return None
+    try:
+        output.write(json.dumps(
+            to_builtin(record),
+            separators=(',', ':'),
+            allow_nan=False) + '\n')
+        output.flush()
+    except (BrokenPipeError, ConnectionError):
+        print('NDJSON consumer disconnected, output stopped', file=sys.stderr)
+        return None
+    return output
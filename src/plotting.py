@@ -1,8 +1,28 @@
+import os
 import matplotlib.pyplot as plt
+
+from pathlib import Path
+from src.fileIO import atomic_write
 from matplotlib.ticker import MultipleLocator, AutoMinorLocator
 
-plt.rcParams['figure.dpi'] = 300
-plt.rcParams['savefig.dpi'] = 300
+
+RENDER_PROFILES = {
+    'Preview': {
+        'DPI': 60,
+        'Formats': ['png'],
+        'Tight Layout': False,
+        'Rasterize Points': False},
+    'Default': {
+        'DPI': 300,
+        'Formats': ['png'],
+        'Tight Layout': True,
+        'Rasterize Points': False},
+    'Publication': {
+        'DPI': 300,
+        'Formats': ['png', 'svg', 'pdf'],
+        'Tight Layout': True,
+        'Rasterize Points': True}}
+
 
 def tick_function(X):
     '''
@@ -16,11 +36,42 @@ def tick_function(X):
     return ['%.2f' % z for z in V]
 
 
+def save_figure(fig,
+                out_path,
+                profile='Default'):
+    '''
+    Save figure atomically in every format of the render profile. The first
+    format replaces the extension of out_path, further formats are saved
+    alongside with their own extensions.
+    Args:
+        fig: <matplotlib.figure.Figure> figure to save
+        out_path: <string> path to save
+        profile: <string> render profile name (RENDER_PROFILES)
+    Returns:
+        out_paths: <array> paths of saved files
+    '''
+    settings = RENDER_PROFILES[profile]
+    out_paths = []
+    for image_format in settings['Formats']:
+        format_path = Path(out_path).with_suffix(f'.{image_format}')
+        with atomic_write(out_path=format_path) as temporary_path:
+            with open(temporary_path, 'wb') as outfile:
+                fig.savefig(
+                    outfile,
+                    format=image_format,
+                    dpi=settings['DPI'])
+                outfile.flush()
+                os.fsync(outfile.fileno())
+        out_paths.append(format_path)
+    return out_paths
+
+
 def literature_plot(drude_permittivity,
                     label,
                     frequency_range,
                     frequency_ticks,
-                    out_path):
+                    out_path,
+                    profile='Default'):
     '''
     Recreate plot from Atwater Paper, including x ticks in frequency (THz) and
     wavelength (μm).
@@ -31,8 +82,9 @@ def literature_plot(drude_permittivity,
         frequency_range: <array> frequency array in THz
         frequency_ticks: <array> desired frequency tick values
         out_path: <string> path to save
+        profile: <string> render profile name (RENDER_PROFILES)
     Returns:
-        None
+        out_paths: <array> paths of saved files
     '''
     fig, ax1 = plt.subplots(
         nrows=1,
@@ -72,40 +124,35 @@ def literature_plot(drude_permittivity,
         'Epsilon [au]',
         fontsize=14,
         fontweight='bold')
-    plt.savefig(out_path)
+    out_paths = save_figure(
+        fig=fig,
+        out_path=out_path,
+        profile=profile)
     fig.clf()
     plt.cla()
     plt.close(fig)
+    return out_paths
 
 
-def drude_permittivity_plot(frequency_THz,
-                            drude_permittivity_real,
-                            drude_permittivity_imag,
-                            real_color,
-                            imag_color,
-                            real_label,
-                            imaginary_label,
-                            frequency_points,
-                            frequency_errors,
-                            real_permittivity_points,
-                            real_permittivity_errors,
-                            imag_permittivity_points,
-                            imag_permittivity_errors,
-                            frequency_ticks,
-                            out_path):
+def permittivity_scaffold(frequency_ticks,
+                          profile='Default'):
+    '''
+    Build the twin-axis permittivity figure: real permittivity (left) and
+    imaginary permittivity (right) against wavelength (bottom) and frequency
+    (top). The axes, tick transforms and labels do not depend on the data, so
+    one scaffold can be reused for every plot in a run (see clear_scaffold).
+    Args:
+        frequency_ticks: <array> desired frequency tick values
+        profile: <string> render profile name (RENDER_PROFILES)
+    Returns:
+        scaffold: <dict> figure, axes, profile and the data artists added
+    '''
     fig, ax1 = plt.subplots(
         nrows=1,
         ncols=1,
         figsize=[10, 7])
     ax3 = ax1.twiny()
-    
-    ''' Plot Real Permittivity and Frequency '''
-    line1 = ax1.plot(
-        frequency_THz,
-        drude_permittivity_real,
-        color=real_color,
-        lw=4,
-        label=real_label)
+    ax2 = ax1.twinx()
     ax1.axhline(
         y=0,
         color='black',
@@ -113,52 +160,8 @@ def drude_permittivity_plot(frequency_THz,
         linestyle='--',
         alpha=0.5)
     ax1.set_ylim(-3.9, 5.9)
-
-    ''' Plot Imaginary Permittivity and Frequency '''
-    ax2 = ax1.twinx()
-    line2 = ax2.plot(
-        frequency_THz,
-        drude_permittivity_imag,
-        color=imag_color,
-        lw=4,
-        label=imaginary_label)
     ax2.set_ylim(-0.39, 0.59)
 
-    ''' Get Lines and Labels '''
-    lines = line1 + line2
-    labels = [line.get_label() for line in lines]
-    ax1.legend(
-        lines,
-        labels,
-        frameon=True,
-        loc='lower left',
-        ncol=1,
-        prop={'size': 22})
-
-    ''' Plot Real Resonant Points with Errors '''
-    ax1.errorbar(
-        x=frequency_points,
-        y=real_permittivity_points,
-        yerr=real_permittivity_errors,
-        mfc=real_color,
-        ecolor=real_color,
-        markeredgecolor=real_color,
-        marker='o',
-        linestyle='',
-        ms=12)
-
-    ''' Plot Imaginary Resonant Points with Errors '''
-    ax2.errorbar(
-        x=frequency_points,
-        y=imag_permittivity_points,
-        yerr=imag_permittivity_errors,
-        mfc=imag_color,
-        ecolor=imag_color,
-        markeredgecolor=imag_color,
-        marker='^',
-        linestyle='',
-        ms=12)
-
     ''' Set Up Wavelength Range '''
     ax3.set_xticks(frequency_ticks)
     ax3Ticks = ax3.get_xticks()
@@ -181,16 +184,14 @@ def drude_permittivity_plot(frequency_THz,
     ax1.set_ylabel(
         r'$\bf{\epsilon_{r}}$ (a.u.)',
         fontsize=32,
-        fontweight='bold',
-        color=real_color)
+        fontweight='bold')
     ax2.set_ylabel(
         r'$\bf{\epsilon_{i}}$ (a.u.)',
         fontsize=32,
         fontweight='bold',
         rotation=270,
-        labelpad=20,
-        color=imag_color)
-    
+        labelpad=20)
+
     ax1.tick_params(axis='x', which='major', labelsize=28)
     ax1.tick_params(axis='y', which='major', labelsize=28)
     ax2.tick_params(axis='y', which='major', labelsize=28)
@@ -205,9 +206,313 @@ def drude_permittivity_plot(frequency_THz,
     ax2.invert_xaxis()
     ax3.invert_xaxis()
 
+    if RENDER_PROFILES[profile]['Tight Layout']:
+        fig.tight_layout()
+    else:
+        fig.subplots_adjust(left=0.16, right=0.84, bottom=0.17, top=0.83)
+    return {
+        'Figure': fig,
+        'Real Axis': ax1,
+        'Imaginary Axis': ax2,
+        'Frequency Axis': ax3,
+        'Profile': profile,
+        'Artists': []}
+
+
+def clear_scaffold(scaffold):
+    '''
+    Remove the data artists and legend of the previous plot so the scaffold
+    can be reused.
+    Args:
+        scaffold: <dict> figure scaffold (permittivity_scaffold)
+    Returns:
+        None
+    '''
+    for artist in scaffold['Artists']:
+        artist.remove()
+    scaffold['Artists'] = []
+    legend = scaffold['Real Axis'].get_legend()
+    if legend is not None:
+        legend.remove()
+
+
+def close_scaffold(scaffold):
+    '''
+    Close the scaffold figure.
+    Args:
+        scaffold: <dict> figure scaffold (permittivity_scaffold)
+    Returns:
+        None
+    '''
+    scaffold['Figure'].clf()
+    plt.close(scaffold['Figure'])
+
+
+def add_permittivity_data(scaffold,
+                          frequency_THz,
+                          drude_permittivity_real,
+                          drude_permittivity_imag,
+                          real_color,
+                          imag_color,
+                          real_label,
+                          imaginary_label,
+                          frequency_points,
+                          real_permittivity_points,
+                          real_permittivity_errors,
+                          imag_permittivity_points,
+                          imag_permittivity_errors,
+                          line_width=4,
+                          marker_size=12,
+                          imag_linestyle='-'):
+    '''
+    Add one batch's Drude curves and measured points with error bars to the
+    scaffold. Error bars are rasterised when the render profile asks for it.
+    Args:
+        scaffold: <dict> figure scaffold (permittivity_scaffold)
+        frequency_THz: <array> frequency array in THz
+        drude_permittivity_real: <array> real Drude curve
+        drude_permittivity_imag: <array> imaginary Drude curve
+        real_color: <string> real curve colour
+        imag_color: <string> imaginary curve colour
+        real_label: <string> real curve legend label
+        imaginary_label: <string> imaginary curve legend label
+        frequency_points: <array> measured frequencies in THz
+        real_permittivity_points: <array> measured real permittivities
+        real_permittivity_errors: <array> measured real permittivity errors
+        imag_permittivity_points: <array> measured imaginary permittivities
+        imag_permittivity_errors: <array> measured imaginary errors
+        line_width: <float> curve line width
+        marker_size: <float> point marker size
+        imag_linestyle: <string> imaginary curve line style
+    Returns:
+        lines: <array> curve lines for the legend
+    '''
+    ax1 = scaffold['Real Axis']
+    ax2 = scaffold['Imaginary Axis']
+    rasterize = RENDER_PROFILES[scaffold['Profile']]['Rasterize Points']
+
+    ''' Plot Real and Imaginary Permittivity and Frequency '''
+    lines = ax1.plot(
+        frequency_THz,
+        drude_permittivity_real,
+        color=real_color,
+        lw=line_width,
+        label=real_label)
+    lines += ax2.plot(
+        frequency_THz,
+        drude_permittivity_imag,
+        color=imag_color,
+        lw=line_width,
+        linestyle=imag_linestyle,
+        label=imaginary_label)
+
+    ''' Plot Real and Imaginary Resonant Points with Errors '''
+    real_points = ax1.errorbar(
+        x=frequency_points,
+        y=real_permittivity_points,
+        yerr=real_permittivity_errors,
+        mfc=real_color,
+        ecolor=real_color,
+        markeredgecolor=real_color,
+        marker='o',
+        linestyle='',
+        ms=marker_size,
+        rasterized=rasterize)
+    imag_points = ax2.errorbar(
+        x=frequency_points,
+        y=imag_permittivity_points,
+        yerr=imag_permittivity_errors,
+        mfc=imag_color,
+        ecolor=imag_color,
+        markeredgecolor=imag_color,
+        marker='^',
+        linestyle='',
+        ms=marker_size,
+        rasterized=rasterize)
+    scaffold['Artists'] += lines + [real_points, imag_points]
+    return lines
+
+
+def drude_permittivity_plot(frequency_THz,
+                            drude_permittivity_real,
+                            drude_permittivity_imag,
+                            real_color,
+                            imag_color,
+                            real_label,
+                            imaginary_label,
+                            frequency_points,
+                            frequency_errors,
+                            real_permittivity_points,
+                            real_permittivity_errors,
+                            imag_permittivity_points,
+                            imag_permittivity_errors,
+                            frequency_ticks,
+                            out_path,
+                            profile='Default',
+                            scaffold=None):
+    '''
+    Plot one batch's Drude curves and measured points. Pass a scaffold to
+    reuse the same figure and axes across plots, otherwise a figure is built
+    and closed for this plot.
+    Args:
+        frequency_THz: <array> frequency array in THz
+        drude_permittivity_real: <array> real Drude curve
+        drude_permittivity_imag: <array> imaginary Drude curve
+        real_color: <string> real curve colour
+        imag_color: <string> imaginary curve colour
+        real_label: <string> real curve legend label
+        imaginary_label: <string> imaginary curve legend label
+        frequency_points: <array> measured frequencies in THz
+        frequency_errors: <array> measured frequency errors in THz
+        real_permittivity_points: <array> measured real permittivities
+        real_permittivity_errors: <array> measured real permittivity errors
+        imag_permittivity_points: <array> measured imaginary permittivities
+        imag_permittivity_errors: <array> measured imaginary errors
+        frequency_ticks: <array> desired frequency tick values
+        out_path: <string> path to save
+        profile: <string> render profile name, ignored with a scaffold
+        scaffold: <dict> reusable figure scaffold (permittivity_scaffold)
+    Returns:
+        out_paths: <array> paths of saved files
+    '''
+    owned = scaffold is None
+    if owned:
+        scaffold = permittivity_scaffold(
+            frequency_ticks=frequency_ticks,
+            profile=profile)
+    else:
+        clear_scaffold(scaffold=scaffold)
+    lines = add_permittivity_data(
+        scaffold=scaffold,
+        frequency_THz=frequency_THz,
+        drude_permittivity_real=drude_permittivity_real,
+        drude_permittivity_imag=drude_permittivity_imag,
+        real_color=real_color,
+        imag_color=imag_color,
+        real_label=real_label,
+        imaginary_label=imaginary_label,
+        frequency_points=frequency_points,
+        real_permittivity_points=real_permittivity_points,
+        real_permittivity_errors=real_permittivity_errors,
+        imag_permittivity_points=imag_permittivity_points,
+        imag_permittivity_errors=imag_permittivity_errors)
+
+    ''' Get Lines and Labels '''
+    scaffold['Real Axis'].legend(
+        lines,
+        [line.get_label() for line in lines],
+        frameon=True,
+        loc='lower left',
+        ncol=1,
+        prop={'size': 22})
+    scaffold['Real Axis'].yaxis.label.set_color(real_color)
+    scaffold['Imaginary Axis'].yaxis.label.set_color(imag_color)
+
     ''' Save '''
-    fig.tight_layout()
-    plt.savefig(out_path)
-    fig.clf()
-    plt.cla()
-    plt.close(fig)
\ No newline at end of file
+    out_paths = save_figure(
+        fig=scaffold['Figure'],
+        out_path=out_path,
+        profile=scaffold['Profile'])
+    if owned:
+        close_scaffold(scaffold=scaffold)
+    return out_paths
+
+
+def overlay_styles(count):
+    '''
+    Automatic real/imaginary colour pairs for any number of batches. Up to ten
+    batches use the paired tab20 colours (dark real, light imaginary), larger
+    overlays sample a continuous colour map.
+    Args:
+        count: <int> number of batches
+    Returns:
+        styles: <array> (real colour, imaginary colour) tuples
+    '''
+    if count <= 10:
+        colors = plt.get_cmap('tab20').colors
+        return [(colors[2 * i], colors[2 * i + 1]) for i in range(count)]
+    colormap = plt.get_cmap('turbo')
+    return [
+        (colormap(i / (count - 1)), colormap(i / (count - 1)))
+        for i in range(count)]
+
+
+def drude_overlay_plot(frequency_THz,
+                       curves,
+                       frequency_ticks,
+                       out_path,
+                       profile='Default',
+                       scaffold=None):
+    '''
+    Overlay the Drude permittivity curves and measured points of several
+    batches on a single twin-axis frequency/wavelength figure. The figure is
+    built once and each batch only adds its lines and error bars.
+    Args:
+        frequency_THz: <array> frequency array in THz shared by all curves
+        curves: <array> batch dictionaries containing
+            Label: <string> batch label
+            Real Drude Permittivity: <array> real curve
+            Imaginary Drude Permittivity: <array> imaginary curve
+            Frequency Points: <array> measured frequencies in THz
+            Real Permittivity, Real Permittivity Error: <array>
+            Imaginary Permittivity, Imaginary Permittivity Error: <array>
+            Real Color, Imaginary Color: <string> optional, automatic if unset
+            Real Label, Imaginary Label: <string> optional legend labels
+        frequency_ticks: <array> desired frequency tick values
+        out_path: <string> path to save
+        profile: <string> render profile name, ignored with a scaffold
+        scaffold: <dict> reusable figure scaffold (permittivity_scaffold)
+    Returns:
+        out_paths: <array> paths of saved files
+    '''
+    owned = scaffold is None
+    if owned:
+        scaffold = permittivity_scaffold(
+            frequency_ticks=frequency_ticks,
+            profile=profile)
+    else:
+        clear_scaffold(scaffold=scaffold)
+
+    ''' Plot Each Batch '''
+    lines = []
+    styles = overlay_styles(count=len(curves))
+    for curve, (real_color, imag_color) in zip(curves, styles):
+        lines += add_permittivity_data(
+            scaffold=scaffold,
+            frequency_THz=frequency_THz,
+            drude_permittivity_real=curve['Real Drude Permittivity'],
+            drude_permittivity_imag=curve['Imaginary Drude Permittivity'],
+            real_color=curve.get('Real Color', real_color),
+            imag_color=curve.get('Imaginary Color', imag_color),
+            real_label=curve.get(
+                'Real Label', rf'$\epsilon_r$ {curve["Label"]}'),
+            imaginary_label=curve.get(
+                'Imaginary Label', rf'$\epsilon_i$ {curve["Label"]}'),
+            frequency_points=curve['Frequency Points'],
+            real_permittivity_points=curve['Real Permittivity'],
+            real_permittivity_errors=curve['Real Permittivity Error'],
+            imag_permittivity_points=curve['Imaginary Permittivity'],
+            imag_permittivity_errors=curve['Imaginary Permittivity Error'],
+            line_width=3,
+            marker_size=10,
+            imag_linestyle='-.')
+
+    ''' Get Lines and Labels '''
+    scaffold['Real Axis'].legend(
+        lines,
+        [line.get_label() for line in lines],
+        frameon=True,
+        loc='lower left',
+        ncol=max(1, (len(lines) + 7) // 8),
+        prop={'size': 14 if len(lines) <= 8 else 10})
+    scaffold['Real Axis'].yaxis.label.set_color('black')
+    scaffold['Imaginary Axis'].yaxis.label.set_color('black')
+
+    ''' Save '''
+    out_paths = save_figure(
+        fig=scaffold['Figure'],
+        out_path=out_path,
+        profile=scaffold['Profile'])
+    if owned:
+        close_scaffold(scaffold=scaffold)
+    return out_paths
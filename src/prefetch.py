@@ -0,0 +1,95 @@
+import os
+import src.fileIO as io
+import src.metrics as metrics
+import src.filepaths as fp
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_batch_inputs(batch,
+                      entries,
+                      S4_index):
+    '''
+    Load and parse the measurement files for one batch: the 4PP sheet
+    resistances and the matching S4 measurement file.
+    Args:
+        batch: <string> batch name (primary string)
+        entries: <array> 4PP catalogue entries for the batch
+        S4_index: <dict> indexed S4 catalogue (filepaths.index_catalogue)
+    Returns:
+        batch_inputs: <dict> sheet resistances, S4 file, S4 parameters and S4
+                        measurements (empty when no S4 file found)
+    '''
+    sheet_resistances = io.load_sheet_resistance(
+        file_path=entries[0]['File Path'])
+    S4_file, S4_parameters = fp.catalogue_S4_measurement(
+        S4_index=S4_index,
+        batch_name=batch)
+    bytes_read = entries[0]['Size']
+    if len(S4_file) == 0:
+        S4_measurements = {}
+    else:
+        S4_measurements = io.get_S4_measurements(file_path=S4_file[0])
+        bytes_read += os.path.getsize(S4_file[0])
+    metrics.registry.increment(
+        name='drude_input_bytes_total',
+        amount=bytes_read)
+    return {
+        'Batch': batch,
+        'Sheet Resistances': sheet_resistances,
+        'S4 File': S4_file,
+        'S4 Parameters': S4_parameters,
+        'S4 Measurements': S4_measurements}
+
+
+def prefetch_batches(batches,
+                     S4_index,
+                     depth=2,
+                     workers=None):
+    '''
+    Load upcoming batches on a thread pool while the caller fits and plots the
+    current one. At most depth batches are loaded ahead of the consumer, which
+    caps memory, and batches are yielded in order. A batch whose files fail
+    to load is yielded with the exception under "Load Error", so the caller
+    can fail that batch and carry on with the rest.
+    Args:
+        batches: <iterable> (batch name, catalogue entries) pairs, may be lazy
+        S4_index: <dict> indexed S4 catalogue (filepaths.index_catalogue)
+        depth: <int> number of batches to load ahead
+        workers: <int> loader threads, defaults to depth
+    Returns:
+        batch_inputs: <generator> (batch name, entries, batch inputs)
+    '''
+    depth = max(int(depth), 1)
+    batches = iter(batches)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=workers or depth)
+
+    def submit_next():
+        for batch, entries in batches:
+            pending.append((
+                batch,
+                entries,
+                executor.submit(
+                    load_batch_inputs,
+                    batch=batch,
+                    entries=entries,
+                    S4_index=S4_index)))
+            return
+
+    try:
+        for _ in range(depth):
+            submit_next()
+        while pending:
+            batch, entries, future = pending.popleft()
+            submit_next()
+            try:
+                batch_inputs = future.result()
+            except Exception as error:
+                batch_inputs = {'Batch': batch, 'Load Error': error}
+            yield batch, entries, batch_inputs
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
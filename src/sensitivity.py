@@ -0,0 +1,141 @@
+import numpy as np
+import src.models as models
+
+
+PARAMETER_NAMES = models.DRUDE_NAMES
+
+
+def drude_jacobian(angular_frequency,
+                   parameters,
+                   normalise=False):
+    '''
+    Analytic derivatives of the real and imaginary Drude permittivity with
+    respect to carrier density, effective mass, epsilon infinity and
+    relaxation time, over a whole frequency grid for one or many parameter
+    sets at once, from the registered Drude model gradient
+    (models.drude_gradient).
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        parameters: <array> (..., 4) carrier density, effective mass, epsilon
+                    infinity and relaxation time (Imaginary Results order)
+        normalise: <bool> return theta d(eps)/d(theta), the permittivity
+                    change per fractional parameter change
+    Returns:
+        jacobian: <dict> (..., W, 4) real and imaginary jacobians
+    '''
+    gradient = models.drude_gradient(
+        angular_frequency=angular_frequency,
+        parameters=parameters)
+    real_jacobian = gradient.real
+    imag_jacobian = gradient.imag
+    parameters = np.asarray(parameters, dtype=float)[..., np.newaxis, :]
+    if normalise:
+        real_jacobian = real_jacobian * parameters
+        imag_jacobian = imag_jacobian * parameters
+    return {
+        'Real Jacobian': real_jacobian,
+        'Imaginary Jacobian': imag_jacobian}
+
+
+def padded_covariance(covariance,
+                      size=4):
+    '''
+    Embed a fit covariance in the full parameter covariance, with zeros for
+    parameters the fit did not vary (relaxation time for the real fit).
+    Args:
+        covariance: <array> (..., P, P) fit covariance, P <= size
+        size: <int> number of Drude parameters
+    Returns:
+        covariance: <array> (..., size, size) covariance
+    '''
+    covariance = np.asarray(covariance, dtype=float)
+    count = covariance.shape[-1]
+    padded = np.zeros(covariance.shape[:-2] + (size, size))
+    padded[..., :count, :count] = covariance
+    return padded
+
+
+def confidence_band(jacobian,
+                    covariance,
+                    coverage_factor=1.0):
+    '''
+    Frequency resolved permittivity uncertainty from linear error propagation,
+    sqrt(diag(J C J^T)), evaluated without forming the (W, W) matrix.
+    Args:
+        jacobian: <array> (..., W, 4) jacobian from drude_jacobian
+        covariance: <array> (..., 4, 4) parameter covariance
+        coverage_factor: <float> multiple of the standard deviation, e.g. 1.96
+                        for a 95% band
+    Returns:
+        band: <array> (..., W) half width of the band
+    '''
+    variance = np.einsum(
+        '...wi,...ij,...wj->...w',
+        jacobian,
+        np.asarray(covariance, dtype=float),
+        jacobian)
+    return coverage_factor * np.sqrt(np.clip(variance, 0, None))
+
+
+def permittivity_sensitivity(angular_frequency,
+                             real_results,
+                             imag_results,
+                             real_covariance=None,
+                             imag_covariance=None,
+                             coverage_factor=1.0,
+                             normalise=False):
+    '''
+    Sensitivity of the fitted permittivity of a batch to each Drude parameter,
+    and optionally the confidence bands from the fit covariances. The real
+    curve uses the real fit parameters and covariance, the imaginary curve the
+    imaginary fit parameters and covariance, as in the batch plots.
+    Args:
+        angular_frequency: <array> (W,) angular frequency grid
+        real_results: <array> (..., 3) real fit results (Real Results)
+        imag_results: <array> (..., 4) imaginary fit results
+        real_covariance: <array> (..., 3, 3) real fit covariance, optional
+        imag_covariance: <array> (..., 4, 4) imaginary fit covariance, optional
+        coverage_factor: <float> multiple of the standard deviation for bands
+        normalise: <bool> return theta d(eps)/d(theta)
+    Returns:
+        sensitivity: <dict> (..., W, 4) real and imaginary sensitivities, and
+                    (..., W) real and imaginary bands if covariances are given
+    '''
+    real_results = np.asarray(real_results, dtype=float)
+    imag_results = np.asarray(imag_results, dtype=float)
+    real_parameters = np.concatenate(
+        [real_results, imag_results[..., 3:]], axis=-1)
+    real_jacobian = drude_jacobian(
+        angular_frequency=angular_frequency,
+        parameters=real_parameters,
+        normalise=True)['Real Jacobian']
+    imag_jacobian = drude_jacobian(
+        angular_frequency=angular_frequency,
+        parameters=imag_results,
+        normalise=True)['Imaginary Jacobian']
+    sensitivity = {'Parameter Names': PARAMETER_NAMES}
+    if normalise:
+        sensitivity['Real Sensitivity'] = real_jacobian
+        sensitivity['Imaginary Sensitivity'] = imag_jacobian
+    else:
+        sensitivity['Real Sensitivity'] = (
+            real_jacobian / real_parameters[..., np.newaxis, :])
+        sensitivity['Imaginary Sensitivity'] = (
+            imag_jacobian / imag_results[..., np.newaxis, :])
+
+    ''' Bands in relative parameters for conditioning, same J C J^T '''
+    if real_covariance is not None:
+        sensitivity['Real Band'] = confidence_band(
+            jacobian=real_jacobian,
+            covariance=(
+                padded_covariance(covariance=real_covariance)
+                / np.einsum(
+                    '...i,...j->...ij', real_parameters, real_parameters)),
+            coverage_factor=coverage_factor)
+    if imag_covariance is not None:
+        sensitivity['Imaginary Band'] = confidence_band(
+            jacobian=imag_jacobian,
+            covariance=np.asarray(imag_covariance, dtype=float) / np.einsum(
+                '...i,...j->...ij', imag_results, imag_results),
+            coverage_factor=coverage_factor)
+    return sensitivity
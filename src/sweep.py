@@ -0,0 +1,171 @@
+import os
+import numpy as np
+import src.kernels as kernels
+
+from pathlib import Path
+from src.fileIO import is_valid_json, load_json, save_json_dicts
+
+
+PRECISIONS = {
+    'float32': np.complex64,
+    'float64': np.complex128}
+
+
+def sweep_dtype(precision):
+    '''
+    Complex array type of a sweep precision.
+    Args:
+        precision: <string> "float32" or "float64", the precision of the real
+                    and imaginary parts
+    Returns:
+        dtype: <numpy.dtype> complex array type
+    '''
+    if precision not in PRECISIONS.keys():
+        raise ValueError(f'Unknown sweep precision "{precision}"')
+    return np.dtype(PRECISIONS[precision])
+
+
+def chunk_rows(effective_masses,
+               angular_frequencies,
+               chunk_memory=64):
+    '''
+    Carrier densities evaluated per chunk so the complex128 working arrays of
+    a chunk stay within chunk_memory.
+    Args:
+        effective_masses: <int> number of effective masses in the sweep
+        angular_frequencies: <int> number of angular frequencies in the sweep
+        chunk_memory: <float> working memory per chunk in MB
+    Returns:
+        rows: <int> carrier densities per chunk
+    '''
+    row_bytes = 3 * 16 * effective_masses * angular_frequencies
+    return max(int(chunk_memory * 1E6 // row_bytes), 1)
+
+
+def drude_sweep(out_path,
+                carrier_densities,
+                angular_frequencies,
+                effective_masses,
+                epsilon_infinity,
+                relaxation_time,
+                mode='Approximate',
+                precision='float32',
+                chunk_memory=64):
+    '''
+    Evaluate complex Drude permittivity over a carrier density x effective mass
+    x angular frequency grid straight into a .npy file on disk, a chunk of
+    carrier densities at a time, so sweeps larger than memory run with
+    bounded memory. A json file alongside records the sweep and the number of
+    chunks completed; it is rewritten atomically after each chunk is flushed,
+    so an interrupted sweep resumes from the first incomplete chunk when
+    called again with the same sweep.
+    Args:
+        out_path: <string> path to .npy file
+        carrier_densities: <array> carrier densities in m^-3, shape (N,)
+        angular_frequencies: <array> angular frequencies in rad/s, shape (W,)
+        effective_masses: <array> effective mass multipliers, shape (M,)
+        epsilon_infinity: <float> high frequency permittivity
+        relaxation_time: <float> relaxation time of electrons
+        mode: <string> Drude form, "Full" or "Approximate"
+                (analysis.complex_drude_permittivity)
+        precision: <string> "float32" or "float64" (PRECISIONS)
+        chunk_memory: <float> working memory per chunk in MB
+    Returns:
+        sweep: <dict> sweep metadata and read-only memory-mapped permittivity,
+                shape (N, M, W) (load_sweep)
+    '''
+    out_path = Path(out_path).with_suffix('.npy')
+    metadata_path = out_path.with_suffix('.json')
+    carrier_densities = np.asarray(carrier_densities, dtype=float)
+    angular_frequencies = np.asarray(angular_frequencies, dtype=float)
+    effective_masses = np.asarray(effective_masses, dtype=float)
+    shape = (
+        carrier_densities.size,
+        effective_masses.size,
+        angular_frequencies.size)
+    metadata = {
+        'Carrier Densities': carrier_densities.tolist(),
+        'Effective Masses': effective_masses.tolist(),
+        'Angular Frequencies': angular_frequencies.tolist(),
+        'Epsilon Infinity': float(epsilon_infinity),
+        'Relaxation Time': float(relaxation_time),
+        'Drude Mode': mode,
+        'Precision': precision,
+        'Shape': list(shape)}
+    dtype = sweep_dtype(precision=precision)
+
+    if out_path.is_file() and is_valid_json(file_path=metadata_path):
+        previous = load_json(file_path=metadata_path)
+        if any(previous.get(key) != value for key, value in metadata.items()):
+            raise ValueError(
+                f'{out_path} holds a different sweep, remove it or choose '
+                f'another path')
+        metadata = previous
+    else:
+        rows = chunk_rows(
+            effective_masses=shape[1],
+            angular_frequencies=shape[2],
+            chunk_memory=chunk_memory)
+        header = np.lib.format.open_memmap(
+            out_path,
+            mode='w+',
+            dtype=dtype,
+            shape=shape)
+        metadata.update({
+            'Offset': header.offset,
+            'Chunk Size': rows,
+            'Chunks': -(-shape[0] // rows),
+            'Completed Chunks': 0})
+        del header
+        save_json_dicts(
+            out_path=metadata_path,
+            dictionary=metadata)
+
+    ''' Chunks are written through the file, not a mapping, so the pages of
+    finished chunks are not held in memory '''
+    rows = metadata['Chunk Size']
+    row_bytes = dtype.itemsize * shape[1] * shape[2]
+    with open(out_path, 'r+b') as file:
+        for chunk in range(metadata['Completed Chunks'], metadata['Chunks']):
+            start = chunk * rows
+            stop = min(start + rows, shape[0])
+            file.seek(metadata['Offset'] + start * row_bytes)
+            kernels.drude_grid(
+                angular_frequency=angular_frequencies,
+                carrier_densities=carrier_densities[start:stop],
+                effective_masses=effective_masses,
+                epsilon_infinity=epsilon_infinity,
+                relaxation_time=relaxation_time,
+                mode=mode,
+                dtype=dtype).tofile(file)
+            file.flush()
+            os.fsync(file.fileno())
+            metadata['Completed Chunks'] = chunk + 1
+            save_json_dicts(
+                out_path=metadata_path,
+                dictionary=metadata)
+    return load_sweep(file_path=out_path)
+
+
+def load_sweep(file_path,
+               mmap=True):
+    '''
+    Load a sweep written by drude_sweep. With mmap the permittivity is
+    memory-mapped read-only, so it is read back without copies and only the
+    pages used are loaded.
+    Args:
+        file_path: <string> path to .npy file
+        mmap: <bool> memory-map the permittivity
+    Returns:
+        sweep: <dict> sweep metadata with the axes as arrays, whether every
+                chunk was completed, and the permittivity, shape (N, M, W)
+    '''
+    file_path = Path(file_path)
+    sweep = load_json(file_path=file_path.with_suffix('.json'))
+    for key in ['Carrier Densities', 'Effective Masses', 'Angular Frequencies']:
+        sweep[key] = np.asarray(sweep[key])
+    sweep['Complete'] = sweep['Completed Chunks'] == sweep['Chunks']
+    sweep['Permittivity'] = np.load(
+        file_path.with_suffix('.npy'),
+        mmap_mode='r' if mmap else None)
+    return sweep
@@ -0,0 +1,263 @@
+import re
+import time
+import numpy as np
+import src.fileIO as io
+import src.metrics as metrics
+import src.filepaths as fp
+import src.models as models
+import src.database as database
+
+from pathlib import Path
+
+
+def timeseries_path(results_path,
+                    batch):
+    '''
+    Path to a sample's time series file in the results directory.
+    Args:
+        results_path: <string> path to results directory
+        batch: <string> batch name (primary string)
+    Returns:
+        timeseries_path: <Path> path to json lines time series file
+    '''
+    return Path(f'{results_path}/{batch}_TimeSeries.jsonl')
+
+
+def condition_value(secondary_string):
+    '''
+    Time or condition value of a measurement from its secondary string, the
+    first number in the string (e.g. "30min" or "t2.5" give 30 and 2.5).
+    Args:
+        secondary_string: <string> secondary string of the measurement file
+    Returns:
+        value: <float> condition value, None if the string holds no number
+    '''
+    match = re.search(r'[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?', secondary_string)
+    return float(match.group()) if match else None
+
+
+def point_order(entry):
+    '''
+    Sort key placing a sample's measurements in time or condition order, with
+    non-numeric secondary strings after numeric ones in string order.
+    Args:
+        entry: <dict> 4PP catalogue entry
+    Returns:
+        key: <tuple> sort key
+    '''
+    value = condition_value(secondary_string=entry['Secondary String'])
+    return (
+        value is None,
+        0.0 if value is None else value,
+        entry['Secondary String'])
+
+
+def new_measurements(index,
+                     timeseries):
+    '''
+    Measurements not yet in their sample's time series, in time order within
+    each sample. A measurement file rewritten since it was processed counts as
+    new and is processed again.
+    Args:
+        index: <dict> indexed 4PP catalogue (filepaths.index_catalogue)
+        timeseries: <dict> batch name: time series records
+    Returns:
+        measurements: <array> (batch name, catalogue entry) pairs
+    '''
+    measurements = []
+    for batch, entries in index.items():
+        processed = {
+            (record['Secondary String'], record['Modified'])
+            for record in timeseries.get(batch, [])}
+        measurements.extend(
+            (batch, entry)
+            for entry in sorted(entries, key=point_order)
+            if (entry['Secondary String'], entry['Modified']) not in processed)
+    return measurements
+
+
+def point_S4_file(S4_index,
+                  batch,
+                  secondary_string):
+    '''
+    S4 measurement for one point of a time series. An S4 file whose secondary
+    string starts with the 4PP secondary string (e.g. AA5_30min_grating_S4 for
+    AA5_30min) belongs to that point, otherwise the sample's first S4 file is
+    shared by every point.
+    Args:
+        S4_index: <dict> indexed S4 catalogue (filepaths.index_catalogue)
+        batch: <string> batch name (primary string)
+        secondary_string: <string> 4PP secondary string of the point
+    Returns:
+        S4_entry: <dict> S4 catalogue entry, None if the sample has none
+    '''
+    entries = (S4_index or {}).get(f'{batch}', [])
+    for entry in entries:
+        if entry['Secondary String'].split('_')[0] == secondary_string:
+            return entry
+    return entries[0] if entries else None
+
+
+def load_point_inputs(batch,
+                      entry,
+                      S4_index):
+    '''
+    Load and parse the measurement files for one point of a time series, in
+    the prefetch.load_batch_inputs format.
+    Args:
+        batch: <string> batch name (primary string)
+        entry: <dict> 4PP catalogue entry of the point
+        S4_index: <dict> indexed S4 catalogue (filepaths.index_catalogue)
+    Returns:
+        batch_inputs: <dict> sheet resistances, S4 file, S4 parameters and S4
+                        measurements (empty when no S4 file found)
+    '''
+    S4_entry = point_S4_file(
+        S4_index=S4_index,
+        batch=batch,
+        secondary_string=entry['Secondary String'])
+    bytes_read = entry['Size']
+    if S4_entry is None:
+        S4_file, S4_parameters, S4_measurements = [], {}, {}
+    else:
+        S4_file = [S4_entry['File Path']]
+        S4_parameters = fp.catalogue_sample_information(entry=S4_entry)
+        S4_measurements = io.get_S4_measurements(file_path=S4_file[0])
+        bytes_read += S4_entry['Size']
+    metrics.registry.increment(
+        name='drude_input_bytes_total',
+        amount=bytes_read)
+    return {
+        'Batch': batch,
+        'Sheet Resistances': io.load_sheet_resistance(
+            file_path=entry['File Path']),
+        'S4 File': S4_file,
+        'S4 Parameters': S4_parameters,
+        'S4 Measurements': S4_measurements}
+
+
+def warm_start_parameters(drude_parameters,
+                          record=None):
+    '''
+    Copy of drude_parameters with the guesses replaced by the results of the
+    previous point of the time series, clipped inside their bounds, so each
+    fit starts from its neighbour. Carrier density is measured per point and
+    is not warm started.
+    Args:
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        record: <dict> previous accepted time series record, None for the
+                first point
+    Returns:
+        drude_parameters: <dict> user input dictionary with warm start guesses
+    '''
+    if record is None:
+        return drude_parameters
+    fitted = record['Parameters']
+
+    def previous_result(name, bounds, guess):
+        for prefix in ['Model', 'Imaginary', 'Real']:
+            if f'{prefix} {name}' in fitted.keys():
+                return float(np.clip(
+                    fitted[f'{prefix} {name}'][0],
+                    bounds[0],
+                    bounds[1]))
+        return guess
+
+    warm_parameters = dict(drude_parameters)
+    warm_parameters['Guesses'] = [
+        previous_result(name=name, bounds=bounds, guess=guess)
+        for name, guess, bounds in zip(
+            drude_parameters['Names'],
+            drude_parameters['Guesses'],
+            drude_parameters['Bounds'])]
+    warm_parameters['Lorentz Oscillators'] = [
+        dict(
+            oscillator,
+            Guesses=[
+                previous_result(
+                    name=f'Oscillator {index + 1} {name}',
+                    bounds=bounds,
+                    guess=guess)
+                for name, guess, bounds in zip(
+                    models.LORENTZ_NAMES,
+                    oscillator['Guesses'],
+                    oscillator['Bounds'])])
+        for index, oscillator in enumerate(
+            drude_parameters.get('Lorentz Oscillators', []))]
+    return warm_parameters
+
+
+def last_accepted(records):
+    '''
+    Latest time series record whose fit passed the fit gates.
+    Args:
+        records: <array> time series records
+    Returns:
+        record: <dict> latest accepted record, None if there is none
+    '''
+    for record in reversed(records):
+        if record.get('Parameters') and not record['Fit Gate Failures']:
+            return record
+    return None
+
+
+def timeseries_record(entry,
+                      batch_dictionary):
+    '''
+    One time series record: the point's measurement file, its time or
+    condition value, and the queryable scalar results of its fit.
+    Args:
+        entry: <dict> 4PP catalogue entry of the point
+        batch_dictionary: <dict> batch results dictionary of the point
+    Returns:
+        record: <dict> time series record
+    '''
+    return {
+        'Secondary String': entry['Secondary String'],
+        'Condition': condition_value(
+            secondary_string=entry['Secondary String']),
+        'File Path': f'{entry["File Path"]}',
+        'Modified': entry['Modified'],
+        'Processed': time.time(),
+        'Fit Gate Failures': batch_dictionary.get('Fit Gate Failures', []),
+        'Parameters': {
+            name: list(value) for name, value
+            in database.batch_parameters(dictionary=batch_dictionary).items()}}
+
+
+def failed_record(entry,
+                  error):
+    '''
+    Time series record of a point that could not be loaded or fitted. It
+    marks the measurement file as processed, so it is retried only once the
+    file is rewritten, and has no parameters, so it is never warm started
+    from.
+    Args:
+        entry: <dict> 4PP catalogue entry of the point
+        error: <string> description of the failure
+    Returns:
+        record: <dict> time series record
+    '''
+    return {
+        'Secondary String': entry['Secondary String'],
+        'Condition': condition_value(
+            secondary_string=entry['Secondary String']),
+        'File Path': f'{entry["File Path"]}',
+        'Modified': entry['Modified'],
+        'Processed': time.time(),
+        'Fit Gate Failures': [],
+        'Parameters': {},
+        'Error': error}
+
+
+def latest_points(records):
+    '''
+    Current time series of a sample from its append-only records: the latest
+    record of every measurement, in time or condition order.
+    Args:
+        records: <array> time series records (fileIO.load_json_lines)
+    Returns:
+        records: <array> latest record per secondary string
+    '''
+    latest = {record['Secondary String']: record for record in records}
+    return sorted(latest.values(), key=point_order)
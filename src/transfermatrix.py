@@ -0,0 +1,236 @@
+import numpy as np
+import src.models as models
+import src.analysis as anal
+
+
+def wavelengths_to_angularfrequencies(wavelengths):
+    '''
+    Convert wavelengths to angular frequencies.
+    Args:
+        wavelengths: <array> wavelengths in nm
+    Returns:
+        angular_frequencies: <array> angular frequencies in rad/s
+    '''
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    return 2 * np.pi * anal.wavelength_or_frequency(
+        wavelength_or_frequency=wavelengths * 1E-9)
+
+
+def normal_components(permittivity,
+                      incident_permittivity,
+                      angles):
+    '''
+    Normal component of the complex refractive index, n cos(theta), in a layer
+    for light incident at angles from the incident medium. The branch is chosen
+    so that fields decay into absorbing or evanescent layers.
+    Args:
+        permittivity: <array> layer complex permittivity, shape (..., W)
+        incident_permittivity: <float> incident medium permittivity (lossless)
+        angles: <array> incident angles in radians, shape (A, 1)
+    Returns:
+        normal_component: <array> n cos(theta), shape (..., A, W)
+    '''
+    permittivity = np.asarray(permittivity, dtype=complex)
+    if permittivity.ndim > 0:
+        permittivity = permittivity[..., np.newaxis, :]
+    tangential_sq = incident_permittivity * np.sin(angles) ** 2
+    normal_component = np.sqrt(permittivity - tangential_sq)
+    return np.where(
+        normal_component.imag < 0,
+        -normal_component,
+        normal_component)
+
+
+def optical_admittances(permittivity,
+                        normal_component,
+                        polarisation):
+    '''
+    Tilted optical admittance of a layer for TE (s) or TM (p) polarisation.
+    Args:
+        permittivity: <array> layer complex permittivity, shape (..., W)
+        normal_component: <array> n cos(theta), shape (..., A, W)
+        polarisation: <string> "TE" or "TM"
+    Returns:
+        admittance: <array> tilted admittance, shape (..., A, W)
+    '''
+    if polarisation == 'TE':
+        return normal_component
+    elif polarisation == 'TM':
+        permittivity = np.asarray(permittivity, dtype=complex)
+        if permittivity.ndim > 0:
+            permittivity = permittivity[..., np.newaxis, :]
+        return permittivity / normal_component
+    raise ValueError(f'Unknown polarisation "{polarisation}"')
+
+
+def characteristic_matrices(phase_thickness,
+                            admittance):
+    '''
+    Stack of 2x2 characteristic matrices for one layer over every angle and
+    wavelength (exp(-iwt) convention, n + ik).
+    Args:
+        phase_thickness: <array> 2 pi n cos(theta) d / wavelength
+        admittance: <array> tilted optical admittance of the layer
+    Returns:
+        matrices: <array> characteristic matrices, shape (..., 2, 2)
+    '''
+    cos_phase = np.cos(phase_thickness)
+    sin_phase = np.sin(phase_thickness)
+    matrices = np.empty(np.shape(phase_thickness) + (2, 2), dtype=complex)
+    matrices[..., 0, 0] = cos_phase
+    matrices[..., 0, 1] = -1j * sin_phase / admittance
+    matrices[..., 1, 0] = -1j * admittance * sin_phase
+    matrices[..., 1, 1] = cos_phase
+    return matrices
+
+
+def polarised_response(wavelengths,
+                       angles,
+                       layers,
+                       incident_permittivity,
+                       substrate_permittivity,
+                       polarisation):
+    '''
+    Reflectance, transmittance, and absorption of a thin-film stack for a
+    single polarisation. Each layer contributes one batched matrix product
+    over all angles, wavelengths and any leading (e.g. bias) axes.
+    Args:
+        wavelengths: <array> wavelengths in nm, shape (W,)
+        angles: <array> incident angles in radians, shape (A, 1)
+        layers: <array> layer dictionaries (see stack_response)
+        incident_permittivity: <float> incident medium permittivity
+        substrate_permittivity: <array> exit medium permittivity
+        polarisation: <string> "TE" or "TM"
+    Returns:
+        response: <dict> reflectance, transmittance, absorption
+    '''
+    incident_component = normal_components(
+        permittivity=incident_permittivity,
+        incident_permittivity=incident_permittivity,
+        angles=angles)
+    incident_admittance = optical_admittances(
+        permittivity=incident_permittivity,
+        normal_component=incident_component,
+        polarisation=polarisation)
+    substrate_component = normal_components(
+        permittivity=substrate_permittivity,
+        incident_permittivity=incident_permittivity,
+        angles=angles)
+    substrate_admittance = optical_admittances(
+        permittivity=substrate_permittivity,
+        normal_component=substrate_component,
+        polarisation=polarisation)
+    system = np.eye(2, dtype=complex)
+    for layer in layers:
+        normal_component = normal_components(
+            permittivity=layer['Permittivity'],
+            incident_permittivity=incident_permittivity,
+            angles=angles)
+        admittance = optical_admittances(
+            permittivity=layer['Permittivity'],
+            normal_component=normal_component,
+            polarisation=polarisation)
+        phase_thickness = (
+            2 * np.pi * normal_component * layer['Thickness'] / wavelengths)
+        system = system @ characteristic_matrices(
+            phase_thickness=phase_thickness,
+            admittance=admittance)
+    system = np.broadcast_to(
+        system,
+        np.broadcast_shapes(
+            np.shape(system)[:-2],
+            np.shape(substrate_admittance)) + (2, 2))
+    electric = system[..., 0, 0] + system[..., 0, 1] * substrate_admittance
+    magnetic = system[..., 1, 0] + system[..., 1, 1] * substrate_admittance
+    denominator = incident_admittance * electric + magnetic
+    reflection = (incident_admittance * electric - magnetic) / denominator
+    reflectance = np.abs(reflection) ** 2
+    transmittance = (
+        4 * incident_admittance.real * substrate_admittance.real
+        / np.abs(denominator) ** 2)
+    return {
+        'Reflectance': reflectance,
+        'Transmittance': transmittance,
+        'Absorption': 1 - reflectance - transmittance}
+
+
+def stack_response(wavelengths,
+                   angles,
+                   layers,
+                   incident_permittivity=1.0,
+                   substrate_permittivity=1.0,
+                   polarisation='TE'):
+    '''
+    Transfer-matrix reflectance, transmittance, and absorption of a user
+    defined thin-film stack, e.g. substrate/TCO/dielectric/metal. Layers are
+    listed in the order light meets them, between a semi-infinite incident
+    medium and a semi-infinite substrate (exit medium). Layer permittivities
+    may be scalars or arrays of shape (..., W); any leading axes (bias states,
+    parameter sets) are broadcast through the calculation.
+    Args:
+        wavelengths: <array> wavelengths in nm, shape (W,)
+        angles: <array> incident angles in degrees, shape (A,)
+        layers: <array> layer dictionaries
+            Thickness: <float> layer thickness in nm
+            Permittivity: <array> complex permittivity, scalar or (..., W)
+        incident_permittivity: <float> incident medium permittivity (lossless)
+        substrate_permittivity: <array> substrate complex permittivity
+        polarisation: <string> "TE", "TM", or "Average" (unpolarised)
+    Returns:
+        response: <dict> reflectance, transmittance, absorption arrays of shape
+                    (..., A, W)
+    '''
+    wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype=float))
+    angles = np.radians(
+        np.atleast_1d(np.asarray(angles, dtype=float)))[:, np.newaxis]
+    incident_permittivity = float(np.real(incident_permittivity))
+    if polarisation == 'Average':
+        responses = [
+            polarised_response(
+                wavelengths=wavelengths,
+                angles=angles,
+                layers=layers,
+                incident_permittivity=incident_permittivity,
+                substrate_permittivity=substrate_permittivity,
+                polarisation=mode)
+            for mode in ['TE', 'TM']]
+        return {
+            key: (responses[0][key] + responses[1][key]) / 2
+            for key in responses[0].keys()}
+    return polarised_response(
+        wavelengths=wavelengths,
+        angles=angles,
+        layers=layers,
+        incident_permittivity=incident_permittivity,
+        substrate_permittivity=substrate_permittivity,
+        polarisation=polarisation)
+
+
+def build_stack_layers(stack_parameters,
+                       angular_frequency,
+                       results_dictionary):
+    '''
+    Build transfer-matrix layers from the stack parameters dictionary
+    (Stack_parameters.json). Layers with "Material": "Drude" take the fitted
+    permittivity of the current batch, whichever dispersion model it was
+    fitted with, others a fixed [real, imaginary] permittivity.
+    Args:
+        stack_parameters: <dict> user stack dictionary (Stack_parameters.json)
+        angular_frequency: <array> angular frequencies in rad/s
+        results_dictionary: <dict> fitted batch results dictionary
+    Returns:
+        layers: <array> layer dictionaries for stack_response
+    '''
+    layers = []
+    for layer in stack_parameters['Layers']:
+        if layer.get('Material') == 'Drude':
+            permittivity = models.results_permittivity(
+                angular_frequency=angular_frequency,
+                results_dictionary=results_dictionary)
+        else:
+            permittivity = complex(*layer['Permittivity'])
+        layers.append({
+            'Name': layer['Name'],
+            'Thickness': layer['Thickness'],
+            'Permittivity': permittivity})
+    return layers
@@ -0,0 +1,359 @@
+import os
+import multiprocessing
+import numpy as np
+import src.analysis as anal
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+PARAMETER_NAMES = [
+    'Carrier Density',
+    'Effective Mass',
+    'Epsilon Infinity',
+    'Relaxation Time',
+    'Plasma Frequency',
+    'ENZ Wavelength']
+
+
+def draw_measurements(S4_measurements,
+                      carrier_density,
+                      samples,
+                      method='Monte Carlo',
+                      seed=None):
+    '''
+    Draw resampled datasets from the measured S4 values and carrier density.
+    "Monte Carlo" perturbs every refractive index, extinction coefficient,
+    peak wavelength and the carrier density with normal noise of the measured
+    errors. "Bootstrap" keeps the measured values and resamples the grating
+    points with replacement, returned as per-point weights.
+    Args:
+        S4_measurements: <dict> S4 measurements (fileIO.get_S4_measurements)
+        carrier_density: <dict> carrier density in m^-3, with errors
+        samples: <int> number of resampled datasets
+        method: <string> "Monte Carlo" or "Bootstrap"
+        seed: <int> random seed, None for a fresh seed
+    Returns:
+        draws: <dict> (samples, points) arrays of refractive index, extinction
+                coefficient, peak wavelength and weights, and (samples,)
+                carrier densities
+    '''
+    rng = np.random.default_rng(seed)
+    names = ['Refractive Index', 'Extinction Coefficient', 'Peak Wavelength']
+    values = {
+        name: np.asarray(S4_measurements[name], dtype=float)
+        for name in names}
+    points = values['Peak Wavelength'].size
+    density = carrier_density['Carrier Density']
+    if method == 'Monte Carlo':
+        draws = {
+            name: rng.normal(
+                loc=values[name],
+                scale=np.abs(np.asarray(
+                    S4_measurements[f'{name} Error'], dtype=float)),
+                size=(samples, points))
+            for name in names}
+        draws['Carrier Density'] = np.abs(rng.normal(
+            loc=density,
+            scale=abs(carrier_density['Carrier Error']),
+            size=samples))
+        draws['Weights'] = np.ones((samples, points))
+    elif method == 'Bootstrap':
+        draws = {
+            name: np.broadcast_to(values[name], (samples, points))
+            for name in names}
+        draws['Carrier Density'] = np.full(samples, density)
+        draws['Weights'] = rng.multinomial(
+            n=points,
+            pvals=np.full(points, 1 / points),
+            size=samples).astype(float)
+    else:
+        raise ValueError(f'Unknown resampling method "{method}"')
+    return draws
+
+
+def drawn_permittivities(draws):
+    '''
+    Permittivities and angular frequencies of every resampled dataset.
+    Args:
+        draws: <dict> resampled datasets from draw_measurements
+    Returns:
+        permittivities: <dict> (samples, points) real permittivity, imaginary
+                        permittivity and angular frequency arrays
+    '''
+    n = draws['Refractive Index']
+    k = draws['Extinction Coefficient']
+    return {
+        'Real Permittivity': n ** 2 - k ** 2,
+        'Imaginary Permittivity': 2 * n * k,
+        'Angular Frequency': 2 * np.pi * anal.wavelength_or_frequency(
+            wavelength_or_frequency=draws['Peak Wavelength'] * 1E-9)}
+
+
+def derived_parameters(carrier_density,
+                       effective_mass):
+    '''
+    Plasma frequency and epsilon-near-zero wavelength. The real Drude
+    permittivity crosses zero at the plasma frequency.
+    Args:
+        carrier_density: <array> carrier density in m^-3
+        effective_mass: <array> effective mass material multiplier
+    Returns:
+        derived: <dict> plasma frequency in rad/s and ENZ wavelength in nm
+    '''
+    plasma_frequency = anal.plasmafrequency(
+        carrier_density=carrier_density,
+        effective_mass=effective_mass)
+    return {
+        'Plasma Frequency': plasma_frequency,
+        'ENZ Wavelength': anal.wavelength_or_frequency(
+            wavelength_or_frequency=plasma_frequency / (2 * np.pi)) * 1E9}
+
+
+def linearised_fits(draws,
+                    permittivity):
+    '''
+    Weighted least squares Drude fits of every resampled dataset at once. The
+    real model eps_inf (1 - wp^2 / w^2) is linear in a = eps_inf and
+    b = eps_inf wp^2, and the imaginary model eps_inf wp^2 / (w tau) is linear
+    in b / tau, so each fit is a closed form solve of its normal equations.
+    Only carrier density over effective mass is identifiable from the optical
+    data, so the effective mass follows from the drawn carrier density.
+    Args:
+        draws: <dict> resampled datasets from draw_measurements
+        permittivity: <dict> measured permittivities with errors, the errors
+                    weight the fits as sigma does in the optimizer
+    Returns:
+        parameters: <dict> (samples,) arrays of each Drude parameter, NaN where
+                    a resample gives no physical solution
+    '''
+    drawn = drawn_permittivities(draws=draws)
+    omega = drawn['Angular Frequency']
+    u = 1 / omega ** 2
+    v = 1 / omega
+    real_weights = draws['Weights'] / np.asarray(
+        permittivity['Real Permittivity Error'], dtype=float) ** 2
+    imag_weights = draws['Weights'] / np.asarray(
+        permittivity['Imaginary Permittivity Error'], dtype=float) ** 2
+
+    ''' Real Fit: eps_r = a - b u '''
+    y = drawn['Real Permittivity']
+    s0 = np.sum(real_weights, axis=-1)
+    s1 = np.sum(real_weights * u, axis=-1)
+    s2 = np.sum(real_weights * u ** 2, axis=-1)
+    sy = np.sum(real_weights * y, axis=-1)
+    suy = np.sum(real_weights * u * y, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        determinant = s0 * s2 - s1 ** 2
+        a = (s2 * sy - s1 * suy) / determinant
+        b = -(s0 * suy - s1 * sy) / determinant
+
+        ''' Imaginary Fit: eps_i = (b / tau) v '''
+        d = (
+            np.sum(imag_weights * v * drawn['Imaginary Permittivity'], axis=-1)
+            / np.sum(imag_weights * v ** 2, axis=-1))
+        plasma_squared = b / a
+        effective_mass = (
+            draws['Carrier Density'] * (1.60217663E-19 ** 2)
+            / (8.854E-12 * 9.11E-31 * plasma_squared))
+        relaxation_time = b / d
+    valid = (
+        (determinant > 0) & (a > 0) & (b > 0) & (d > 0)
+        & np.isfinite(effective_mass))
+    parameters = {
+        'Carrier Density': draws['Carrier Density'],
+        'Effective Mass': effective_mass,
+        'Epsilon Infinity': a,
+        'Relaxation Time': relaxation_time}
+    parameters.update(derived_parameters(
+        carrier_density=parameters['Carrier Density'],
+        effective_mass=np.where(valid, effective_mass, np.nan)))
+    return {
+        name: np.where(valid, values, np.nan)
+        for name, values in parameters.items()}
+
+
+def refit_samples(draws,
+                  permittivity,
+                  carrier_error,
+                  drude_parameters):
+    '''
+    Refit resampled datasets with the same bounded optimizer fits as the
+    batch run. Resamples the optimizer cannot fit return NaN.
+    Args:
+        draws: <dict> resampled datasets from draw_measurements
+        permittivity: <dict> measured permittivities with errors
+        carrier_error: <float> carrier density error in m^-3
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+    Returns:
+        parameters: <array> (samples, 4) carrier density, effective mass,
+                    epsilon infinity and relaxation time
+    '''
+    drawn = drawn_permittivities(draws=draws)
+    samples = draws['Carrier Density'].size
+    parameters = np.full((samples, 4), np.nan)
+    for index in range(samples):
+        ''' Bootstrap weights become repeated points '''
+        repeats = draws['Weights'][index].astype(int)
+        omega = np.repeat(drawn['Angular Frequency'][index], repeats)
+        real_guesses_bounds = anal.get_real_guesses_bounds(
+            carrier_density={
+                'Carrier Density': draws['Carrier Density'][index],
+                'Carrier Error': carrier_error},
+            drude_parameters=drude_parameters)
+        try:
+            drude_real = anal.optimize_real_drude(
+                angular_frequency=omega,
+                real_permittivity=np.repeat(
+                    drawn['Real Permittivity'][index], repeats),
+                real_permittivity_error=np.repeat(
+                    permittivity['Real Permittivity Error'], repeats),
+                initial_guesses=real_guesses_bounds['Real Initial Guesses'],
+                bounds=real_guesses_bounds['Real Bounds'])
+            imag_guesses_bounds = anal.get_imag_guesses_bounds(
+                variables=drude_real['Real Results'],
+                errors=drude_real['Real Errors'],
+                drude_parameters=drude_parameters)
+            drude_imag = anal.optimize_imag_drude(
+                angular_frequency=omega,
+                imag_permittivity=np.repeat(
+                    drawn['Imaginary Permittivity'][index], repeats),
+                imag_permittivity_error=np.repeat(
+                    permittivity['Imaginary Permittivity Error'], repeats),
+                initial_guesses=imag_guesses_bounds[
+                    'Imaginary Initial Guesses'],
+                bounds=imag_guesses_bounds['Imaginary Bounds'])
+        except (RuntimeError, TypeError, ValueError):
+            continue
+        parameters[index] = drude_imag['Imaginary Results']
+    return parameters
+
+
+def pooled_refits(draws,
+                  permittivity,
+                  carrier_error,
+                  drude_parameters,
+                  workers=None):
+    '''
+    Refit resampled datasets across a process pool, in chunks so each worker
+    receives a slice of the draws rather than one task per resample. Workers
+    are spawned, not forked, as the prefetch threads may hold locks.
+    Args:
+        draws: <dict> resampled datasets from draw_measurements
+        permittivity: <dict> measured permittivities with errors
+        carrier_error: <float> carrier density error in m^-3
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        workers: <int> worker processes, defaults to the number of CPUs
+    Returns:
+        parameters: <dict> (samples,) arrays of each Drude parameter
+    '''
+    samples = draws['Carrier Density'].size
+    workers = workers or os.cpu_count() or 1
+    chunks = np.array_split(
+        np.arange(samples),
+        max(1, min(samples, 4 * workers)))
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(
+                refit_samples,
+                draws={name: values[chunk] for name, values in draws.items()},
+                permittivity=permittivity,
+                carrier_error=carrier_error,
+                drude_parameters=drude_parameters)
+            for chunk in chunks]
+        fitted = np.concatenate([future.result() for future in futures])
+    parameters = {
+        name: fitted[:, index]
+        for index, name in enumerate(PARAMETER_NAMES[:4])}
+    parameters.update(derived_parameters(
+        carrier_density=parameters['Carrier Density'],
+        effective_mass=parameters['Effective Mass']))
+    return parameters
+
+
+def percentile_intervals(parameters,
+                         percentiles=(2.5, 97.5)):
+    '''
+    Median and percentile interval of each resampled parameter, ignoring
+    resamples without a solution.
+    Args:
+        parameters: <dict> (samples,) arrays of each parameter
+        percentiles: <array> lower and upper percentiles of the interval
+    Returns:
+        intervals: <dict> "<name> Median", "<name> Lower", "<name> Upper"
+    '''
+    intervals = {}
+    for name, values in parameters.items():
+        if np.all(np.isnan(values)):
+            lower = median = upper = np.nan
+        else:
+            lower, median, upper = np.nanpercentile(
+                values,
+                [percentiles[0], 50, percentiles[1]])
+        intervals[f'{name} Median'] = float(median)
+        intervals[f'{name} Lower'] = float(lower)
+        intervals[f'{name} Upper'] = float(upper)
+    return intervals
+
+
+def drude_uncertainty(S4_measurements,
+                      permittivity,
+                      carrier_density,
+                      drude_parameters,
+                      samples=10000,
+                      method='Monte Carlo',
+                      fit='Linearised',
+                      percentiles=(2.5, 97.5),
+                      workers=None,
+                      seed=None):
+    '''
+    Resampled uncertainty of the Drude parameters and ENZ wavelength of one
+    batch. Intervals propagate the measured n, k, peak wavelength and carrier
+    density errors through the fit together rather than by quadrature.
+    Args:
+        S4_measurements: <dict> S4 measurements (fileIO.get_S4_measurements)
+        permittivity: <dict> measured permittivities with errors
+        carrier_density: <dict> carrier density in m^-3, with errors
+        drude_parameters: <dict> user input dictionary (Drude_parameters.json)
+        samples: <int> number of resampled datasets
+        method: <string> "Monte Carlo" or "Bootstrap" (draw_measurements)
+        fit: <string> "Linearised" closed form fits of all resamples at once,
+            or "Refit" bounded optimizer fits across a process pool
+        percentiles: <array> lower and upper percentiles of the intervals
+        workers: <int> worker processes for "Refit"
+        seed: <int> random seed, None for a fresh seed
+    Returns:
+        uncertainty: <dict> resampling settings, valid sample count and the
+                    median and interval of every parameter
+    '''
+    draws = draw_measurements(
+        S4_measurements=S4_measurements,
+        carrier_density=carrier_density,
+        samples=samples,
+        method=method,
+        seed=seed)
+    if fit == 'Linearised':
+        parameters = linearised_fits(
+            draws=draws,
+            permittivity=permittivity)
+    elif fit == 'Refit':
+        parameters = pooled_refits(
+            draws=draws,
+            permittivity=permittivity,
+            carrier_error=carrier_density['Carrier Error'],
+            drude_parameters=drude_parameters,
+            workers=workers)
+    else:
+        raise ValueError(f'Unknown uncertainty fit "{fit}"')
+    uncertainty = {
+        'Uncertainty Method': method,
+        'Uncertainty Fit': fit,
+        'Uncertainty Samples': samples,
+        'Uncertainty Valid Samples': int(np.sum(np.isfinite(
+            parameters['ENZ Wavelength']))),
+        'Uncertainty Percentiles': list(percentiles)}
+    uncertainty.update(percentile_intervals(
+        parameters=parameters,
+        percentiles=percentiles))
+    return uncertainty